@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Categoria, Ativo, Movimentacao, EvolucaoPatrimonial, Dividendo
+from .models import Categoria, Ativo, Instrumento, Movimentacao, EvolucaoPatrimonial, Dividendo
 from django.utils.html import format_html
 
 @admin.register(Categoria)
@@ -32,6 +32,13 @@ class AtivoAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(Instrumento)
+class InstrumentoAdmin(admin.ModelAdmin):
+    list_display = ['ticker', 'nome', 'moeda', 'bolsa', 'yahoo_symbol', 'categoria_sugerida', 'icone_url', 'dataAlteracao']
+    list_filter = ['moeda', 'bolsa']
+    search_fields = ['ticker', 'nome', 'yahoo_symbol']
+    ordering = ['ticker']
+
 @admin.register(Movimentacao)
 class MovimentacaoAdmin(admin.ModelAdmin):
     list_display = ['ativo', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa', 'custoTotal', 'dataCriacao', 'dataAlteracao']
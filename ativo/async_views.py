@@ -0,0 +1,84 @@
+# Async (ASGI) versions of the price-bound ativo actions. Plain Django views,
+# since DRF viewsets are sync-only; Yahoo calls are awaited instead of holding a worker.
+import asyncio
+import logging
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import JsonResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .models import Ativo
+from .serializers import AtivoSerializer, SnapshotSerializer
+from .services import acreate_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+def jwt_required(view):
+    """Authenticate an async view with the same JWT scheme as the REST API."""
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        try:
+            result = await sync_to_async(JWTAuthentication().authenticate)(request)
+        except AuthenticationFailed as e:
+            return JsonResponse({'detail': str(e.detail)}, status=401)
+        if result is None:
+            return JsonResponse({'detail': 'Authentication credentials were not provided.'}, status=401)
+        request.user = result[0]
+        return await view(request, *args, **kwargs)
+    return wrapper
+
+
+async def _get_user_ativo(request, pk):
+    return await Ativo.objects.select_related('categoria').filter(pk=pk, usuario=request.user).afirst()
+
+
+@sync_to_async
+def _serialize_ativos(ativos, many=False):
+    return AtivoSerializer(ativos, many=many).data
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def update_price(request, pk):
+    """Update the current price and value of an asset."""
+    ativo = await _get_user_ativo(request, pk)
+    if ativo is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    try:
+        await ativo.aupdate_valor_atual()
+        return JsonResponse(await _serialize_ativos(ativo))
+    except Exception as e:
+        logger.error(f"Error updating price for {ativo.ticker}: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def update_prices(request):
+    """Update the prices of all of the user's assets concurrently."""
+    ativos = [ativo async for ativo in Ativo.objects.select_related('categoria').filter(usuario=request.user)]
+    await asyncio.gather(*(ativo.aupdate_valor_atual() for ativo in ativos))
+    return JsonResponse(await _serialize_ativos(ativos, many=True), safe=False)
+
+
+@csrf_exempt
+@require_POST
+@jwt_required
+async def create_snapshot(request, pk):
+    ativo = await _get_user_ativo(request, pk)
+    if ativo is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+    try:
+        snapshot = await acreate_snapshot(ativo)
+        data = await sync_to_async(lambda: SnapshotSerializer(snapshot).data)()
+        return JsonResponse(data)
+    except Exception as e:
+        logger.error(f"Error creating snapshot: {str(e)}")
+        return JsonResponse({'error': str(e)}, status=500)
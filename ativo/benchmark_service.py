@@ -0,0 +1,166 @@
+"""
+Benchmark indices (CDI, IBOV, IPCA) stored locally and compared with the
+portfolio.
+
+Series are bulk-loaded from CSV or Parquet files (load_benchmarks), so
+charts never fetch index data from the network. Comparisons align the
+portfolio's dates with each index through a vectorized as-of join
+(pd.merge_asof): every portfolio date takes the index value of the same
+day or, when the index has none, the last one before it.
+"""
+import os
+from datetime import date
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+
+from .models import Ativo, IndiceBenchmark
+from .returns_service import historico_precos, serie_twr
+
+BENCHMARK_CACHE_TIMEOUT = 24 * 3600
+BENCHMARK_BATCH_SIZE = 5000
+
+
+def _cache_key(indice: str) -> str:
+    """
+    Key on what is stored for the index, so a load made by another process
+    (load_benchmarks) is seen at once: the row count and last date change
+    when rows are added, the sum when an upsert corrects a value.
+    """
+    marcador = IndiceBenchmark.objects.filter(indice=indice).aggregate(
+        linhas=Count('id'), ultima=Max('data'), soma=Sum('valor'),
+    )
+    return f"benchmark:{indice}:{marcador['linhas']}:{marcador['ultima']}:{marcador['soma']}"
+
+
+def ler_arquivo(caminho: str) -> pd.DataFrame:
+    """Read a CSV (',' or ';' separated) or Parquet file into a DataFrame with lowercase column names."""
+    extensao = os.path.splitext(caminho)[1].lower()
+    if extensao == '.parquet':
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            raise ValueError('Loading Parquet files requires the pyarrow package')
+        df = pd.read_parquet(caminho)
+    elif extensao == '.csv':
+        df = pd.read_csv(caminho, sep=None, engine='python', dtype=str)
+    else:
+        raise ValueError(f'Unsupported file type: {extensao} (use .csv or .parquet)')
+    df.columns = [str(coluna).strip().lower() for coluna in df.columns]
+    return df
+
+
+def carregar_serie(df: pd.DataFrame, indice: Optional[str] = None) -> int:
+    """
+    Insert or update benchmark values from a DataFrame with ``data`` and
+    ``valor`` columns, plus ``indice`` unless a single index is given.
+    Dates may be ISO or dd/mm/yyyy and values may use a decimal comma
+    (as in Banco Central exports). Returns the number of rows written.
+    """
+    faltando = {'data', 'valor'} - set(df.columns)
+    if faltando:
+        raise ValueError(f"Missing columns: {', '.join(sorted(faltando))}")
+    if indice:
+        df = df.assign(indice=indice)
+    elif 'indice' not in df.columns:
+        raise ValueError("The file has no 'indice' column; pass the index explicitly")
+
+    df = df.assign(indice=df['indice'].astype(str).str.strip().str.upper())
+    desconhecidos = set(df['indice']) - set(IndiceBenchmark.TIPOS)
+    if desconhecidos:
+        raise ValueError(f"Unknown indices: {', '.join(sorted(desconhecidos))}")
+
+    datas = pd.to_datetime(df['data'], format='ISO8601', errors='coerce')
+    datas = datas.fillna(pd.to_datetime(df['data'], format='%d/%m/%Y', errors='coerce'))
+    valores = pd.to_numeric(df['valor'].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    df = pd.DataFrame({'indice': df['indice'], 'data': datas.dt.date, 'valor': valores}).dropna()
+    # A file may repeat a date; the last value wins, as it would row by row
+    df = df.drop_duplicates(['indice', 'data'], keep='last')
+
+    registros = [
+        IndiceBenchmark(indice=indice, data=data, valor=round(valor, 8))
+        for indice, data, valor in df.itertuples(index=False, name=None)
+    ]
+    with transaction.atomic():
+        IndiceBenchmark.objects.bulk_create(
+            registros, batch_size=BENCHMARK_BATCH_SIZE,
+            update_conflicts=True, unique_fields=['indice', 'data'], update_fields=['valor'],
+        )
+    return len(registros)
+
+
+def niveis(indice: str) -> pd.DataFrame:
+    """
+    The whole stored history of an index as (data, nivel) rows sorted by
+    date, where nivel is a level that grows with the index: the value
+    itself for price indices, the compounded rates for rate indices.
+    """
+    cache_key = _cache_key(indice)
+    df = cache.get(cache_key)
+    if df is None:
+        linhas = IndiceBenchmark.objects.filter(indice=indice).order_by('data').values_list('data', 'valor')
+        df = pd.DataFrame(list(linhas), columns=['data', 'valor'])
+        df['data'] = pd.to_datetime(df['data']).astype('datetime64[ns]')
+        valores = df['valor'].astype(float)
+        if IndiceBenchmark.TIPOS[indice] == 'taxa':
+            df['nivel'] = np.cumprod(1 + valores / 100)
+        else:
+            df['nivel'] = valores
+        df = df[['data', 'nivel']]
+        cache.set(cache_key, df, BENCHMARK_CACHE_TIMEOUT)
+    return df
+
+
+def _percentuais(serie) -> List[Optional[float]]:
+    return [round(float(v) * 100, 4) if np.isfinite(v) else None for v in serie]
+
+
+def comparar_benchmarks(user, indices: List[str], start: Optional[date] = None, end: Optional[date] = None,
+                        ativo_id: Optional[int] = None, moeda: str = 'BRL') -> Dict[str, Any]:
+    """
+    Cumulative return of the portfolio (its time-weighted return in
+    `moeda`) or of one ativo's price, next to each benchmark's, all
+    measured from the first date in the range and aligned with ``dates``.
+    """
+    desconhecidos = set(indices) - set(IndiceBenchmark.TIPOS)
+    if desconhecidos:
+        raise ValueError(f"Unknown indices: {', '.join(sorted(desconhecidos))}")
+
+    if ativo_id is not None:
+        if not Ativo.objects.filter(usuario=user, pk=ativo_id).exists():
+            raise ValueError(f'Ativo {ativo_id} not found')
+        precos = historico_precos([ativo_id])[ativo_id].dropna()
+        if start:
+            precos = precos[precos.index >= pd.Timestamp(start)]
+        if end:
+            precos = precos[precos.index <= pd.Timestamp(end)]
+        datas, crescimento = precos.index, precos.to_numpy()
+    else:
+        twr = serie_twr(user, start=start, end=end).get(moeda, {'dates': [], 'acumulado': []})
+        datas = pd.to_datetime(twr['dates'])
+        crescimento = 1 + np.array([np.nan if v is None else v for v in twr['acumulado']], dtype=float) / 100
+
+    resultado = {'dates': [d.date().isoformat() for d in datas], 'carteira': [], 'benchmarks': {i: [] for i in indices}}
+    if not len(datas):
+        return resultado
+    resultado['carteira'] = _percentuais(crescimento / crescimento[0] - 1)
+    if not indices:
+        return resultado
+
+    # One as-of join for every index: (date x index) rows take the last index level on or before the date
+    esquerda = pd.DataFrame({
+        'data': np.repeat(datas.to_numpy().astype('datetime64[ns]'), len(indices)),
+        'indice': np.tile(indices, len(datas)),
+    }).sort_values('data', kind='stable')
+    direita = pd.concat([niveis(indice).assign(indice=indice) for indice in indices], ignore_index=True)
+    alinhado = pd.merge_asof(esquerda, direita.sort_values('data'), on='data', by='indice', direction='backward')
+    tabela = alinhado.pivot(index='data', columns='indice', values='nivel')
+    tabela = tabela.reindex(index=datas.astype('datetime64[ns]'), columns=indices)
+    relativo = tabela / tabela.iloc[0] - 1
+    for indice in indices:
+        resultado['benchmarks'][indice] = _percentuais(relativo[indice])
+    return resultado
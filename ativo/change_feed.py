@@ -0,0 +1,77 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from django.utils import timezone
+
+from .models import Ativo, Movimentacao, Dividendo, Snapshot, RegistroExcluido
+from .serializers import AtivoSerializer, MovimentacaoSerializer, DividendoSerializer, SnapshotSerializer
+
+# dataAlteracao is stamped when a row is written, not when its transaction
+# commits, so the token is moved back by this much: a row written before the
+# token was taken but committed after it (e.g. by a chunked import) is still
+# caught by the next call. Transactions longer than this can still be missed.
+JANELA_SEGURANCA = timedelta(minutes=5)
+
+# feed key -> (tombstone modelo, queryset factory, serializer)
+CHANGE_FEED_MODELS = {
+    'ativos': ('ativo', lambda user: Ativo.objects.filter(usuario=user).select_related('categoria'), AtivoSerializer),
+    'movimentacoes': ('movimentacao', lambda user: Movimentacao.objects.filter(usuario=user).select_related('ativo'), MovimentacaoSerializer),
+    'dividendos': ('dividendo', lambda user: Dividendo.objects.filter(usuario=user).select_related('ativo'), DividendoSerializer),
+    'snapshots': ('snapshot', lambda user: Snapshot.objects.filter(ativo__usuario=user).select_related('ativo'), SnapshotSerializer),
+}
+
+
+def encode_token(moment: datetime) -> str:
+    return urlsafe_b64encode(moment.isoformat().encode('ascii')).decode('ascii')
+
+
+def decode_token(token: str) -> datetime:
+    try:
+        moment = datetime.fromisoformat(urlsafe_b64decode(token.encode('ascii')).decode('ascii'))
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError('Invalid change token')
+    if timezone.is_naive(moment):
+        raise ValueError('Invalid change token')
+    return moment
+
+
+def build_change_feed(user, since: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Return what changed for a user since a token from a previous call.
+
+    Each collection lists the rows created or updated since the token
+    (by dataAlteracao) and the ids deleted since then (from the
+    RegistroExcluido tombstones). Without a token, or with one older than the
+    tombstone retention, the full state is returned with ``reset`` set so
+    the client replaces its copy instead of merging.
+
+    The returned token trails the read by JANELA_SEGURANCA, so rows changed
+    shortly before a call are sent again on the next one. Upserts and
+    deletions are keyed by id, so clients apply them idempotently and the
+    repeats are harmless.
+    """
+    agora = timezone.now()
+    token_moment = agora - JANELA_SEGURANCA
+    since_moment = decode_token(since) if since else None
+    reset = (
+        since_moment is None
+        or since_moment < agora - timedelta(days=RegistroExcluido.RETENCAO_DIAS)
+    )
+
+    feed = {'token': encode_token(token_moment), 'reset': reset}
+    for key, (modelo, get_queryset, serializer_class) in CHANGE_FEED_MODELS.items():
+        queryset = get_queryset(user)
+        deleted = []
+        if not reset:
+            queryset = queryset.filter(dataAlteracao__gte=since_moment)
+            deleted = list(
+                RegistroExcluido.objects.filter(
+                    usuario=user, modelo=modelo, data_exclusao__gte=since_moment
+                ).values_list('objeto_id', flat=True)
+            )
+        feed[key] = {
+            'upserted': serializer_class(queryset, many=True).data,
+            'deleted': deleted,
+        }
+    return feed
@@ -0,0 +1,79 @@
+import hashlib
+from functools import wraps
+
+from django.utils import timezone
+from django.utils.cache import patch_vary_headers
+from rest_framework import status
+from rest_framework.response import Response
+
+from .models import VersaoDados
+from .services import PRECO_CACHE_VALIDADE
+
+
+def _janela_de_preco() -> int:
+    """
+    Index of the current PRECO_CACHE_VALIDADE time window. Cached prices
+    expire without a write, so the data version alone would keep a 304
+    (which skips the serializer that refreshes them) valid forever.
+    """
+    return int(timezone.now().timestamp() // PRECO_CACHE_VALIDADE.total_seconds())
+
+
+def build_etag(request) -> str:
+    """
+    Build a weak ETag from the user's data version, the price-cache time
+    window and the requested URL. The URL is part of the tag because
+    filters and pages change the payload; the window makes clients
+    revalidate at least once per price-cache lifetime.
+    """
+    versao = VersaoDados.get_versao(request.user.pk)
+    path_hash = hashlib.sha1(request.get_full_path().encode('utf-8')).hexdigest()[:16]
+    return f'W/"{request.user.pk}-{versao}-{_janela_de_preco()}-{path_hash}"'
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(',')]
+    # Weak comparison: ignore the W/ prefix on both sides
+    bare = etag[2:] if etag.startswith('W/') else etag
+    return any((c[2:] if c.startswith('W/') else c) == bare for c in candidates)
+
+
+def _finalize(response, etag):
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    patch_vary_headers(response, ['Authorization'])
+    return response
+
+
+def etag_por_versao(view_method):
+    """
+    Decorator for read-only viewset methods.
+    Answers 304 Not Modified, without touching the queryset or serializer,
+    when the client's If-None-Match matches the current data version.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        etag = build_etag(request)
+        if _etag_matches(etag, request.headers.get('If-None-Match', '')):
+            return _finalize(Response(status=status.HTTP_304_NOT_MODIFIED), etag)
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            _finalize(response, etag)
+        return response
+    return wrapper
+
+
+class VersaoETagMixin:
+    """Add data-version ETags to the list and retrieve actions of a viewset."""
+
+    @etag_por_versao
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @etag_por_versao
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
@@ -0,0 +1,161 @@
+import csv
+from typing import Iterator, List, Tuple
+
+from .models import Movimentacao, Dividendo, Snapshot, EvolucaoPatrimonial
+
+# Rows fetched per database round trip; memory stays bounded by this, not by history size
+EXPORT_CHUNK_SIZE = 2000
+
+# dataset -> (model, [(column name, ORM lookup, column type)])
+EXPORT_DATASETS = {
+    'movimentacoes': (Movimentacao, [
+        ('data', 'data', 'date'),
+        ('ticker', 'ativo__ticker', 'str'),
+        ('operacao', 'operacao', 'str'),
+        ('quantidade', 'quantidade', 'decimal'),
+        ('valor_unitario', 'valorUnitario', 'decimal'),
+        ('taxa', 'taxa', 'decimal'),
+        ('custo_total', 'custoTotal', 'decimal'),
+    ]),
+    'dividendos': (Dividendo, [
+        ('data', 'data', 'date'),
+        ('ticker', 'ativo__ticker', 'str'),
+        ('valor', 'valor', 'decimal'),
+    ]),
+    'snapshots': (Snapshot, [
+        ('data', 'data', 'date'),
+        ('ticker', 'ativo__ticker', 'str'),
+        ('preco', 'preco', 'decimal'),
+        ('quantidade', 'quantidade', 'decimal'),
+        ('valor_total', 'valor_total', 'decimal'),
+        ('is_preco_estimado', 'is_preco_estimado', 'bool'),
+    ]),
+    'evolucao': (EvolucaoPatrimonial, [
+        ('data', 'data', 'date'),
+        ('ticker', 'ativo__ticker', 'str'),
+        ('preco_atual', 'preco_atual', 'decimal'),
+        ('quantidade', 'quantidade', 'decimal'),
+        ('valor_total', 'valor_total', 'decimal'),
+        ('custo_total', 'custo_total', 'decimal'),
+        ('dividendos_mes', 'dividendos_mes', 'decimal'),
+    ]),
+}
+
+EXPORT_FORMATS = {
+    'csv': ('text/csv', 'csv'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+
+
+def _get_columns(dataset: str) -> List[Tuple[str, str, str]]:
+    if dataset not in EXPORT_DATASETS:
+        raise ValueError(f"dataset must be one of: {', '.join(EXPORT_DATASETS)}")
+    return EXPORT_DATASETS[dataset][1]
+
+
+def iter_export_rows(dataset: str, user, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[tuple]:
+    """Yield the user's rows for a dataset as tuples, reading chunk_size rows at a time."""
+    columns = _get_columns(dataset)
+    model = EXPORT_DATASETS[dataset][0]
+    queryset = model.objects.filter(ativo__usuario=user).order_by('data', 'id')
+    return queryset.values_list(*[lookup for _, lookup, _ in columns]).iterator(chunk_size=chunk_size)
+
+
+class _Echo:
+    """File-like object whose write() returns the value instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(dataset: str, user, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[str]:
+    """Yield a dataset as CSV lines, header first."""
+    columns = _get_columns(dataset)
+    writer = csv.writer(_Echo())
+    yield writer.writerow([name for name, _, _ in columns])
+    for row in iter_export_rows(dataset, user, chunk_size):
+        yield writer.writerow(row)
+
+
+class _ChunkSink:
+    """Write-only file object that hands back whatever was written since the last drain()."""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise ValueError('Parquet export requires the pyarrow package')
+    return pyarrow, pyarrow.parquet
+
+
+def iter_parquet(dataset: str, user, chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    Yield a dataset as a Parquet file, one row group per chunk.
+    Requires the optional pyarrow dependency.
+    """
+    pa, pq = _require_pyarrow()
+    columns = _get_columns(dataset)
+    arrow_types = {
+        'date': pa.date32(),
+        'str': pa.string(),
+        'decimal': pa.decimal128(18, 6),
+        'bool': pa.bool_(),
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, _, kind in columns])
+
+    def to_batch(rows):
+        return pa.Table.from_arrays(
+            [pa.array(values, type=field.type) for values, field in zip(zip(*rows), schema)],
+            schema=schema,
+        )
+
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema)
+    rows = []
+    for row in iter_export_rows(dataset, user, chunk_size):
+        rows.append(row)
+        if len(rows) >= chunk_size:
+            writer.write_table(to_batch(rows))
+            rows = []
+            yield sink.drain()
+    if rows:
+        writer.write_table(to_batch(rows))
+    writer.close()
+    yield sink.drain()
+
+
+def export_dataset(dataset: str, user, file_format: str = 'csv', chunk_size: int = EXPORT_CHUNK_SIZE) -> Iterator:
+    """Return a lazy iterator over the exported file contents (str for CSV, bytes for Parquet)."""
+    _get_columns(dataset)
+    if file_format == 'csv':
+        return iter_csv(dataset, user, chunk_size)
+    if file_format == 'parquet':
+        _require_pyarrow()
+        return iter_parquet(dataset, user, chunk_size)
+    raise ValueError(f"file_format must be one of: {', '.join(EXPORT_FORMATS)}")
@@ -0,0 +1,52 @@
+from datetime import date, timedelta
+from typing import Optional, Tuple
+
+
+# Period filters are written as half-open ranges (data >= inicio AND data < fim)
+# instead of data__year/data__month, which wrap the column in a function and
+# force a full scan; a plain range can seek on any index starting with data
+# (or with usuario/ativo followed by data).
+
+def intervalo_ano(year: int) -> Tuple[date, date]:
+    return date(year, 1, 1), date(year + 1, 1, 1)
+
+
+def intervalo_mes(year: int, month: int) -> Tuple[date, date]:
+    inicio = date(year, month, 1)
+    fim = date(year + 1, 1, 1) if month == 12 else date(year, month + 1, 1)
+    return inicio, fim
+
+
+def filtrar_intervalo(queryset, inicio: Optional[date], fim: Optional[date], field: str = 'data'):
+    """Filter `field` to [inicio, fim); either bound may be None."""
+    if inicio is not None:
+        queryset = queryset.filter(**{f'{field}__gte': inicio})
+    if fim is not None:
+        queryset = queryset.filter(**{f'{field}__lt': fim})
+    return queryset
+
+
+def filtrar_periodo(queryset, params, field: str = 'data'):
+    """
+    Apply the ?year=, ?month= (with year) and ?start=/?end= (inclusive
+    YYYY-MM-DD) query parameters as date ranges. Invalid values are ignored,
+    as the year filter always did.
+    """
+    try:
+        year = int(params['year'])
+        if 'month' in params:
+            queryset = filtrar_intervalo(queryset, *intervalo_mes(year, int(params['month'])), field=field)
+        else:
+            queryset = filtrar_intervalo(queryset, *intervalo_ano(year), field=field)
+    except (KeyError, ValueError):
+        pass
+
+    try:
+        queryset = filtrar_intervalo(queryset, date.fromisoformat(params['start']), None, field=field)
+    except (KeyError, ValueError):
+        pass
+    try:
+        queryset = filtrar_intervalo(queryset, None, date.fromisoformat(params['end']) + timedelta(days=1), field=field)
+    except (KeyError, ValueError, OverflowError):
+        pass
+    return queryset
@@ -1,60 +1,68 @@
+import logging
 import requests
 import re
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from urllib.parse import urljoin, urlparse
-from typing import Optional
+from typing import Iterable, Optional
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .timing import measure
+from .metrics import provider_call
+
+logger = logging.getLogger(__name__)
+
+# Each probe is a (method, url) request; a 200 answer means the logo exists
+PROBE_TIMEOUT = 5
+
+SEM_ICONE = Q(icone_url__isnull=True) | Q(icone_url='')
+
+_background = ThreadPoolExecutor(max_workers=2, thread_name_prefix='icones')
+
+
+def _probe(method: str, url: str) -> Optional[str]:
+    try:
+        with provider_call('logo', 'icon_service'):
+            response = requests.request(method, url, timeout=PROBE_TIMEOUT)
+        if response.status_code != 200:
+            return None
+        if method == 'GET':
+            # Brandfetch answers with the brand's logo list
+            logos = response.json().get('logos') or []
+            return logos[0]['image'] if logos else None
+        return url
+    except Exception:
+        return None
+
 
 def search_company_icon(ticker: str, company_name: str) -> Optional[str]:
     """
     Search for company icon using multiple strategies.
+    All strategies are probed concurrently and the first one that finds a
+    logo wins, so a miss costs one timeout instead of one per strategy.
     Returns the icon URL if found, None otherwise.
     """
-    
-    # Strategy 1: Try Logo.dev API (free tier)
+    probes = [
+        # Logo.dev API (free tier)
+        ('HEAD', f"https://img.logo.dev/{ticker.lower()}.com?token=pk_X-1ZO13ESEOdEyVKzKNfzQ"),
+        # Clearbit Logo API (free tier), by ticker and company name domains
+        ('HEAD', f"https://logo.clearbit.com/{ticker.lower()}.com"),
+        ('HEAD', f"https://logo.clearbit.com/{ticker.lower()}.com.br"),
+        ('HEAD', f"https://logo.clearbit.com/{company_name.lower().replace(' ', '').replace('.', '')}.com"),
+        # Brandfetch API (free tier)
+        ('GET', f"https://api.brandfetch.io/v2/brands/{ticker.lower()}.com"),
+    ]
+    executor = ThreadPoolExecutor(max_workers=len(probes))
     try:
-        logo_dev_url = f"https://img.logo.dev/{ticker.lower()}.com?token=pk_X-1ZO13ESEOdEyVKzKNfzQ"
-        response = requests.head(logo_dev_url, timeout=5)
-        if response.status_code == 200:
-            return logo_dev_url
-    except:
-        pass
-    
-    # Strategy 2: Try Clearbit Logo API (free tier)
-    try:
-        # Extract domain from company name or use ticker
-        domain_candidates = [
-            f"{ticker.lower()}.com",
-            f"{ticker.lower()}.com.br",
-            f"{company_name.lower().replace(' ', '').replace('.', '')}.com",
-        ]
-        
-        for domain in domain_candidates:
-            clearbit_url = f"https://logo.clearbit.com/{domain}"
-            response = requests.head(clearbit_url, timeout=5)
-            if response.status_code == 200:
-                return clearbit_url
-    except:
-        pass
-    
-    # Strategy 3: Try Brandfetch API (free tier)
-    try:
-        brandfetch_url = f"https://api.brandfetch.io/v2/brands/{ticker.lower()}.com"
-        response = requests.get(brandfetch_url, timeout=5)
-        if response.status_code == 200:
-            data = response.json()
-            if 'logos' in data and len(data['logos']) > 0:
-                return data['logos'][0]['image']
-    except:
-        pass
-    
-    # Strategy 4: Try Yahoo Finance favicon
-    try:
-        yahoo_icon = f"https://s.yimg.com/cv/apiv2/social/images/yahoo_default_logo.png"
-        # This is a fallback - in practice you'd want to scrape Yahoo Finance for the actual logo
-        return None  # Skip this for now as it's not reliable
-    except:
-        pass
-    
-    return None
+        futures = [executor.submit(_probe, method, url) for method, url in probes]
+        for future in as_completed(futures):
+            icon = future.result()
+            if icon:
+                return icon
+        return None
+    finally:
+        # Don't wait for the slower probes once one has answered
+        executor.shutdown(wait=False, cancel_futures=True)
 
 def get_brazilian_stock_icon(ticker: str) -> Optional[str]:
     """
@@ -77,6 +85,40 @@ def get_brazilian_stock_icon(ticker: str) -> Optional[str]:
     
     return brazilian_icons.get(ticker.upper())
 
+DEFAULT_ICON = 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png'
+
+CATEGORY_ICONS = {
+    # Renda Variável
+    'ACOES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
+    'FII': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png',   # Building
+    'ETFS': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
+    'BDRS': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
+    'CRIPTO': 'https://cdn-icons-png.flaticon.com/512/5968/5968260.png', # Bitcoin
+    
+    # Renda Fixa
+    'TESOURO_DIRETO': 'https://cdn-icons-png.flaticon.com/512/1077/1077114.png', # Government
+    'CDB': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png',    # Bank
+    'LCI_LCA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Bank
+    'DEBENTURES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'CRI_CRA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
+    'POUPANCA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Bank
+    
+    # Fundos
+    'FUNDO_RF': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'FUNDO_MULTI': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'FUNDO_ACOES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'FUNDO_CAMBIAL': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'FUNDO_IMOB': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
+    'PREVIDENCIA': 'https://cdn-icons-png.flaticon.com/512/1077/1077114.png', # Shield
+    
+    # Exterior
+    'ETF_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'ACOES_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'FUNDOS_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
+    'REITS': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
+}
+
+
 def fetch_ativo_icon(ticker: str, company_name: str, categoria_subtipo: str) -> str:
     """
     Main function to fetch ativo icon with multiple fallback strategies.
@@ -89,41 +131,74 @@ def fetch_ativo_icon(ticker: str, company_name: str, categoria_subtipo: str) ->
         if brazilian_icon:
             return brazilian_icon
     
-    # Strategy 2: Try general company icon search
-    company_icon = search_company_icon(ticker, company_name)
+    # Strategy 2: Try general company icon search, remembering hits and misses per ticker
+    from .models import IconeCache
+
+    hit, company_icon = IconeCache.get_cached_icon(ticker)
+    if not hit:
+        with measure('icon'):
+            company_icon = search_company_icon(ticker, company_name)
+        IconeCache.update_cache(ticker, company_icon)
     if company_icon:
         return company_icon
     
     # Strategy 3: Fallback to category default icons
-    category_icons = {
-        # Renda Variável
-        'ACOES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
-        'FII': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png',   # Building
-        'ETFS': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
-        'BDRS': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',  # Stock chart
-        'CRIPTO': 'https://cdn-icons-png.flaticon.com/512/5968/5968260.png', # Bitcoin
-        
-        # Renda Fixa
-        'TESOURO_DIRETO': 'https://cdn-icons-png.flaticon.com/512/1077/1077114.png', # Government
-        'CDB': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png',    # Bank
-        'LCI_LCA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Bank
-        'DEBENTURES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'CRI_CRA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
-        'POUPANCA': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Bank
-        
-        # Fundos
-        'FUNDO_RF': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'FUNDO_MULTI': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'FUNDO_ACOES': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'FUNDO_CAMBIAL': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'FUNDO_IMOB': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
-        'PREVIDENCIA': 'https://cdn-icons-png.flaticon.com/512/1077/1077114.png', # Shield
-        
-        # Exterior
-        'ETF_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'ACOES_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'FUNDOS_INTER': 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png', # Chart
-        'REITS': 'https://cdn-icons-png.flaticon.com/512/1077/1077976.png', # Building
-    }
     
-    return category_icons.get(categoria_subtipo, 'https://cdn-icons-png.flaticon.com/512/2830/2830284.png') 
\ No newline at end of file
+    return CATEGORY_ICONS.get(categoria_subtipo, DEFAULT_ICON) 
+
+
+def resolve_icons(ativo_ids: Iterable[int], force: bool = False) -> int:
+    """
+    Fetch and store the icon of each ativo (only those without one unless
+    force), probing each distinct instrument once. A logo found is kept on
+    the Instrumento and fanned out to every holder still without an icon.
+    On a miss nothing is stored: get_icon_url serves the category icon and
+    the ativo is probed again once the cached miss expires.
+    Returns how many ativos were updated.
+    """
+    from .models import Ativo, Instrumento, VersaoDados
+
+    ativos = Ativo.objects.filter(pk__in=list(ativo_ids)).select_related('categoria')
+    if not force:
+        ativos = ativos.filter(SEM_ICONE)
+    grupos = {}
+    for ativo in ativos:
+        grupos.setdefault(ativo.instrumento_id or ativo.ticker, []).append(ativo)
+
+    atualizados = 0
+    for chave, grupo in grupos.items():
+        icon = fetch_ativo_icon(grupo[0].ticker, grupo[0].nome, grupo[0].categoria.subtipo)
+        if icon in CATEGORY_ICONS.values() or icon == DEFAULT_ICON:
+            continue
+        destino = Q(pk__in=[a.pk for a in grupo])
+        if grupo[0].instrumento_id:
+            Instrumento.objects.filter(pk=chave).update(icone_url=icon, dataAlteracao=timezone.now())
+            destino |= Q(instrumento_id=chave) & SEM_ICONE
+        holders = Ativo.objects.filter(destino)
+        usuario_ids = set(holders.values_list('usuario_id', flat=True))
+        # update() skips save() and its receivers; bump dataAlteracao and the data version here
+        atualizados += holders.update(icone_url=icon, dataAlteracao=timezone.now())
+        for usuario_id in usuario_ids:
+            VersaoDados.incrementar(usuario_id)
+    return atualizados
+
+
+def _resolve_in_background(ativo_ids) -> None:
+    try:
+        resolve_icons(ativo_ids)
+    except Exception:
+        logger.exception('Background icon resolution failed')
+    finally:
+        close_old_connections()
+
+
+def resolve_icons_in_background(ativo_ids: Iterable[int]) -> None:
+    """
+    Queue icon resolution for these ativos once the current transaction
+    commits; the caller never waits on the network. Ativos show their
+    category icon (Ativo.get_icon_url) until it finishes, and any that are
+    missed are picked up by the refresh_icons command.
+    """
+    ativo_ids = list(ativo_ids)
+    if ativo_ids:
+        transaction.on_commit(lambda: _background.submit(_resolve_in_background, ativo_ids))
@@ -0,0 +1,461 @@
+"""
+Vectorized, streaming import of B3 spreadsheets (movimentacoes and dividendos).
+
+The file (XLSX or CSV) is read straight from the upload stream in
+fixed-size chunks, so memory stays flat however long the statement is.
+Each chunk is normalized column-wise in one pass (tickers, dates, numbers),
+categories and the user's existing ativos are loaded into dicts once,
+each row gets a content hash (user, ticker, date, operation, quantity,
+price) checked against the stored ones with one IN query (rows saved
+without a hash are matched on those columns), only new rows
+and missing ativos are bulk-created, so re-importing an overlapping export
+costs O(new rows), and each chunk is committed
+together with an ImportacaoArquivo checkpoint: re-sending a file after a
+failure resumes after the last committed chunk. Every touched ativo has its
+position recomputed once, at the end.
+"""
+import csv
+import hashlib
+import io
+import os
+from collections import Counter
+from datetime import date
+from decimal import Decimal
+from typing import Dict, Optional
+
+import pandas as pd
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Ativo, Categoria, Dividendo, DividendoMensal, Movimentacao, VersaoDados, ImportacaoArquivo, Instrumento
+from .icon_service import resolve_icons_in_background
+
+MOVIMENTACAO_COLUMNS = {
+    'ticker': 'Código de Negociação',
+    'data': 'Data do Negócio',
+    'tipo': 'Tipo de Movimentação',
+    'quantidade': 'Quantidade',
+    'preco': 'Preço',
+    'valor': 'Valor',
+}
+
+DIVIDENDO_COLUMNS = {
+    'produto': 'Produto',
+    'data': 'Pagamento',
+    'valor': 'Valor líquido',
+}
+
+DATE_FORMAT = '%d/%m/%Y'
+
+# Columns that identify an imported row (together with the user)
+MOVIMENTACAO_CHAVE = ['ticker', 'data', 'operacao', 'quantidade', 'valorUnitario']
+DIVIDENDO_CHAVE = ['ticker', 'data', 'valor']
+
+# Rows per chunk: one transaction, one bulk insert and one checkpoint each
+IMPORT_CHUNK_SIZE = 5000
+
+
+def _check_columns(df: pd.DataFrame, columns: Dict[str, str]) -> None:
+    missing = [column for column in columns.values() if column not in df.columns]
+    if missing:
+        raise ValueError(f"Colunas ausentes na planilha: {', '.join(missing)}")
+
+
+def normalizar_tickers(values: pd.Series) -> pd.Series:
+    """Upper-case and strip tickers, dropping the 'F' suffix of fractional-market tickers (WEGE3F -> WEGE3)."""
+    tickers = values.astype(str).str.strip().str.upper()
+    fracionario = tickers.str.endswith('F') & (tickers.str.len() > 1)
+    return tickers.where(~fracionario, tickers.str[:-1])
+
+
+def normalizar_datas(values: pd.Series) -> pd.Series:
+    """Parse dd/mm/yyyy strings (date cells pass through); invalid values become NaT."""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return values.dt.normalize()
+    return pd.to_datetime(values, format=DATE_FORMAT, errors='coerce')
+
+
+def normalizar_numeros(values: pd.Series) -> pd.Series:
+    """Parse numbers, accepting decimal commas in text cells; invalid values become NaN."""
+    if pd.api.types.is_numeric_dtype(values):
+        return values.astype(float)
+    return pd.to_numeric(values.astype(str).str.strip().str.replace(',', '.', regex=False), errors='coerce')
+
+
+def _decimais(values: pd.Series, casas: int):
+    return values.round(casas).astype(str).map(Decimal)
+
+
+def _canonico(valor) -> str:
+    # Decimal('10.0'), Decimal('10.000000') -> '10', so the hash ignores the scale
+    if isinstance(valor, Decimal):
+        return f'{valor.normalize():f}'
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return str(valor)
+
+
+def chave_importacao(usuario_id: int, valores) -> str:
+    """Content key of one imported row, e.g. "7|BBAS3|2024-01-15|COMPRA|100|25.3"."""
+    return '|'.join([str(usuario_id)] + [_canonico(valor) for valor in valores])
+
+
+def hash_importacao(chave: str, ocorrencia: int = 0) -> str:
+    """
+    SHA-256 of a row key plus its occurrence number: identical rows in one
+    file (two equal trades on the same day) are kept apart as occurrence
+    0, 1, ... and still match themselves when the file is imported again.
+    """
+    return hashlib.sha256(f'{chave}|{ocorrencia}'.encode()).hexdigest()
+
+
+def _linhas_invalidas(df: pd.DataFrame, colunas, summary, offset: int = 0) -> pd.DataFrame:
+    """Drop rows with an unparseable value, reporting each one in summary['errors']."""
+    invalidas = df[colunas].isna().any(axis=1)
+    for idx, row in df[invalidas].iterrows():
+        campos = ', '.join(c for c in colunas if pd.isna(row[c]))
+        summary['errors'].append(f'Row {idx + offset}: valor inválido em {campos}')
+    return df[~invalidas]
+
+
+class ImportContext:
+    """Per-user lookups loaded once per import and reused across chunks."""
+
+    def __init__(self, user, stdout=None):
+        self.user = user
+        self.stdout = stdout
+        self.categorias = {
+            (c.tipo, c.subtipo): c
+            for c in Categoria.objects.filter(tipo='RENDA_VARIAVEL', subtipo__in=['ACOES', 'FII'])
+        }
+        self.ativos = {a.ticker: a for a in Ativo.objects.filter(usuario=user)}
+        self.ativos_alterados = set()
+        self.ocorrencias = {}  # row key -> times seen so far in this file
+        self.sem_hash_usados = {}  # row key -> stored rows without a hash already matched
+
+    def chaves(self, frame: pd.DataFrame, colunas) -> pd.Series:
+        """Content keys (chave_importacao) of the frame's rows, built column-wise."""
+        return pd.Series(str(self.user.pk), index=frame.index, dtype=object).str.cat(
+            [frame[coluna].map(_canonico) for coluna in colunas], sep='|'
+        )
+
+    def hashes(self, frame: pd.DataFrame, colunas) -> pd.Series:
+        """Content hashes of the frame's rows, numbering repeated rows across all chunks of the file."""
+        if frame.empty:
+            return pd.Series([], index=frame.index, dtype=object)
+        chaves = self.chaves(frame, colunas)
+        anteriores = chaves.map(self.ocorrencias).fillna(0).astype(int)
+        ocorrencias = anteriores + chaves.groupby(chaves).cumcount()
+        for chave, vezes in chaves.value_counts().items():
+            self.ocorrencias[chave] = self.ocorrencias.get(chave, 0) + vezes
+        return pd.Series(
+            [hash_importacao(chave, n) for chave, n in zip(chaves, ocorrencias)],
+            index=frame.index,
+        )
+
+    def write(self, message: str) -> None:
+        if self.stdout:
+            self.stdout.write(message)
+
+    def categoria_para(self, ticker: str, instrumento: Optional[Instrumento] = None) -> Categoria:
+        if instrumento is not None and instrumento.categoria_sugerida_id:
+            return instrumento.categoria_sugerida
+        # FIIs trade with an "11" suffix; everything else is imported as ações
+        subtipo = 'FII' if ticker.endswith('11') else 'ACOES'
+        categoria = self.categorias.get(('RENDA_VARIAVEL', subtipo)) or self.categorias.get(('RENDA_VARIAVEL', 'ACOES'))
+        if categoria is None:
+            raise ValueError('Categoria não encontrada')
+        return categoria
+
+    def criar_ativos(self, tickers, nomes: Dict[str, str]) -> int:
+        """
+        Bulk-create the ativos missing for these tickers, taking name, icon and
+        categoria from the shared Instrumento (created if needed, named from
+        `nomes`); returns how many were created.
+        """
+        faltando = [ticker for ticker in dict.fromkeys(tickers) if ticker not in self.ativos]
+        if not faltando:
+            return 0
+        instrumentos = Instrumento.para_tickers(faltando, 'BRL', nomes)
+        novos = []
+        for ticker in faltando:
+            instrumento = instrumentos[ticker]
+            novos.append(Ativo(
+                ticker=ticker,
+                nome=nomes.get(ticker) or instrumento.nome or ticker,
+                moeda='BRL',
+                categoria=self.categoria_para(ticker, instrumento),
+                usuario=self.user,
+                peso=Decimal('0'),
+                instrumento=instrumento,
+                icone_url=instrumento.icone_url,
+            ))
+        Ativo.objects.bulk_create(novos)
+        for ativo in novos:
+            self.ativos[ativo.ticker] = ativo
+            self.write(f'  Created ativo: {ativo.ticker} ({ativo.categoria.subtipo}) - {ativo.nome}')
+        # Icons are looked up after the commit, off the import's transaction
+        resolve_icons_in_background(ativo.pk for ativo in novos if not ativo.icone_url)
+        return len(novos)
+
+
+def preparar_movimentacoes(df: pd.DataFrame, summary, offset: int = 0) -> pd.DataFrame:
+    """Normalize a B3 "movimentações" sheet into ticker/nome/data/operacao/quantidade/valorUnitario/taxa columns."""
+    _check_columns(df, MOVIMENTACAO_COLUMNS)
+    frame = pd.DataFrame({
+        'ticker': normalizar_tickers(df[MOVIMENTACAO_COLUMNS['ticker']]),
+        'data': normalizar_datas(df[MOVIMENTACAO_COLUMNS['data']]),
+        'quantidade': normalizar_numeros(df[MOVIMENTACAO_COLUMNS['quantidade']]),
+        'preco': normalizar_numeros(df[MOVIMENTACAO_COLUMNS['preco']]),
+        'valor': normalizar_numeros(df[MOVIMENTACAO_COLUMNS['valor']]),
+    }, index=df.index)
+    frame['operacao'] = (df[MOVIMENTACAO_COLUMNS['tipo']] == 'Compra').map({True: 'COMPRA', False: 'VENDA'})
+    frame['nome'] = df['nome'].fillna('').astype(str).str.strip() if 'nome' in df.columns else ''
+    frame = _linhas_invalidas(frame, ['data', 'quantidade', 'preco', 'valor'], summary, offset)
+
+    # Fees are whatever the broker charged above quantidade x preço
+    frame['taxa'] = (frame['valor'] - frame['quantidade'] * frame['preco']).clip(lower=0)
+    frame['data'] = frame['data'].dt.date
+    frame['quantidade'] = _decimais(frame['quantidade'], 6)
+    frame['valorUnitario'] = _decimais(frame['preco'], 2)
+    frame['taxa'] = _decimais(frame['taxa'], 2)
+    return frame[['ticker', 'nome', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa']]
+
+
+def _novas_linhas(frame: pd.DataFrame, context: ImportContext, colunas, model) -> pd.DataFrame:
+    """
+    Hash the rows and drop those already stored, with one IN query for the
+    whole chunk. Rows saved through the API or the admin have no hash; they
+    are matched on the same columns instead, each stored row absorbing one
+    file row with its content.
+    """
+    frame = frame.assign(hash_importacao=context.hashes(frame, colunas))
+    existentes = set(
+        model.objects.filter(hash_importacao__in=frame['hash_importacao'].tolist())
+        .values_list('hash_importacao', flat=True)
+    )
+    frame = frame[~frame['hash_importacao'].isin(existentes)]
+    if frame.empty:
+        return frame
+
+    campos = ['ativo__ticker' if coluna == 'ticker' else coluna for coluna in colunas]
+    sem_hash = Counter(
+        chave_importacao(context.user.pk, valores)
+        for valores in model.objects.filter(
+            ativo__usuario=context.user, hash_importacao__isnull=True,
+            ativo__ticker__in=set(frame['ticker']), data__gte=frame['data'].min(), data__lte=frame['data'].max(),
+        ).values_list(*campos)
+    )
+    if not sem_hash:
+        return frame
+    novas = []
+    for chave in context.chaves(frame, colunas):
+        usados = context.sem_hash_usados.get(chave, 0)
+        novas.append(usados >= sem_hash[chave])
+        if not novas[-1]:
+            context.sem_hash_usados[chave] = usados + 1
+    return frame[novas]
+
+
+def importar_movimentacoes(df: pd.DataFrame, context: ImportContext, summary, offset: int = 0) -> None:
+    """Import one DataFrame of movimentacoes, skipping rows already imported, adding to the summary counters."""
+    from .services import bulk_save_movimentacoes  # services imports this module
+
+    frame = preparar_movimentacoes(df, summary, offset)
+    if frame.empty:
+        return
+    lidas = len(frame)
+    frame = _novas_linhas(frame, context, MOVIMENTACAO_CHAVE, Movimentacao)
+    summary['skipped_movimentacoes'] = summary.get('skipped_movimentacoes', 0) + lidas - len(frame)
+    if frame.empty:
+        context.write(f'Imported 0 movimentacoes ({lidas} already existed)')
+        return
+    nomes = frame[frame['nome'] != ''].drop_duplicates('ticker').set_index('ticker')['nome'].to_dict()
+
+    with transaction.atomic():
+        summary['created_ativos'] += context.criar_ativos(frame['ticker'], nomes)
+        novas = [
+            Movimentacao(
+                ativo=context.ativos[ticker],
+                data=data,
+                operacao=operacao,
+                quantidade=quantidade,
+                valorUnitario=valor_unitario,
+                taxa=taxa,
+                hash_importacao=hash_linha,
+            )
+            for ticker, data, operacao, quantidade, valor_unitario, taxa, hash_linha in frame[
+                ['ticker', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa', 'hash_importacao']
+            ].itertuples(index=False, name=None)
+        ]
+        # Positions are recomputed once per ativo when the whole file is done
+        falhas = bulk_save_movimentacoes(novas, recompute=False)
+        for posicao, erro in falhas.items():
+            summary['errors'].append(f'Row {frame.index[posicao] + offset}: {erro}')
+        novas = [mov for posicao, mov in enumerate(novas) if posicao not in falhas]
+        context.ativos_alterados.update(mov.ativo_id for mov in novas)
+    summary['created_movimentacoes'] += len(novas)
+    context.write(f'Imported {len(novas)} movimentacoes ({lidas - len(novas) - len(falhas)} already existed)')
+
+
+def preparar_dividendos(df: pd.DataFrame, summary, offset: int = 0) -> pd.DataFrame:
+    """Normalize a B3 "proventos" sheet into ticker/data/valor columns."""
+    _check_columns(df, DIVIDENDO_COLUMNS)
+    # Produto looks like "BBAS3 - BANCO DO BRASIL S/A"
+    produto = df[DIVIDENDO_COLUMNS['produto']].astype(str).str.split(' - ', n=1).str[0]
+    frame = pd.DataFrame({
+        'ticker': normalizar_tickers(produto),
+        'data': normalizar_datas(df[DIVIDENDO_COLUMNS['data']]),
+        'valor': normalizar_numeros(df[DIVIDENDO_COLUMNS['valor']]),
+    }, index=df.index)
+    frame = _linhas_invalidas(frame, ['data', 'valor'], summary, offset)
+    frame['data'] = frame['data'].dt.date
+    frame['valor'] = _decimais(frame['valor'], 2)
+    return frame
+
+
+def importar_dividendos(df: pd.DataFrame, context: ImportContext, summary, offset: int = 0) -> None:
+    """Import one DataFrame of dividendos, skipping rows already imported."""
+    frame = preparar_dividendos(df, summary, offset)
+
+    conhecido = frame['ticker'].isin(context.ativos.keys())
+    for idx, ticker in frame.loc[~conhecido, 'ticker'].items():
+        summary['errors'].append(f'Row {idx + offset}: Ativo {ticker} não encontrado para o usuário')
+    frame = frame[conhecido]
+    if frame.empty:
+        return
+
+    lidas = len(frame)
+    frame = _novas_linhas(frame, context, DIVIDENDO_CHAVE, Dividendo)
+    agora = timezone.now()
+    novos = [
+        Dividendo(
+            ativo_id=context.ativos[ticker].pk, usuario_id=context.user.pk, data=data, valor=valor,
+            hash_importacao=hash_linha, dataAlteracao=agora,
+        )
+        for ticker, data, valor, hash_linha in frame[['ticker', 'data', 'valor', 'hash_importacao']].itertuples(index=False, name=None)
+    ]
+    if novos:
+        # bulk_create skips Dividendo.save() and the version and monthly-total receivers
+        with transaction.atomic():
+            Dividendo.objects.bulk_create(novos)
+            DividendoMensal.atualizar((d.ativo_id, d.data) for d in novos)
+        VersaoDados.incrementar(context.user.pk)
+    summary['created_dividendos'] += len(novos)
+    context.write(f'Imported {len(novos)} dividendos ({lidas - len(novos)} already existed)')
+
+
+def _sha256(arquivo) -> str:
+    digest = hashlib.sha256()
+    arquivo.seek(0)
+    for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+        digest.update(bloco)
+    arquivo.seek(0)
+    return digest.hexdigest()
+
+
+def _iter_xlsx(arquivo, chunk_size: int):
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(arquivo, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(c).strip() if c is not None else '' for c in header]
+        width = len(columns)
+        buffer, start = [], 0
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            buffer.append((tuple(row) + (None,) * width)[:width])
+            if len(buffer) >= chunk_size:
+                yield pd.DataFrame(buffer, columns=columns, index=range(start, start + len(buffer)))
+                start += len(buffer)
+                buffer = []
+        if buffer:
+            yield pd.DataFrame(buffer, columns=columns, index=range(start, start + len(buffer)))
+    finally:
+        workbook.close()
+
+
+def _iter_csv(arquivo, chunk_size: int):
+    texto = io.TextIOWrapper(arquivo, encoding='utf-8-sig', newline='')
+    try:
+        amostra = texto.read(64 * 1024)
+        texto.seek(0)
+        # B3 exports use ";"; let the sniffer decide between ";" and ","
+        delimitador = csv.Sniffer().sniff(amostra, delimiters=';,').delimiter if amostra else ','
+        yield from pd.read_csv(texto, sep=delimitador, dtype=str, chunksize=chunk_size, skipinitialspace=True)
+    finally:
+        texto.detach()
+
+
+def iter_chunks(arquivo, nome_arquivo: str, chunk_size: int = IMPORT_CHUNK_SIZE):
+    """Yield the rows of an XLSX or CSV file as DataFrames of at most chunk_size rows, indexed by row number."""
+    extensao = os.path.splitext(nome_arquivo or '')[1].lower()
+    if extensao == '.csv':
+        return _iter_csv(arquivo, chunk_size)
+    if extensao in ('.xlsx', '.xlsm'):
+        return _iter_xlsx(arquivo, chunk_size)
+    raise ValueError('Formato de arquivo não suportado (use .xlsx ou .csv)')
+
+
+IMPORTADORES = {
+    'movimentacoes': (importar_movimentacoes, preparar_movimentacoes, MOVIMENTACAO_CHAVE, 0),
+    'dividendos': (importar_dividendos, preparar_dividendos, DIVIDENDO_CHAVE, 1),
+}
+
+
+def importar_arquivo(arquivo, nome_arquivo: str, user, tipo: str, summary, stdout=None,
+                     chunk_size: int = IMPORT_CHUNK_SIZE) -> None:
+    """
+    Import a path or binary file object (e.g. the upload stream) chunk by chunk.
+
+    Each chunk is committed with its checkpoint; an error stops the import
+    and leaves the checkpoint at the last committed chunk, so sending the
+    same file again continues from there.
+    """
+    if isinstance(arquivo, (str, os.PathLike)):
+        with open(arquivo, 'rb') as handle:
+            return importar_arquivo(handle, nome_arquivo or os.fspath(arquivo), user, tipo, summary,
+                                    stdout=stdout, chunk_size=chunk_size)
+
+    importar, preparar, chave, offset = IMPORTADORES[tipo]
+    checkpoint, _ = ImportacaoArquivo.objects.get_or_create(
+        usuario=user, tipo=tipo, sha256=_sha256(arquivo),
+        defaults={'nome_arquivo': (nome_arquivo or '')[:255]},
+    )
+    if checkpoint.concluida:
+        # A finished import sent again starts over; only interrupted ones resume
+        checkpoint.linhas_processadas = 0
+        checkpoint.concluida = False
+        checkpoint.save(update_fields=['linhas_processadas', 'concluida', 'dataAlteracao'])
+    retomada = checkpoint.linhas_processadas
+    if retomada:
+        summary['resumed_from_row'] = retomada
+
+    context = ImportContext(user, stdout=stdout)
+    try:
+        for chunk in iter_chunks(arquivo, nome_arquivo, chunk_size):
+            fim = chunk.index[-1] + 1
+            if fim <= checkpoint.linhas_processadas:
+                # Already committed; only count its rows so repeated rows keep their occurrence numbers
+                context.hashes(preparar(chunk, {'errors': []}), chave)
+                continue
+            chunk = chunk[chunk.index >= checkpoint.linhas_processadas]
+            with transaction.atomic():
+                importar(chunk, context, summary, offset)
+                checkpoint.linhas_processadas = fim
+                checkpoint.save(update_fields=['linhas_processadas', 'dataAlteracao'])
+            context.write(f'Committed rows up to {fim}')
+        checkpoint.concluida = True
+        checkpoint.save(update_fields=['concluida', 'dataAlteracao'])
+    finally:
+        # After a resume the earlier chunks' ativos are unknown here; replay them all
+        if retomada and tipo == 'movimentacoes':
+            context.ativos_alterados.update(a.pk for a in context.ativos.values())
+        if context.ativos_alterados:
+            from .services import recompute_ativos
+            recompute_ativos(context.ativos_alterados)
@@ -0,0 +1,126 @@
+"""
+Dividend income analytics: monthly and yearly totals per ativo and
+categoria, trailing 12-month yield on cost and on market value, and a
+projection of the next 12 months.
+
+Everything is read from DividendoMensal, which holds one row per ativo
+and month and is kept current as dividends are saved, deleted or
+imported, so the cost depends on the number of ativo-months, not on the
+number of payments. Results are cached per data version.
+"""
+from datetime import date
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.db.models import Sum
+from django.db.models.functions import ExtractYear
+from django.utils import timezone
+
+from .models import Ativo, DividendoMensal, VersaoDados
+
+INCOME_CACHE_TIMEOUT = 24 * 3600
+MESES_PROJECAO = 12
+
+
+# Response group -> fields each total is broken down by, outermost first.
+# Categorias are split by currency (amounts in BRL and USD don't add up) and
+# by subtipo, so ações and FIIs are reported apart.
+GRUPOS = {
+    'moedas': ('ativo__moeda',),
+    'ativos': ('ativo__ticker',),
+    'categorias': ('ativo__moeda', 'ativo__categoria__subtipo'),
+}
+
+
+def _totais(queryset, campo_chave: str) -> Tuple[List, Dict[str, Dict[str, Any]]]:
+    """
+    Columnar totals for each distinct value of campo_chave (month or year):
+    one array per currency, per ticker and per categoria within each
+    currency, from a single GROUP BY.
+    """
+    campos = sorted({campo for grupo in GRUPOS.values() for campo in grupo})
+    linhas = list(queryset.values(campo_chave, *campos).annotate(soma=Sum('total')).order_by(campo_chave))
+    chaves = sorted({linha[campo_chave] for linha in linhas})
+    posicao = {chave: i for i, chave in enumerate(chaves)}
+    resultado: Dict[str, Dict[str, Any]] = {grupo: {} for grupo in GRUPOS}
+    for linha in linhas:
+        i = posicao[linha[campo_chave]]
+        for grupo, (*externos, campo) in GRUPOS.items():
+            destino = resultado[grupo]
+            for externo in externos:
+                destino = destino.setdefault(linha[externo], {})
+            destino.setdefault(linha[campo], [0.0] * len(chaves))[i] += float(linha['soma'])
+    return chaves, resultado
+
+
+def _percentual(parte: Decimal, todo: Decimal) -> Optional[Decimal]:
+    if not todo:
+        return None
+    return (parte / todo * 100).quantize(Decimal('0.01'))
+
+
+def resumo_proventos(user, hoje: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Income report for the Dividendos page.
+
+    ``mensal`` and ``anual`` are columnar: ``meses``/``anos`` plus one array
+    per currency, per ticker and per categoria subtipo within each currency
+    (``categorias[moeda][subtipo]``). ``ativos`` has, per ativo, the
+    trailing 12-month income, its yield on cost (quantity x average price)
+    and on market value, and the next 12 months' projection. The projection
+    repeats each ativo's payments of the same calendar month over the last
+    12 months, for positions still held.
+    """
+    hoje = hoje or timezone.localdate()
+    cache_key = f'proventos:{user.pk}:{hoje.isoformat()}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    mensais = DividendoMensal.objects.filter(usuario=user)
+    meses, mensal = _totais(mensais, 'mes')
+    anos, anual = _totais(mensais.annotate(ano=ExtractYear('mes')), 'ano')
+
+    # Trailing 12 months: the current month and the 11 before it
+    mes_atual = hoje.replace(day=1)
+    inicio_12m = mes_atual - relativedelta(months=MESES_PROJECAO - 1)
+    ultimos = mensais.filter(mes__gte=inicio_12m, mes__lte=mes_atual).values_list('ativo_id', 'mes', 'total')
+
+    por_ativo: Dict[int, Dict[int, Decimal]] = {}
+    for ativo_id, mes, total in ultimos:
+        por_ativo.setdefault(ativo_id, {})[mes.month] = total
+
+    meses_projecao = [mes_atual + relativedelta(months=i) for i in range(1, MESES_PROJECAO + 1)]
+    projecao: Dict[str, List[float]] = {}
+    ativos = []
+    for ativo in Ativo.objects.filter(usuario=user, pk__in=por_ativo.keys()).values(
+        'id', 'ticker', 'moeda', 'quantidade', 'preco_medio', 'valor_atual'
+    ).order_by('ticker'):
+        pagamentos = por_ativo[ativo['id']]
+        ultimos_12m = sum(pagamentos.values(), Decimal('0'))
+        custo = ativo['quantidade'] * ativo['preco_medio']
+        em_carteira = ativo['quantidade'] > 0
+        previstos = [float(pagamentos.get(mes.month, 0)) if em_carteira else 0.0 for mes in meses_projecao]
+        coluna = projecao.setdefault(ativo['moeda'], [0.0] * MESES_PROJECAO)
+        for i, valor in enumerate(previstos):
+            coluna[i] += valor
+        ativos.append({
+            'ativo_id': ativo['id'],
+            'ticker': ativo['ticker'],
+            'moeda': ativo['moeda'],
+            'ultimos_12m': ultimos_12m,
+            'yield_on_cost': _percentual(ultimos_12m, custo) if em_carteira else None,
+            'yield_mercado': _percentual(ultimos_12m, ativo['valor_atual']) if em_carteira else None,
+            'projecao_12m': Decimal(str(sum(previstos))).quantize(Decimal('0.01')),
+        })
+
+    resultado = {
+        'mensal': {'meses': [m.strftime('%Y-%m') for m in meses], **mensal},
+        'anual': {'anos': anos, **anual},
+        'ativos': ativos,
+        'projecao': {'meses': [m.strftime('%Y-%m') for m in meses_projecao], 'moedas': projecao},
+    }
+    cache.set(cache_key, resultado, INCOME_CACHE_TIMEOUT)
+    return resultado
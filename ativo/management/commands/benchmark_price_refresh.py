@@ -0,0 +1,129 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, AsyncClient
+from django.test.utils import override_settings
+from rest_framework_simplejwt.tokens import AccessToken
+from ativo.models import Ativo, Categoria, PrecoCache
+from ativo import services
+from decimal import Decimal
+import asyncio
+import time
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = ('Compare price refresh throughput of the sync (WSGI) and async (ASGI) update_price endpoints. '
+            'Runs against a throwaway test database holding a copy of the user\'s ativos, so the '
+            'prices it fetches or simulates never reach real data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-email',
+            type=str,
+            default='b3@teste.com',
+            help='Email of the user whose ativos are refreshed (default: b3@teste.com)',
+        )
+        parser.add_argument(
+            '--latency',
+            type=float,
+            help='Replace the Yahoo Finance call with a fixed price and this many seconds of latency, '
+                 'for reproducible offline runs',
+        )
+
+    def run_sync(self, ativos, auth_header):
+        client = Client(HTTP_AUTHORIZATION=auth_header)
+        start = time.perf_counter()
+        for ativo in ativos:
+            client.post(f'/api/ativos/{ativo.pk}/update_price/')
+        return time.perf_counter() - start
+
+    def run_async(self, ativos, auth_header):
+        client = AsyncClient()
+
+        async def refresh_all():
+            await asyncio.gather(*(
+                client.post(f'/api/async/ativos/{ativo.pk}/update_price/', headers={'authorization': auth_header})
+                for ativo in ativos
+            ))
+
+        start = time.perf_counter()
+        asyncio.run(refresh_all())
+        return time.perf_counter() - start
+
+    def clear_price_cache(self, ativos):
+        # Every request must reach the provider, otherwise both paths only read PrecoCache
+        PrecoCache.objects.filter(ticker__in=[ativo.ticker for ativo in ativos]).delete()
+
+    def copy_to_test_database(self, user, ativos):
+        """
+        Create a throwaway test database and copy the user and their ativos
+        into it; returns (old database name, user, ativos) for the copy.
+        """
+        usuario = {'username': user.username, 'email': user.email}
+        copias = [
+            {
+                'ticker': ativo.ticker, 'nome': ativo.nome, 'moeda': ativo.moeda,
+                'quantidade': ativo.quantidade, 'preco_medio': ativo.preco_medio,
+                'categoria': (ativo.categoria.tipo, ativo.categoria.subtipo),
+            }
+            for ativo in ativos
+        ]
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=False)
+
+        user = User.objects.create_user(usuario['username'], usuario['email'])
+        copia_ativos = []
+        for dados in copias:
+            tipo, subtipo = dados.pop('categoria')
+            categoria, _ = Categoria.objects.get_or_create(tipo=tipo, subtipo=subtipo)
+            copia_ativos.append(Ativo.objects.create(usuario=user, categoria=categoria, **dados))
+        return old_name, user, copia_ativos
+
+    def handle(self, *args, **options):
+        user_email = options['user_email']
+        latency = options.get('latency')
+
+        try:
+            user = User.objects.get(email=user_email)
+        except User.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'User not found: {user_email}')
+            )
+            return
+
+        ativos = list(Ativo.objects.filter(usuario=user).select_related('categoria'))
+        if not ativos:
+            self.stdout.write(self.style.WARNING('User has no ativos to refresh.'))
+            return
+
+        old_name, user, ativos = self.copy_to_test_database(user, ativos)
+        self.stdout.write('Running against a throwaway test database')
+        auth_header = f'Bearer {AccessToken.for_user(user)}'
+        original_fetch = services.fetch_yahoo_price
+        if latency is not None:
+            def simulated_fetch(yahoo_ticker):
+                time.sleep(latency)
+                return Decimal('10.00')
+            services.fetch_yahoo_price = simulated_fetch
+            self.stdout.write(f'Simulating provider latency of {latency}s per call')
+
+        try:
+            self.stdout.write(f'Refreshing {len(ativos)} ativos per path...')
+            # The in-process test clients send Host: testserver
+            with override_settings(ALLOWED_HOSTS=['testserver']):
+                self.clear_price_cache(ativos)
+                sync_elapsed = self.run_sync(ativos, auth_header)
+                self.clear_price_cache(ativos)
+                async_elapsed = self.run_async(ativos, auth_header)
+        finally:
+            services.fetch_yahoo_price = original_fetch
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        for label, elapsed in (('WSGI (sync)', sync_elapsed), ('ASGI (async)', async_elapsed)):
+            self.stdout.write(
+                f'  {label}: {elapsed:.2f}s total, {len(ativos) / elapsed:.1f} refreshes/s'
+            )
+        self.stdout.write(
+            self.style.SUCCESS(f'Async speedup: {sync_elapsed / async_elapsed:.1f}x')
+        )
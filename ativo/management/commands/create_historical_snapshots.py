@@ -2,6 +2,9 @@ from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from django.db import transaction
 from ativo.models import Ativo, Movimentacao, Dividendo, EvolucaoPatrimonial
+from ativo.filters import intervalo_mes
+from ativo.metrics import provider_call, job
+from ativo.symbol_service import com_simbolo
 from decimal import Decimal
 from datetime import date, datetime
 import yfinance as yf
@@ -31,6 +34,11 @@ class Command(BaseCommand):
             type=str,
             help='End date in YYYY-MM-DD format (default: current month)',
         )
+        parser.add_argument(
+            '--all-users',
+            action='store_true',
+            help='Create snapshots for every user with assets instead of --user-email',
+        )
         parser.add_argument(
             '--dry-run',
             action='store_true',
@@ -67,35 +75,18 @@ class Command(BaseCommand):
                     return (total_custo / total_quantidade).quantize(Decimal('0.01'))
                 return Decimal('0.00')
             
-            # For variable income assets, fetch historical data from yfinance
-            yahoo_ticker = ativo.ticker
-            if ativo.moeda == 'BRL':
-                # Brazilian stocks on B3
-                yahoo_ticker = f"{ativo.ticker}.SA"
-            elif ativo.moeda == 'GBP':
-                # London Stock Exchange
-                yahoo_ticker = f"{ativo.ticker}.L"
-            
-            # Get historical data for a range around the target date
+            # For variable income assets, use the instrument's history around the target date
             start_date = target_date - relativedelta(days=10)  # 10 days before
             end_date = target_date + relativedelta(days=5)     # 5 days after
-            
-            stock = yf.Ticker(yahoo_ticker)
-            hist = stock.history(start=start_date, end=end_date)
-            
-            if hist.empty:
-                self.stdout.write(f"  No historical data found for {yahoo_ticker}")
-                # Try without suffix as fallback
-                if yahoo_ticker != ativo.ticker:
-                    stock = yf.Ticker(ativo.ticker)
-                    hist = stock.history(start=start_date, end=end_date)
-                
-                if hist.empty:
-                    self.stdout.write(f"  No historical data found for {ativo.ticker} either")
-                    return Decimal('0.00')
+
+            hist = self.get_history(ativo)
+            if hist is not None:
+                hist = hist[(hist.index >= start_date) & (hist.index < end_date)]
+            if hist is None or hist.empty:
+                self.stdout.write(f"  No historical data found for {ativo.ticker}")
+                return Decimal('0.00')
             
             # Find the closest date to our target date
-            hist.index = pd.to_datetime(hist.index).date
             available_dates = list(hist.index)
             
             # Find the closest date on or before the target date
@@ -116,6 +107,26 @@ class Command(BaseCommand):
             self.stdout.write(f"  Error fetching historical price for {ativo.ticker} on {target_date}: {str(e)}")
             return Decimal('0.00')
 
+    def get_history(self, ativo: Ativo):
+        """
+        Daily history of the ativo's instrument over the whole run, indexed by
+        date, or None. It is fetched once per instrument and shared by every
+        month and every holder, instead of one request per ativo and month.
+        """
+        chave = ativo.instrumento_id or (ativo.ticker, ativo.moeda)
+        if chave not in self.historicos:
+            def buscar_historico(yahoo_ticker):
+                with provider_call('yfinance', 'create_historical_snapshots'):
+                    hist = yf.Ticker(yahoo_ticker).history(start=self.history_start, end=self.history_end)
+                return None if hist.empty else hist
+
+            # The Yahoo symbol (.SA, .L or bare) is resolved once per ticker and stored
+            hist = com_simbolo(ativo.ticker, ativo.moeda, buscar_historico)
+            if hist is not None:
+                hist.index = pd.to_datetime(hist.index).date
+            self.historicos[chave] = hist
+        return self.historicos[chave]
+
     def calculate_quantity_at_date(self, ativo: Ativo, target_date: date) -> Decimal:
         """Calculate the quantity of an asset based on movements up to a specific date."""
         movements = Movimentacao.objects.filter(
@@ -159,14 +170,13 @@ class Command(BaseCommand):
 
     def calculate_monthly_dividends(self, ativo: Ativo, snapshot_date: date) -> Decimal:
         """Calculate total dividends for an asset in a specific month."""
-        year = snapshot_date.year
-        month = snapshot_date.month
+        inicio, fim = intervalo_mes(snapshot_date.year, snapshot_date.month)
         
         # Get all dividends for this asset in the specified month
         monthly_dividends = Dividendo.objects.filter(
             ativo=ativo,
-            data__year=year,
-            data__month=month
+            data__gte=inicio,
+            data__lt=fim
         )
         
         total_dividends = sum(dividend.valor for dividend in monthly_dividends)
@@ -241,9 +251,13 @@ class Command(BaseCommand):
         dry_run = options['dry_run']
         
         try:
-            # Get user
-            user = User.objects.get(email=user_email)
-            self.stdout.write(f'Creating historical snapshots for user: {user_email}')
+            # Get users
+            if options['all_users']:
+                users = User.objects.filter(ativos__isnull=False).distinct()
+                user_email = 'all users'
+            else:
+                users = [User.objects.get(email=user_email)]
+            self.stdout.write(f'Creating historical snapshots for: {user_email}')
             
             # Parse dates
             start_date = datetime.strptime(start_date_str, '%Y-%m-%d').date()
@@ -258,13 +272,18 @@ class Command(BaseCommand):
             end_date = end_date.replace(day=1)
             
             self.stdout.write(f'Date range: {start_date} to {end_date}')
+
+            # One history request per instrument covers every month of the run
+            self.historicos = {}
+            self.history_start = start_date - relativedelta(days=10)
+            self.history_end = end_date + relativedelta(days=5)
             
             if dry_run:
                 self.stdout.write(self.style.WARNING('DRY RUN MODE - No snapshots will be created'))
             
-            # Get all assets for the user
-            ativos = Ativo.objects.filter(usuario=user)
-            self.stdout.write(f'Found {ativos.count()} assets for user')
+            # Get all assets of the users
+            ativos = Ativo.objects.filter(usuario__in=users).select_related('categoria')
+            self.stdout.write(f'Found {ativos.count()} assets')
             
             # Generate list of months to process
             current_date = start_date
@@ -279,30 +298,33 @@ class Command(BaseCommand):
             total_snapshots = 0
             
             # Process each month
-            for month_date in months_to_process:
-                self.stdout.write(f'\n📅 Processing {month_date.strftime("%B %Y")}...')
+            with job('historical_snapshots') as rows_written:
+                for month_date in months_to_process:
+                    self.stdout.write(f'\n📅 Processing {month_date.strftime("%B %Y")}...')
                 
-                month_snapshots = 0
+                    month_snapshots = 0
                 
-                # For each asset, check if it had any movements by this date
-                for ativo in ativos:
-                    # Check if asset had any movements by this date
-                    movements_count = Movimentacao.objects.filter(
-                        ativo=ativo,
-                        data__lte=month_date
-                    ).count()
+                    # For each asset, check if it had any movements by this date
+                    for ativo in ativos:
+                        # Check if asset had any movements by this date
+                        movements_count = Movimentacao.objects.filter(
+                            ativo=ativo,
+                            data__lte=month_date
+                        ).count()
                     
-                    if movements_count == 0:
-                        continue  # Skip assets with no movements yet
+                        if movements_count == 0:
+                            continue  # Skip assets with no movements yet
                     
-                    self.stdout.write(f'  Processing {ativo.ticker}...')
+                        self.stdout.write(f'  Processing {ativo.ticker}...')
                     
-                    snapshot = self.create_historical_snapshot(ativo, month_date, dry_run)
-                    if snapshot:
-                        month_snapshots += 1
+                        snapshot = self.create_historical_snapshot(ativo, month_date, dry_run)
+                        if snapshot:
+                            month_snapshots += 1
                 
-                self.stdout.write(f'  ✅ {month_date.strftime("%B %Y")}: {month_snapshots} snapshots processed')
-                total_snapshots += month_snapshots
+                    self.stdout.write(f'  ✅ {month_date.strftime("%B %Y")}: {month_snapshots} snapshots processed')
+                    total_snapshots += month_snapshots
+                    if not dry_run:
+                        rows_written(month_snapshots)
             
             mode_text = " (DRY RUN)" if dry_run else ""
             self.stdout.write(
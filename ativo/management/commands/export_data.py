@@ -0,0 +1,73 @@
+from django.core.management.base import BaseCommand
+from django.contrib.auth import get_user_model
+from ativo.export_service import export_dataset, EXPORT_DATASETS, EXPORT_FORMATS, EXPORT_CHUNK_SIZE
+
+User = get_user_model()
+
+class Command(BaseCommand):
+    help = 'Export a user\'s movimentacoes, dividendos, snapshots or evolucao as CSV or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user-email',
+            type=str,
+            required=True,
+            help='Email of the user to export data for',
+        )
+        parser.add_argument(
+            '--dataset',
+            type=str,
+            required=True,
+            choices=list(EXPORT_DATASETS),
+            help='Dataset to export',
+        )
+        parser.add_argument(
+            '--format',
+            type=str,
+            default='csv',
+            choices=list(EXPORT_FORMATS),
+            help='Output format (default: csv)',
+        )
+        parser.add_argument(
+            '--output',
+            type=str,
+            help='Output file path (default: <dataset>.<format>)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=EXPORT_CHUNK_SIZE,
+            help=f'Rows read per database round trip (default: {EXPORT_CHUNK_SIZE})',
+        )
+
+    def handle(self, *args, **options):
+        user_email = options['user_email']
+        dataset = options['dataset']
+        file_format = options['format']
+        output = options.get('output') or f'{dataset}.{EXPORT_FORMATS[file_format][1]}'
+
+        try:
+            user = User.objects.get(email=user_email)
+        except User.DoesNotExist:
+            self.stdout.write(
+                self.style.ERROR(f'User not found: {user_email}')
+            )
+            return
+
+        try:
+            content = export_dataset(dataset, user, file_format, options['chunk_size'])
+            if file_format == 'csv':
+                with open(output, 'w', newline='', encoding='utf-8') as f:
+                    for chunk in content:
+                        f.write(chunk)
+            else:
+                with open(output, 'wb') as f:
+                    for chunk in content:
+                        f.write(chunk)
+        except ValueError as e:
+            self.stdout.write(self.style.ERROR(str(e)))
+            return
+
+        self.stdout.write(
+            self.style.SUCCESS(f'Exported {dataset} for {user_email} to {output}')
+        )
@@ -0,0 +1,34 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from ativo.benchmark_service import carregar_serie, ler_arquivo
+from ativo.models import IndiceBenchmark
+
+
+class Command(BaseCommand):
+    help = 'Load benchmark index values (CDI, IBOV, IPCA) from a CSV or Parquet file'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file',
+            type=str,
+            required=True,
+            help='CSV or Parquet file with data and valor columns (and indice, unless --indice is given)',
+        )
+        parser.add_argument(
+            '--indice',
+            type=str,
+            choices=[codigo for codigo, _ in IndiceBenchmark.INDICE_CHOICES],
+            help='Index of every row in the file',
+        )
+
+    def handle(self, *args, **options):
+        file_path = options['file']
+        if not os.path.exists(file_path):
+            raise CommandError(f'File not found: {file_path}')
+
+        try:
+            linhas = carregar_serie(ler_arquivo(file_path), options['indice'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        self.stdout.write(self.style.SUCCESS(f'Loaded {linhas} benchmark values from {file_path}'))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+from ativo.models import RegistroExcluido
+
+class Command(BaseCommand):
+    help = f'Delete change-feed tombstones older than {RegistroExcluido.RETENCAO_DIAS} days'
+
+    def handle(self, *args, **options):
+        removidos = RegistroExcluido.limpar_antigos()
+        self.stdout.write(
+            self.style.SUCCESS(f'Removed {removidos} tombstones')
+        )
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from ativo.icon_service import SEM_ICONE, resolve_icons
+from ativo.models import Ativo
+
+
+class Command(BaseCommand):
+    help = 'Look up icons for ativos that have none (each distinct ticker is probed once)'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--all',
+            action='store_true',
+            help='Refresh every ativo, including those that already have an icon',
+        )
+        parser.add_argument(
+            '--user-email',
+            type=str,
+            help='Only ativos of the user with this email',
+        )
+
+    def handle(self, *args, **options):
+        ativos = Ativo.objects.all()
+        if options['user_email']:
+            ativos = ativos.filter(usuario__email=options['user_email'])
+        if not options['all']:
+            ativos = ativos.filter(SEM_ICONE)
+        ativo_ids = list(ativos.values_list('pk', flat=True))
+
+        self.stdout.write(f'Resolving icons for {len(ativo_ids)} ativos...')
+        updated = resolve_icons(ativo_ids, force=options['all'])
+        self.stdout.write(self.style.SUCCESS(f'Updated icons of {updated} ativos'))
@@ -1,6 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.contrib.auth import get_user_model
 from ativo.models import EvolucaoPatrimonial
+from datetime import date
 
 User = get_user_model()
 
@@ -46,7 +47,7 @@ class Command(BaseCommand):
             self.stdout.write('')
             self.stdout.write('📈 Sample June 2025 Portfolio Values:')
             
-            june_snapshots = snapshots.filter(data__year=2025, data__month=6).order_by('-valor_total')[:5]
+            june_snapshots = snapshots.filter(data__gte=date(2025, 6, 1), data__lt=date(2025, 7, 1)).order_by('-valor_total')[:5]
             for snap in june_snapshots:
                 self.stdout.write(
                     f'  {snap.ativo.ticker}: {snap.quantidade} shares @ '
@@ -0,0 +1,114 @@
+"""
+Prometheus metrics for the price cache, external providers and batch jobs.
+
+Requires the optional prometheus_client package; without it every helper
+here is a no-op and /metrics answers 503. To aggregate across gunicorn
+workers, point PROMETHEUS_MULTIPROC_DIR at an empty directory before the
+workers start (see gunicorn.conf.py at the project root): each process
+then writes its samples to files there and /metrics merges them on scrape.
+Scrapes are limited to the addresses and token in settings.METRICS.
+"""
+import os
+from contextlib import contextmanager
+from time import perf_counter
+
+try:
+    import prometheus_client
+except ImportError:
+    prometheus_client = None
+
+JOB_BUCKETS = (0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+CACHE_AGE_BUCKETS = (60, 300, 900, 1800, 3600, 3 * 3600, 6 * 3600, 12 * 3600, 24 * 3600, 7 * 24 * 3600)
+
+if prometheus_client is not None:
+    PRECO_CACHE_LOOKUPS = prometheus_client.Counter(
+        'investsmart_preco_cache_lookups_total',
+        'PrecoCache lookups by result (hit, stale, miss)',
+        ['call_site', 'result'],
+    )
+    PRECO_CACHE_AGE = prometheus_client.Histogram(
+        'investsmart_preco_cache_age_seconds',
+        'Age of the PrecoCache entry found on lookup',
+        ['call_site'],
+        buckets=CACHE_AGE_BUCKETS,
+    )
+    PROVIDER_LATENCY = prometheus_client.Histogram(
+        'investsmart_provider_request_seconds',
+        'Latency of calls to external data providers',
+        ['provider', 'call_site'],
+    )
+    PROVIDER_ERRORS = prometheus_client.Counter(
+        'investsmart_provider_errors_total',
+        'Failed calls to external data providers',
+        ['provider', 'call_site'],
+    )
+    JOB_DURATION = prometheus_client.Histogram(
+        'investsmart_job_duration_seconds',
+        'Duration of snapshot and import jobs',
+        ['job'],
+        buckets=JOB_BUCKETS,
+    )
+    JOB_ROWS = prometheus_client.Counter(
+        'investsmart_job_rows_written_total',
+        'Rows written by snapshot and import jobs',
+        ['job'],
+    )
+
+
+def record_cache_lookup(call_site: str, age_seconds, fresh: bool) -> None:
+    """Count a PrecoCache lookup; age_seconds is None when there was no entry."""
+    if prometheus_client is None:
+        return
+    if age_seconds is None:
+        PRECO_CACHE_LOOKUPS.labels(call_site, 'miss').inc()
+        return
+    PRECO_CACHE_LOOKUPS.labels(call_site, 'hit' if fresh else 'stale').inc()
+    PRECO_CACHE_AGE.labels(call_site).observe(age_seconds)
+
+
+@contextmanager
+def provider_call(provider: str, call_site: str):
+    """Time a call to an external provider, counting it as an error if it raises."""
+    if prometheus_client is None:
+        yield
+        return
+    start = perf_counter()
+    try:
+        yield
+    except Exception:
+        PROVIDER_ERRORS.labels(provider, call_site).inc()
+        raise
+    finally:
+        PROVIDER_LATENCY.labels(provider, call_site).observe(perf_counter() - start)
+
+
+def record_provider_error(provider: str, call_site: str) -> None:
+    """For providers that report failure without raising (e.g. an empty response)."""
+    if prometheus_client is not None:
+        PROVIDER_ERRORS.labels(provider, call_site).inc()
+
+
+@contextmanager
+def job(name: str):
+    """Time a batch job; call the yielded function with the number of rows written."""
+    if prometheus_client is None:
+        yield lambda rows: None
+        return
+    start = perf_counter()
+    try:
+        yield JOB_ROWS.labels(name).inc
+    finally:
+        JOB_DURATION.labels(name).observe(perf_counter() - start)
+
+
+def render_metrics():
+    """Return (body, content_type) for the scrape endpoint."""
+    if prometheus_client is None:
+        raise RuntimeError('Metrics require the prometheus_client package')
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        registry = prometheus_client.CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = prometheus_client.REGISTRY
+    return prometheus_client.generate_latest(registry), prometheus_client.CONTENT_TYPE_LATEST
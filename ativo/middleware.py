@@ -0,0 +1,91 @@
+import logging
+from time import perf_counter
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.db.backends.signals import connection_created
+
+from .timing import start_request, end_request, record_query
+
+slow_request_logger = logging.getLogger('ativo.slow_requests')
+
+# Server-Timing metric names, in header order
+SERVER_TIMING_METRICS = ('db', 'price', 'icon', 'serializer')
+
+
+def _install_query_recorder(connection, **kwargs):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+class RequestTimingMiddleware:
+    """
+    Opt-in per-request instrumentation (settings.REQUEST_TIMING['ENABLED']).
+
+    Adds a Server-Timing header with SQL count/time, price provider time,
+    icon provider time, serializer time and total time, and logs requests
+    slower than SLOW_REQUEST_MS to the "ativo.slow_requests" logger together
+    with their slowest queries. The buckets overlap: queries and price
+    lookups made while serializing also count as serializer time.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        config = getattr(settings, 'REQUEST_TIMING', {})
+        if not config.get('ENABLED'):
+            raise MiddlewareNotUsed
+        self.slow_request_ms = config.get('SLOW_REQUEST_MS', 500)
+        self.top_queries = config.get('TOP_QUERIES', 5)
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+        connection_created.connect(_install_query_recorder, dispatch_uid='ativo_request_timing')
+        for connection in connections.all(initialized_only=True):
+            _install_query_recorder(connection)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        timings, token = start_request(self.top_queries)
+        start = perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    async def __acall__(self, request):
+        timings, token = start_request(self.top_queries)
+        start = perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            end_request(token)
+        return self.finish(request, response, timings, perf_counter() - start)
+
+    def finish(self, request, response, timings, total):
+        metrics = []
+        for name in SERVER_TIMING_METRICS:
+            if name in timings.counts:
+                metrics.append(
+                    f'{name};dur={timings.durations[name] * 1000:.1f};desc="{timings.counts[name]} calls"'
+                )
+        metrics.append(f'total;dur={total * 1000:.1f}')
+        response['Server-Timing'] = ', '.join(metrics)
+
+        if total * 1000 >= self.slow_request_ms:
+            queries = '\n'.join(
+                f'  {duration * 1000:.1f}ms {sql}' for duration, sql in timings.slowest_queries()
+            )
+            slow_request_logger.warning(
+                f"Slow request {request.method} {request.get_full_path()} -> {response.status_code}: "
+                f"{total * 1000:.0f}ms total, {timings.counts['db']} queries in {timings.durations['db'] * 1000:.0f}ms, "
+                f"price {timings.durations['price'] * 1000:.0f}ms, serializer {timings.durations['serializer'] * 1000:.0f}ms"
+                + (f"\nSlowest queries:\n{queries}" if queries else '')
+            )
+        return response
@@ -0,0 +1,43 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:46
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+
+
+def copy_usuario_from_ativo(apps, schema_editor):
+    Ativo = apps.get_model('ativo', 'Ativo')
+    usuario = Subquery(Ativo.objects.filter(pk=OuterRef('ativo_id')).values('usuario_id')[:1])
+    for model_name in ('Movimentacao', 'Dividendo'):
+        apps.get_model('ativo', model_name).objects.update(usuario_id=usuario)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0016_versaodados'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dividendo',
+            name='usuario',
+            field=models.ForeignKey(editable=False, help_text='Copiado de ativo.usuario para paginação por índice', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='movimentacao',
+            name='usuario',
+            field=models.ForeignKey(editable=False, help_text='Copiado de ativo.usuario para paginação por índice', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='dividendo',
+            index=models.Index(fields=['usuario', 'data', 'dataCriacao', 'id'], name='ativo_div_usuario_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['usuario', 'data', 'dataCriacao', 'id'], name='ativo_mov_usuario_data_idx'),
+        ),
+        migrations.RunPython(copy_usuario_from_ativo, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:53
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0017_movimentacao_dividendo_usuario'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RegistroExcluido',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('modelo', models.CharField(choices=[('ativo', 'Ativo'), ('movimentacao', 'Movimentação'), ('dividendo', 'Dividendo'), ('snapshot', 'Snapshot')], max_length=20)),
+                ('objeto_id', models.BigIntegerField()),
+                ('data_exclusao', models.DateTimeField(auto_now_add=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Registro Excluído',
+                'verbose_name_plural': 'Registros Excluídos',
+                'indexes': [models.Index(fields=['usuario', 'data_exclusao'], name='ativo_regis_usuario_1594b8_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+import unicodedata
+
+from django.db import migrations
+
+
+def normalizar(texto):
+    # Copy of ativo.search.normalizar as it was when this migration was written
+    decomposed = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    Ativo = apps.get_model('ativo', 'Ativo')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "CREATE VIRTUAL TABLE ativo_busca USING fts5("
+            "usuario, ticker, nome, ativo_id UNINDEXED, "
+            "tokenize='unicode61 remove_diacritics 2', prefix='2 3')"
+        )
+        cursor.executemany(
+            'INSERT INTO ativo_busca (usuario, ticker, nome, ativo_id) VALUES (%s, %s, %s, %s)',
+            [
+                (f'u{usuario_id}', normalizar(ticker), normalizar(nome), pk)
+                for pk, usuario_id, ticker, nome in Ativo.objects.values_list('pk', 'usuario_id', 'ticker', 'nome')
+            ],
+        )
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DROP TABLE IF EXISTS ativo_busca')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0018_registroexcluido'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 00:56
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0019_ativo_busca'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='dividendo',
+            index=models.Index(fields=['ativo', 'data'], name='ativo_div_ativo_data_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movimentacao',
+            index=models.Index(fields=['ativo', 'data', 'dataCriacao'], name='ativo_mov_ativo_data_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:02
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0020_ativo_data_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportacaoArquivo',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tipo', models.CharField(choices=[('movimentacoes', 'Movimentações'), ('dividendos', 'Dividendos')], max_length=20)),
+                ('sha256', models.CharField(help_text='Hash do conteúdo do arquivo', max_length=64)),
+                ('nome_arquivo', models.CharField(blank=True, max_length=255)),
+                ('linhas_processadas', models.PositiveIntegerField(default=0)),
+                ('concluida', models.BooleanField(default=False)),
+                ('dataCriacao', models.DateTimeField(auto_now_add=True)),
+                ('dataAlteracao', models.DateTimeField(auto_now=True)),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Importação de Arquivo',
+                'verbose_name_plural': 'Importações de Arquivos',
+                'unique_together': {('usuario', 'tipo', 'sha256')},
+            },
+        ),
+    ]
@@ -0,0 +1,67 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:07
+
+import hashlib
+from datetime import date
+from decimal import Decimal
+
+from django.db import migrations, models
+
+
+# Copies of the ativo.import_service helpers as they were when this
+# migration was written, so later changes there cannot alter the backfill
+def _canonico(valor):
+    if isinstance(valor, Decimal):
+        return f'{valor.normalize():f}'
+    if isinstance(valor, date):
+        return valor.isoformat()
+    return str(valor)
+
+
+def chave_importacao(usuario_id, valores):
+    return '|'.join([str(usuario_id)] + [_canonico(valor) for valor in valores])
+
+
+def hash_importacao(chave, ocorrencia=0):
+    return hashlib.sha256(f'{chave}|{ocorrencia}'.encode()).hexdigest()
+
+
+CHAVES = {
+    'Movimentacao': ['ativo__ticker', 'data', 'operacao', 'quantidade', 'valorUnitario'],
+    'Dividendo': ['ativo__ticker', 'data', 'valor'],
+}
+
+
+def preencher_hashes(apps, schema_editor):
+    # Rows already stored get the hash the importer would give them, so the
+    # first re-import after this migration does not duplicate them
+    for model_name, campos in CHAVES.items():
+        model = apps.get_model('ativo', model_name)
+        ocorrencias = {}
+        atualizadas = []
+        for row in model.objects.order_by('id').values_list('id', 'ativo__usuario_id', *campos).iterator():
+            chave = chave_importacao(row[1], row[2:])
+            ocorrencia = ocorrencias.get(chave, 0)
+            ocorrencias[chave] = ocorrencia + 1
+            atualizadas.append(model(id=row[0], hash_importacao=hash_importacao(chave, ocorrencia)))
+        model.objects.bulk_update(atualizadas, ['hash_importacao'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0021_importacaoarquivo'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='dividendo',
+            name='hash_importacao',
+            field=models.CharField(blank=True, editable=False, help_text='Hash do conteúdo da linha importada; evita duplicatas ao reimportar', max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name='movimentacao',
+            name='hash_importacao',
+            field=models.CharField(blank=True, editable=False, help_text='Hash do conteúdo da linha importada; evita duplicatas ao reimportar', max_length=64, null=True, unique=True),
+        ),
+        migrations.RunPython(preencher_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0022_hash_importacao'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IconeCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20, unique=True)),
+                ('url', models.URLField(blank=True, null=True)),
+                ('status', models.CharField(choices=[('ENCONTRADO', 'Encontrado'), ('NAO_ENCONTRADO', 'Não encontrado')], max_length=20)),
+                ('checked_at', models.DateTimeField()),
+            ],
+            options={
+                'verbose_name': 'Cache de Ícone',
+                'verbose_name_plural': 'Cache de Ícones',
+            },
+        ),
+    ]
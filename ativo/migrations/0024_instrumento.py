@@ -0,0 +1,146 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+# Company names that used to be hard-coded in the import_excel_data command
+NOMES = {
+    # Bancos
+    'BBAS3': 'Banco do Brasil S.A.',
+    'ITUB4': 'Itaú Unibanco Holding S.A.',
+    'BBDC4': 'Banco Bradesco S.A.',
+    'SANB11': 'Banco Santander Brasil S.A.',
+    'ITSA4': 'Itaúsa - Investimentos Itaú S.A.',
+
+    # Energia
+    'EGIE3': 'Engie Brasil Energia S.A.',
+    'CPLE3': 'Copel - Companhia Paranaense de Energia',
+    'TAEE3': 'Taesa - Transmissora Aliança de Energia Elétrica S.A.',
+    'PETR4': 'Petróleo Brasileiro S.A. - Petrobras',
+    'VALE3': 'Vale S.A.',
+
+    # Indústria
+    'WEGE3': 'WEG S.A.',
+    'GOAU3': 'Metalúrgica Gerdau S.A.',
+    'GOAU4': 'Metalúrgica Gerdau S.A.',
+    'KLBN3': 'Klabin S.A.',
+    'KLBN4': 'Klabin S.A.',
+    'SUZB3': 'Suzano S.A.',
+    'USIM5': 'Usinas Siderúrgicas de Minas Gerais S.A.',
+
+    # Seguros/Previdência
+    'PSSA3': 'Porto Seguro S.A.',
+
+    # Logística/Transporte
+    'TGMA3': 'Tegma Gestão Logística S.A.',
+    'RAIL3': 'Rumo S.A.',
+
+    # Varejo
+    'MGLU3': 'Magazine Luiza S.A.',
+    'VVAR3': 'Via S.A.',
+    'LREN3': 'Lojas Renner S.A.',
+
+    # Tecnologia
+    'TOTS3': 'Totvs S.A.',
+    'POSI3': 'Positivo Tecnologia S.A.',
+
+    # Telecomunicações
+    'VIVT3': 'Telefônica Brasil S.A.',
+    'TIMS3': 'TIM S.A.',
+
+    # Alimentação
+    'BRFS3': 'BRF S.A.',
+    'JBSS3': 'JBS S.A.',
+    'MRFG3': 'Marfrig Global Foods S.A.',
+
+    # Fundos Imobiliários (FII)
+    'KNRI11': 'Kinea Renda Imobiliária Fundo de Investimento Imobiliário',
+    'HGLG11': 'Cshg Logística Fundo de Investimento Imobiliário',
+    'BTLG11': 'BTG Pactual Logística Fundo de Investimento Imobiliário',
+    'XPML11': 'XP Malls Fundo de Investimento Imobiliário',
+    'XPLG11': 'XP Log Fundo de Investimento Imobiliário',
+    'CPTS11': 'Capitânia Securities Fundo de Investimento Imobiliário',
+    'FGAA11': 'FGA Fundo de Investimento Imobiliário',
+    'RBHY11': 'RBR Alpha High Yield Fundo de Investimento Imobiliário',
+    'VGIP11': 'Valora Fundo de Investimento Imobiliário',
+    'HCTR11': 'Hospital da Criança Fundo de Investimento Imobiliário',
+    'IRDM11': 'Iridium Fundo de Investimento Imobiliário',
+    'TECB11': 'TG Ativo Real Fundo de Investimento Imobiliário',
+    'KNIP11': 'Kinea Índices de Preços Fundo de Investimento Imobiliário',
+}
+
+
+def criar_instrumentos(apps, schema_editor):
+    Ativo = apps.get_model('ativo', 'Ativo')
+    Categoria = apps.get_model('ativo', 'Categoria')
+    Instrumento = apps.get_model('ativo', 'Instrumento')
+
+    # Names and categorias come from NOMES and the ticker alone: a user's own
+    # ativo nome or categoria is never copied into the shared row
+    categorias = {c.subtipo: c.pk for c in Categoria.objects.filter(tipo='RENDA_VARIAVEL', subtipo__in=['ACOES', 'FII'])}
+    instrumentos = {}
+    for ativo in Ativo.objects.order_by('id'):
+        chave = (ativo.ticker, ativo.moeda)
+        instrumento = instrumentos.get(chave)
+        if instrumento is None:
+            curado = ativo.moeda == 'BRL' and ativo.ticker in NOMES
+            instrumento = instrumentos[chave] = Instrumento(
+                ticker=ativo.ticker,
+                moeda=ativo.moeda,
+                bolsa='B3' if ativo.moeda == 'BRL' else '',
+                nome=NOMES[ativo.ticker] if curado else '',
+                categoria_sugerida_id=categorias.get('FII' if ativo.ticker.endswith('11') else 'ACOES') if curado else None,
+            )
+        if not instrumento.icone_url and ativo.icone_url:
+            instrumento.icone_url = ativo.icone_url
+
+    for ticker, nome in NOMES.items():
+        if (ticker, 'BRL') not in instrumentos:
+            instrumentos[(ticker, 'BRL')] = Instrumento(
+                ticker=ticker, moeda='BRL', bolsa='B3', nome=nome,
+                categoria_sugerida_id=categorias.get('FII' if ticker.endswith('11') else 'ACOES'),
+            )
+    Instrumento.objects.bulk_create(instrumentos.values())
+
+    ids = {(i.ticker, i.moeda): i.pk for i in Instrumento.objects.all()}
+    ativos = list(Ativo.objects.only('id', 'ticker', 'moeda'))
+    for ativo in ativos:
+        ativo.instrumento_id = ids[(ativo.ticker, ativo.moeda)]
+    Ativo.objects.bulk_update(ativos, ['instrumento'], batch_size=500)
+
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0023_iconecache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Instrumento',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ticker', models.CharField(max_length=20)),
+                ('moeda', models.CharField(choices=[('BRL', 'Real'), ('USD', 'Dólar Americano'), ('EUR', 'Euro'), ('GBP', 'Libra Esterlina')], default='BRL', max_length=3)),
+                ('bolsa', models.CharField(blank=True, help_text='Bolsa onde é negociado (ex.: B3)', max_length=20)),
+                ('yahoo_symbol', models.CharField(blank=True, help_text='Símbolo no Yahoo Finance (ex.: PETR4.SA)', max_length=30)),
+                ('nome', models.CharField(blank=True, max_length=200)),
+                ('icone_url', models.URLField(blank=True, null=True)),
+                ('dataCriacao', models.DateTimeField(auto_now_add=True)),
+                ('dataAlteracao', models.DateTimeField(auto_now=True)),
+                ('categoria_sugerida', models.ForeignKey(blank=True, help_text='Categoria usada para novos ativos deste ticker', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='ativo.categoria')),
+            ],
+            options={
+                'verbose_name': 'Instrumento',
+                'verbose_name_plural': 'Instrumentos',
+                'unique_together': {('ticker', 'moeda')},
+            },
+        ),
+        migrations.AddField(
+            model_name='ativo',
+            name='instrumento',
+            field=models.ForeignKey(blank=True, help_text='Dados do ticker compartilhados entre usuários', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ativos', to='ativo.instrumento'),
+        ),
+        migrations.RunPython(criar_instrumentos, migrations.RunPython.noop),
+    ]
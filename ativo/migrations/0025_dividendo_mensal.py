@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:23
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncMonth
+
+
+def agregar_dividendos(apps, schema_editor):
+    Dividendo = apps.get_model('ativo', 'Dividendo')
+    DividendoMensal = apps.get_model('ativo', 'DividendoMensal')
+    linhas = Dividendo.objects.annotate(mes=TruncMonth('data')).values('ativo_id', 'ativo__usuario_id', 'mes').annotate(
+        total=Sum('valor'), pagamentos=Count('id')
+    ).order_by()
+    DividendoMensal.objects.bulk_create([
+        DividendoMensal(ativo_id=linha['ativo_id'], usuario_id=linha['ativo__usuario_id'], mes=linha['mes'],
+                        total=linha['total'], pagamentos=linha['pagamentos'])
+        for linha in linhas
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0024_instrumento'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DividendoMensal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('mes', models.DateField(help_text='Primeiro dia do mês')),
+                ('total', models.DecimalField(decimal_places=2, default=0, max_digits=15)),
+                ('pagamentos', models.PositiveIntegerField(default=0)),
+                ('ativo', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='ativo.ativo')),
+                ('usuario', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Dividendo Mensal',
+                'verbose_name_plural': 'Dividendos Mensais',
+                'indexes': [models.Index(fields=['usuario', 'mes'], name='ativo_divmes_usuario_mes_idx')],
+                'unique_together': {('ativo', 'mes')},
+            },
+        ),
+        migrations.RunPython(agregar_dividendos, migrations.RunPython.noop),
+    ]
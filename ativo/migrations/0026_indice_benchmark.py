@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-19 01:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0025_dividendo_mensal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IndiceBenchmark',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('indice', models.CharField(choices=[('CDI', 'CDI'), ('IBOV', 'Ibovespa'), ('IPCA', 'IPCA')], max_length=10)),
+                ('data', models.DateField()),
+                ('valor', models.DecimalField(decimal_places=8, max_digits=20)),
+            ],
+            options={
+                'verbose_name': 'Índice de Referência',
+                'verbose_name_plural': 'Índices de Referência',
+                'unique_together': {('indice', 'data')},
+            },
+        ),
+    ]
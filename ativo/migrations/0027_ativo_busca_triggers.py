@@ -0,0 +1,57 @@
+from django.db import migrations
+
+# Keep ativo_busca in sync inside the database, so QuerySet.update and bulk
+# writes, which skip the model signals, update the index too. The ativo id
+# becomes the FTS rowid, which makes the trigger deletes index lookups.
+TRIGGERS = [
+    """
+    CREATE TRIGGER ativo_busca_insert AFTER INSERT ON ativo_ativo BEGIN
+        INSERT INTO ativo_busca (rowid, usuario, ticker, nome, ativo_id)
+        VALUES (new.id, 'u' || new.usuario_id, new.ticker, new.nome, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER ativo_busca_update AFTER UPDATE OF usuario_id, ticker, nome ON ativo_ativo BEGIN
+        DELETE FROM ativo_busca WHERE rowid = old.id;
+        INSERT INTO ativo_busca (rowid, usuario, ticker, nome, ativo_id)
+        VALUES (new.id, 'u' || new.usuario_id, new.ticker, new.nome, new.id);
+    END
+    """,
+    """
+    CREATE TRIGGER ativo_busca_delete AFTER DELETE ON ativo_ativo BEGIN
+        DELETE FROM ativo_busca WHERE rowid = old.id;
+    END
+    """,
+]
+
+
+def create_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute('DELETE FROM ativo_busca')
+        cursor.execute(
+            "INSERT INTO ativo_busca (rowid, usuario, ticker, nome, ativo_id) "
+            "SELECT id, 'u' || usuario_id, ticker, nome, id FROM ativo_ativo"
+        )
+        for trigger in TRIGGERS:
+            cursor.execute(trigger)
+
+
+def drop_triggers(apps, schema_editor):
+    if schema_editor.connection.vendor != 'sqlite':
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for nome in ('ativo_busca_insert', 'ativo_busca_update', 'ativo_busca_delete'):
+            cursor.execute(f'DROP TRIGGER IF EXISTS {nome}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0026_indice_benchmark'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_triggers, drop_triggers),
+    ]
@@ -0,0 +1,27 @@
+from django.db import migrations
+
+# The category default icons (icon_service.CATEGORY_ICONS) used to be stored
+# on a miss; stored, they hide the icon cache and keep the ativo out of
+# refresh_icons. Clearing them lets get_icon_url fall back as intended.
+ICONES_DE_CATEGORIA = [
+    'https://cdn-icons-png.flaticon.com/512/2830/2830284.png',
+    'https://cdn-icons-png.flaticon.com/512/1077/1077976.png',
+    'https://cdn-icons-png.flaticon.com/512/5968/5968260.png',
+    'https://cdn-icons-png.flaticon.com/512/1077/1077114.png',
+]
+
+
+def limpar_icones(apps, schema_editor):
+    for modelo in ('Ativo', 'Instrumento'):
+        apps.get_model('ativo', modelo).objects.filter(icone_url__in=ICONES_DE_CATEGORIA).update(icone_url=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ativo', '0027_ativo_busca_triggers'),
+    ]
+
+    operations = [
+        migrations.RunPython(limpar_icones, migrations.RunPython.noop),
+    ]
@@ -1,13 +1,18 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.conf import settings
 from django.utils import timezone
 from decimal import Decimal, ROUND_HALF_UP
-from django.db.models.signals import post_save, post_delete
+from datetime import timedelta
+from dateutil.relativedelta import relativedelta
+from django.db.models import Count, OuterRef, Subquery, Sum
+from django.db.models.functions import TruncMonth, Upper
+from django.db.models.signals import post_save, post_delete, pre_save
 from django.dispatch import receiver
 from django.core.validators import MinValueValidator
 import yfinance as yf
 import logging
 from typing import Optional, Tuple
+from .metrics import record_cache_lookup
 
 logger = logging.getLogger(__name__)
 
@@ -66,6 +71,13 @@ class Categoria(models.Model):
     def __str__(self):
         return f"{self.tipo} - {self.subtipo}"
 
+class AtivoQuerySet(models.QuerySet):
+    def com_icone_cache(self):
+        """Annotate icone_cache_url (the cached icon of each ticker), so get_icon_url needs no query per ativo."""
+        return self.annotate(icone_cache_url=Subquery(
+            IconeCache.objects.filter(ticker=Upper(OuterRef('ticker')), status='ENCONTRADO').values('url')[:1]
+        ))
+
 class Ativo(models.Model):
     MOEDA_CHOICES = [
         ('BRL', 'Real'),
@@ -85,6 +97,7 @@ class Ativo(models.Model):
     dataVencimento = models.DateField(null=True, blank=True, help_text='Data de vencimento para investimentos de renda fixa')
     anotacao = models.TextField(blank=True, help_text='Anotações gerais sobre o ativo')
     icone_url = models.URLField(blank=True, null=True, help_text='URL do ícone do ativo')
+    instrumento = models.ForeignKey('Instrumento', on_delete=models.SET_NULL, null=True, blank=True, related_name='ativos', help_text='Dados do ticker compartilhados entre usuários')
     dataCriacao = models.DateTimeField(auto_now_add=True)
     dataAlteracao = models.DateTimeField(auto_now=True)
     valor_atual = models.DecimalField(max_digits=15, decimal_places=2, default=0)
@@ -96,13 +109,33 @@ class Ativo(models.Model):
         verbose_name_plural = 'Ativos'
         unique_together = ['ticker', 'usuario']
 
+    objects = AtivoQuerySet.as_manager()
+
     def __str__(self):
         return f"{self.ticker} - {self.nome}"
+
+    def save(self, *args, **kwargs):
+        # Partial saves (price, position) never change ticker or moeda
+        if not kwargs.get('update_fields') and (
+            self.instrumento_id is None
+            or (self.instrumento.ticker, self.instrumento.moeda) != (self.ticker, self.moeda)
+        ):
+            # The shared row is never named after one user's own nome
+            self.instrumento = Instrumento.para_tickers([self.ticker], self.moeda)[self.ticker]
+        super().save(*args, **kwargs)
     
     def get_icon_url(self):
-        """Get icon URL with fallback to category default"""
+        """Get icon URL with fallback to the shared icon cache, then to the category default"""
         if self.icone_url:
             return self.icone_url
+
+        # Any icon found for this ticker, even past its TTL, beats the category icon
+        if hasattr(self, 'icone_cache_url'):
+            url = self.icone_cache_url
+        else:
+            url = IconeCache.objects.filter(ticker=self.ticker.upper(), status='ENCONTRADO').values_list('url', flat=True).first()
+        if url:
+            return url
         
         # Default icons based on category
         category_icons = {
@@ -166,7 +199,7 @@ class Ativo(models.Model):
             self.preco_medio = (total_custo / quantidade).quantize(Decimal('0.000001'), rounding=ROUND_HALF_UP)
         else:
             self.preco_medio = Decimal('0')
-        self.save(update_fields=['quantidade', 'preco_medio'])
+        self.save(update_fields=['quantidade', 'preco_medio', 'dataAlteracao'])
 
     def get_current_price(self):
         """Get current price using the price service"""
@@ -179,7 +212,18 @@ class Ativo(models.Model):
             preco_atual, is_estimado = self.get_current_price()
             self.valor_atual = self.quantidade * preco_atual
             self.is_preco_estimado = is_estimado
-            self.save(update_fields=['valor_atual', 'is_preco_estimado'])
+            self.save(update_fields=['valor_atual', 'is_preco_estimado', 'dataAlteracao'])
+        except Exception as e:
+            logger.error(f"Error updating valor_atual for {self.ticker}: {str(e)}")
+
+    async def aupdate_valor_atual(self):
+        """Async update_valor_atual: awaits the price provider without blocking the event loop"""
+        from .services import aget_current_price
+        try:
+            preco_atual, is_estimado = await aget_current_price(self.ticker, self.moeda)
+            self.valor_atual = self.quantidade * preco_atual
+            self.is_preco_estimado = is_estimado
+            await self.asave(update_fields=['valor_atual', 'is_preco_estimado', 'dataAlteracao'])
         except Exception as e:
             logger.error(f"Error updating valor_atual for {self.ticker}: {str(e)}")
 
@@ -203,6 +247,53 @@ class Ativo(models.Model):
         price, _ = self.get_current_price()
         return price
 
+class Instrumento(models.Model):
+    """
+    Ticker metadata shared by every user holding it (name, exchange, Yahoo
+    symbol, icon, suggested categoria), so lookups about a ticker are made
+    once and reused by all of its Ativo rows.
+    """
+    ticker = models.CharField(max_length=20)
+    moeda = models.CharField(max_length=3, choices=Ativo.MOEDA_CHOICES, default='BRL')
+    bolsa = models.CharField(max_length=20, blank=True, help_text='Bolsa onde é negociado (ex.: B3)')
+    yahoo_symbol = models.CharField(max_length=30, blank=True, help_text='Símbolo no Yahoo Finance (ex.: PETR4.SA)')
+    nome = models.CharField(max_length=200, blank=True)
+    icone_url = models.URLField(blank=True, null=True)
+    categoria_sugerida = models.ForeignKey(Categoria, on_delete=models.SET_NULL, null=True, blank=True, related_name='+', help_text='Categoria usada para novos ativos deste ticker')
+    dataCriacao = models.DateTimeField(auto_now_add=True)
+    dataAlteracao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Instrumento'
+        verbose_name_plural = 'Instrumentos'
+        unique_together = ['ticker', 'moeda']
+
+    def __str__(self):
+        return f"{self.ticker} ({self.moeda})"
+
+    @classmethod
+    def para_tickers(cls, tickers, moeda: str = 'BRL', nomes=None) -> dict:
+        """
+        Return {ticker: Instrumento} for these tickers, creating the missing
+        ones in one bulk insert. `nomes` must come from a curated source
+        (e.g. the name column of an import file), never from a user's Ativo.
+        """
+        tickers = list(dict.fromkeys(tickers))
+        instrumentos = {i.ticker: i for i in cls.objects.filter(ticker__in=tickers, moeda=moeda)}
+        faltando = [ticker for ticker in tickers if ticker not in instrumentos]
+        if faltando:
+            nomes = nomes or {}
+            cls.objects.bulk_create(
+                [
+                    cls(ticker=ticker, moeda=moeda, bolsa='B3' if moeda == 'BRL' else '', nome=nomes.get(ticker) or '')
+                    for ticker in faltando
+                ],
+                ignore_conflicts=True,  # another import may have created them meanwhile
+            )
+            # ignore_conflicts leaves the pks unset; read the rows back
+            instrumentos.update({i.ticker: i for i in cls.objects.filter(ticker__in=faltando, moeda=moeda)})
+        return instrumentos
+
 class Movimentacao(models.Model):
     OPERACAO_CHOICES = [
         ('COMPRA', 'Compra'),
@@ -213,39 +304,48 @@ class Movimentacao(models.Model):
     ]
 
     ativo = models.ForeignKey(Ativo, on_delete=models.PROTECT)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, editable=False, related_name='+', help_text='Copiado de ativo.usuario para paginação por índice')
     data = models.DateField()
     operacao = models.CharField(max_length=20, choices=OPERACAO_CHOICES)
     quantidade = models.DecimalField(max_digits=15, decimal_places=6)
     valorUnitario = models.DecimalField(max_digits=15, decimal_places=2)
     taxa = models.DecimalField(max_digits=15, decimal_places=2)
     custoTotal = models.DecimalField(max_digits=15, decimal_places=2)
+    hash_importacao = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False, help_text='Hash do conteúdo da linha importada; evita duplicatas ao reimportar')
     dataCriacao = models.DateTimeField(auto_now_add=True)
     dataAlteracao = models.DateTimeField(auto_now=True)
 
     def save(self, *args, **kwargs):
         # Calculate custoTotal before saving
         self.custoTotal = (self.quantidade * self.valorUnitario) + self.taxa
+        self.usuario_id = self.ativo.usuario_id
+        # The ativo position is recomputed by the post_save/post_delete receivers below
         super().save(*args, **kwargs)
-        self.ativo.update_quantidade_preco_medio()
 
     def __str__(self):
         return f"{self.ativo.ticker} - {self.get_operacao_display()} - {self.data}"
 
-    def delete(self, *args, **kwargs):
-        ativo = self.ativo
-        super().delete(*args, **kwargs)
-        ativo.update_quantidade_preco_medio()
-
     class Meta:
         ordering = ['-data', '-dataCriacao']
+        indexes = [
+            models.Index(fields=['usuario', 'data', 'dataCriacao', 'id'], name='ativo_mov_usuario_data_idx'),
+            # Position recompute walks one ativo's history in date order
+            models.Index(fields=['ativo', 'data', 'dataCriacao'], name='ativo_mov_ativo_data_idx'),
+        ]
 
 class Dividendo(models.Model):
     ativo = models.ForeignKey(Ativo, on_delete=models.PROTECT)
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, null=True, editable=False, related_name='+', help_text='Copiado de ativo.usuario para paginação por índice')
     data = models.DateField()
     valor = models.DecimalField(max_digits=15, decimal_places=2)
+    hash_importacao = models.CharField(max_length=64, null=True, blank=True, unique=True, editable=False, help_text='Hash do conteúdo da linha importada; evita duplicatas ao reimportar')
     dataCriacao = models.DateTimeField(auto_now_add=True)
     dataAlteracao = models.DateTimeField(auto_now=True)
 
+    def save(self, *args, **kwargs):
+        self.usuario_id = self.ativo.usuario_id
+        super().save(*args, **kwargs)
+
     def __str__(self):
         return f"{self.ativo.ticker} - {self.data} - {self.valor}"
 
@@ -253,6 +353,65 @@ class Dividendo(models.Model):
         ordering = ['-data', '-dataCriacao']
         verbose_name = 'Dividendo'
         verbose_name_plural = 'Dividendos'
+        indexes = [
+            models.Index(fields=['usuario', 'data', 'dataCriacao', 'id'], name='ativo_div_usuario_data_idx'),
+            # Monthly dividends per ativo (snapshots, evolucao)
+            models.Index(fields=['ativo', 'data'], name='ativo_div_ativo_data_idx'),
+        ]
+
+class DividendoMensal(models.Model):
+    """
+    Dividends per ativo and month, kept up to date on every Dividendo change
+    (see DividendoMensal.atualizar) so income reports read one row per
+    ativo-month however many payments there are.
+    """
+    ativo = models.ForeignKey(Ativo, on_delete=models.CASCADE, related_name='+')
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    mes = models.DateField(help_text='Primeiro dia do mês')
+    total = models.DecimalField(max_digits=15, decimal_places=2, default=0)
+    pagamentos = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        verbose_name = 'Dividendo Mensal'
+        verbose_name_plural = 'Dividendos Mensais'
+        unique_together = ['ativo', 'mes']
+        indexes = [
+            models.Index(fields=['usuario', 'mes'], name='ativo_divmes_usuario_mes_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.ativo_id} - {self.mes:%m/%Y} - {self.total}"
+
+    @classmethod
+    def atualizar(cls, chaves):
+        """
+        Recompute the months touched by a change, given (ativo_id, date)
+        pairs: one grouped query over those ativos and months, then an
+        upsert; months left without dividends are removed.
+        """
+        meses = {(ativo_id, data.replace(day=1)) for ativo_id, data in chaves}
+        if not meses:
+            return
+        ativo_ids = {ativo_id for ativo_id, _ in meses}
+        inicio = min(mes for _, mes in meses)
+        fim = max(mes for _, mes in meses) + relativedelta(months=1)
+        linhas = Dividendo.objects.filter(
+            ativo_id__in=ativo_ids, data__gte=inicio, data__lt=fim
+        ).annotate(mes=TruncMonth('data')).values('ativo_id', 'usuario_id', 'mes').annotate(
+            total=Sum('valor'), pagamentos=Count('id')
+        ).order_by()
+        agregados = [
+            cls(ativo_id=linha['ativo_id'], usuario_id=linha['usuario_id'], mes=linha['mes'],
+                total=linha['total'], pagamentos=linha['pagamentos'])
+            for linha in linhas if (linha['ativo_id'], linha['mes']) in meses
+        ]
+        with transaction.atomic():
+            cls.objects.bulk_create(
+                agregados, update_conflicts=True, unique_fields=['ativo', 'mes'], update_fields=['total', 'pagamentos']
+            )
+            vazios = meses - {(a.ativo_id, a.mes) for a in agregados}
+            for ativo_id, mes in vazios:
+                cls.objects.filter(ativo_id=ativo_id, mes=mes).delete()
 
 class EvolucaoPatrimonial(models.Model):
     ativo = models.ForeignKey('Ativo', on_delete=models.CASCADE)
@@ -363,14 +522,16 @@ class PrecoCache(models.Model):
         return f"{self.ticker} - {self.preco} ({self.moeda})"
 
     @classmethod
-    def get_cached_price(cls, ticker: str, moeda: str) -> Tuple[Optional[Decimal], bool]:
+    def get_cached_price(cls, ticker: str, moeda: str, call_site: str = 'price_service') -> Tuple[Optional[Decimal], bool]:
         """Get cached price if it exists and is less than 24 hours old"""
         try:
             cache = cls.objects.get(ticker=ticker, moeda=moeda)
-            if (timezone.now() - cache.data_atualizacao).total_seconds() < 24 * 3600:
+            idade = (timezone.now() - cache.data_atualizacao).total_seconds()
+            record_cache_lookup(call_site, idade, idade < 24 * 3600)
+            if idade < 24 * 3600:
                 return cache.preco, cache.is_estimado
         except cls.DoesNotExist:
-            pass
+            record_cache_lookup(call_site, None, False)
         return None, False
 
     @classmethod
@@ -384,3 +545,214 @@ class PrecoCache(models.Model):
                 'is_estimado': is_estimado
             }
         )
+
+class IconeCache(models.Model):
+    """Result of the icon probes per ticker, shared by every user holding it."""
+    STATUS_CHOICES = [
+        ('ENCONTRADO', 'Encontrado'),
+        ('NAO_ENCONTRADO', 'Não encontrado'),
+    ]
+    # Logos rarely change; a miss is retried sooner in case a provider adds the brand
+    TTL_POSITIVO = timedelta(days=30)
+    TTL_NEGATIVO = timedelta(days=3)
+
+    ticker = models.CharField(max_length=20, unique=True)
+    url = models.URLField(blank=True, null=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES)
+    checked_at = models.DateTimeField()
+
+    class Meta:
+        verbose_name = 'Cache de Ícone'
+        verbose_name_plural = 'Cache de Ícones'
+
+    def __str__(self):
+        return f"{self.ticker} - {self.get_status_display()}"
+
+    @property
+    def valido(self) -> bool:
+        ttl = self.TTL_POSITIVO if self.status == 'ENCONTRADO' else self.TTL_NEGATIVO
+        return timezone.now() - self.checked_at < ttl
+
+    @classmethod
+    def get_cached_icon(cls, ticker: str) -> Tuple[bool, Optional[str]]:
+        """Return (hit, url) for a cache entry still within its TTL; url is None for a remembered miss."""
+        cache = cls.objects.filter(ticker=ticker.upper()).first()
+        if cache is None or not cache.valido:
+            return False, None
+        return True, cache.url
+
+    @classmethod
+    def update_cache(cls, ticker: str, url: Optional[str]):
+        cls.objects.update_or_create(
+            ticker=ticker.upper(),
+            defaults={
+                'url': url,
+                'status': 'ENCONTRADO' if url else 'NAO_ENCONTRADO',
+                'checked_at': timezone.now(),
+            }
+        )
+
+class IndiceBenchmark(models.Model):
+    """Benchmark index values, loaded from CSV/Parquet files (see the load_benchmarks command)."""
+    INDICE_CHOICES = [
+        ('CDI', 'CDI'),
+        ('IBOV', 'Ibovespa'),
+        ('IPCA', 'IPCA'),
+    ]
+    # How each index is stored: a price level, or a rate in % for its period (day for CDI, month for IPCA)
+    TIPOS = {
+        'CDI': 'taxa',
+        'IBOV': 'nivel',
+        'IPCA': 'taxa',
+    }
+
+    indice = models.CharField(max_length=10, choices=INDICE_CHOICES)
+    data = models.DateField()
+    valor = models.DecimalField(max_digits=20, decimal_places=8)
+
+    class Meta:
+        verbose_name = 'Índice de Referência'
+        verbose_name_plural = 'Índices de Referência'
+        unique_together = ['indice', 'data']
+
+    def __str__(self):
+        return f"{self.indice} - {self.data} - {self.valor}"
+
+class VersaoDados(models.Model):
+    usuario = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='versao_dados')
+    versao = models.PositiveBigIntegerField(default=0)
+    data_atualizacao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Versão dos Dados'
+        verbose_name_plural = 'Versões dos Dados'
+
+    def __str__(self):
+        return f"{self.usuario_id} - v{self.versao}"
+
+    @classmethod
+    def get_versao(cls, usuario_id) -> int:
+        """Get the current data version for a user (0 if nothing was ever changed)"""
+        versao = cls.objects.filter(usuario_id=usuario_id).values_list('versao', flat=True).first()
+        return versao or 0
+
+    @classmethod
+    def incrementar(cls, usuario_id):
+        """Bump the data version of a user, creating the row on first use"""
+        if usuario_id is None:
+            return
+        if cls.objects.filter(usuario_id=usuario_id).update(versao=models.F('versao') + 1):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(usuario_id=usuario_id, versao=1)
+        except IntegrityError:
+            cls.objects.filter(usuario_id=usuario_id).update(versao=models.F('versao') + 1)
+
+def _usuario_id_do_ativo(ativo_id):
+    return Ativo.objects.filter(pk=ativo_id).values_list('usuario_id', flat=True).first()
+
+@receiver(post_save, sender=Ativo)
+@receiver(post_delete, sender=Ativo)
+def bump_versao_on_ativo_change(sender, instance, **kwargs):
+    VersaoDados.incrementar(instance.usuario_id)
+
+@receiver(post_save, sender=Movimentacao)
+@receiver(post_delete, sender=Movimentacao)
+@receiver(post_save, sender=Dividendo)
+@receiver(post_delete, sender=Dividendo)
+@receiver(post_save, sender=EvolucaoPatrimonial)
+@receiver(post_delete, sender=EvolucaoPatrimonial)
+@receiver(post_save, sender=Snapshot)
+@receiver(post_delete, sender=Snapshot)
+def bump_versao_on_registro_change(sender, instance, **kwargs):
+    VersaoDados.incrementar(_usuario_id_do_ativo(instance.ativo_id))
+
+@receiver(pre_save, sender=Dividendo)
+def guardar_mes_anterior_do_dividendo(sender, instance, **kwargs):
+    # An edit can move a dividend to another month or ativo; that month needs recomputing too
+    instance._chave_anterior = None
+    if instance.pk:
+        instance._chave_anterior = Dividendo.objects.filter(pk=instance.pk).values_list('ativo_id', 'data').first()
+
+@receiver(post_save, sender=Dividendo)
+@receiver(post_delete, sender=Dividendo)
+def atualizar_dividendos_mensais(sender, instance, **kwargs):
+    chaves = [(instance.ativo_id, instance.data)]
+    if getattr(instance, '_chave_anterior', None):
+        chaves.append(instance._chave_anterior)
+    DividendoMensal.atualizar(chaves)
+
+@receiver(post_save, sender=PrecoCache)
+def bump_versao_on_preco_change(sender, instance, **kwargs):
+    # A new price changes preco_atual/valor_atual for every holder of the ticker
+    usuarios = Ativo.objects.filter(ticker=instance.ticker, moeda=instance.moeda).values_list('usuario_id', flat=True).distinct()
+    for usuario_id in usuarios:
+        VersaoDados.incrementar(usuario_id)
+
+class RegistroExcluido(models.Model):
+    """Tombstone for deleted rows, so the change feed can report deletions."""
+    MODELO_CHOICES = [
+        ('ativo', 'Ativo'),
+        ('movimentacao', 'Movimentação'),
+        ('dividendo', 'Dividendo'),
+        ('snapshot', 'Snapshot'),
+    ]
+    RETENCAO_DIAS = 90
+
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    modelo = models.CharField(max_length=20, choices=MODELO_CHOICES)
+    objeto_id = models.BigIntegerField()
+    data_exclusao = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Registro Excluído'
+        verbose_name_plural = 'Registros Excluídos'
+        indexes = [
+            models.Index(fields=['usuario', 'data_exclusao']),
+        ]
+
+    def __str__(self):
+        return f"{self.modelo} {self.objeto_id} ({self.data_exclusao})"
+
+    @classmethod
+    def limpar_antigos(cls) -> int:
+        """Delete tombstones older than the retention window; returns how many were removed"""
+        limite = timezone.now() - timedelta(days=cls.RETENCAO_DIAS)
+        return cls.objects.filter(data_exclusao__lt=limite).delete()[0]
+
+class ImportacaoArquivo(models.Model):
+    """Checkpoint of a chunked spreadsheet import, so an interrupted import resumes where it stopped."""
+    TIPO_CHOICES = [
+        ('movimentacoes', 'Movimentações'),
+        ('dividendos', 'Dividendos'),
+    ]
+
+    usuario = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='+')
+    tipo = models.CharField(max_length=20, choices=TIPO_CHOICES)
+    sha256 = models.CharField(max_length=64, help_text='Hash do conteúdo do arquivo')
+    nome_arquivo = models.CharField(max_length=255, blank=True)
+    linhas_processadas = models.PositiveIntegerField(default=0)
+    concluida = models.BooleanField(default=False)
+    dataCriacao = models.DateTimeField(auto_now_add=True)
+    dataAlteracao = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Importação de Arquivo'
+        verbose_name_plural = 'Importações de Arquivos'
+        unique_together = ['usuario', 'tipo', 'sha256']
+
+    def __str__(self):
+        return f"{self.nome_arquivo} ({self.tipo}): {self.linhas_processadas} linhas"
+
+@receiver(post_delete, sender=Ativo)
+def registrar_exclusao_ativo(sender, instance, **kwargs):
+    RegistroExcluido.objects.create(usuario_id=instance.usuario_id, modelo='ativo', objeto_id=instance.pk)
+
+@receiver(post_delete, sender=Movimentacao)
+@receiver(post_delete, sender=Dividendo)
+@receiver(post_delete, sender=Snapshot)
+def registrar_exclusao_registro(sender, instance, **kwargs):
+    usuario_id = _usuario_id_do_ativo(instance.ativo_id)
+    if usuario_id is not None:
+        RegistroExcluido.objects.create(usuario_id=usuario_id, modelo=sender._meta.model_name, objeto_id=instance.pk)
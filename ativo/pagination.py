@@ -0,0 +1,106 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
+from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(PageNumberPagination):
+    """
+    Page-number pagination with an opt-in keyset (cursor) mode.
+
+    Without a ``cursor`` query parameter this behaves exactly like the default
+    PageNumberPagination, so existing clients keep working. Passing ``?cursor=``
+    (empty for the first page) switches to keyset pagination over
+    (data, dataCriacao, id) descending: each page is a range seek on the
+    (usuario, data, dataCriacao, id) index, with no COUNT(*) and no OFFSET, so
+    the last page costs the same as the first. The keyset order is fixed, so
+    ``?ordering=`` together with ``?cursor=`` is rejected with a 400.
+    """
+    cursor_query_param = 'cursor'
+    keyset_page_size_query_param = 'page_size'
+    max_keyset_page_size = 500
+    invalid_cursor_message = 'Invalid cursor'
+    ordering = ('-data', '-dataCriacao', '-id')
+    ordering_query_param = 'ordering'
+    ordering_not_supported_message = 'ordering cannot be combined with cursor pagination'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self.cursor_query_param in request.query_params
+        if not self.keyset:
+            return super().paginate_queryset(queryset, request, view)
+
+        if request.query_params.get(self.ordering_query_param):
+            raise ValidationError({self.ordering_query_param: self.ordering_not_supported_message})
+
+        self.request = request
+        self.page_size = self.get_keyset_page_size(request)
+        position = self.decode_cursor(request)
+
+        queryset = queryset.order_by(*self.ordering)
+        if position is not None:
+            data, data_criacao, pk = position
+            # Written with a leading "data <= x" so the index can seek to the cursor
+            queryset = queryset.filter(data__lte=data).filter(
+                Q(data__lt=data)
+                | Q(dataCriacao__lt=data_criacao)
+                | Q(dataCriacao=data_criacao, id__lt=pk)
+            )
+
+        rows = list(queryset[:self.page_size + 1])
+        self.has_next = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        self.next_position = None
+        if self.has_next:
+            last = rows[-1]
+            self.next_position = (last.data, last.dataCriacao, last.pk)
+        return rows
+
+    def get_paginated_response(self, data):
+        if not self.keyset:
+            return super().get_paginated_response(data)
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if not self.keyset:
+            return super().get_next_link()
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_previous_link(self):
+        if not self.keyset:
+            return super().get_previous_link()
+        return None
+
+    def get_keyset_page_size(self, request):
+        try:
+            size = int(request.query_params[self.keyset_page_size_query_param])
+            if size > 0:
+                return min(size, self.max_keyset_page_size)
+        except (KeyError, ValueError):
+            pass
+        return self.page_size
+
+    def encode_cursor(self, position):
+        data, data_criacao, pk = position
+        raw = f"{data.isoformat()}|{data_criacao.isoformat()}|{pk}"
+        return urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            raw = urlsafe_b64decode(encoded.encode('ascii')).decode('ascii')
+            data, data_criacao, pk = raw.split('|')
+            return date.fromisoformat(data), datetime.fromisoformat(data_criacao), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
@@ -3,6 +3,9 @@ import yfinance as yf
 from django.utils import timezone
 import logging
 from typing import Tuple
+from .timing import measure
+from .metrics import provider_call
+from .symbol_service import com_simbolo
 
 logger = logging.getLogger(__name__)
 
@@ -18,10 +21,15 @@ def get_current_price(ticker: str, moeda: str = 'BRL') -> Tuple[Decimal, bool]:
     if cached_price is not None:
         return cached_price, is_estimado
 
+    def buscar_info(symbol: str):
+        with measure('price'), provider_call('yfinance', 'price_service'):
+            info = yf.Ticker(symbol).info
+        # An unknown symbol still answers, just without any price
+        return info if info and (info.get('regularMarketPrice') or info.get('currentPrice')) else None
+
     try:
         # If not in cache or expired, fetch from yfinance
-        stock = yf.Ticker(ticker)
-        info = stock.info
+        info = com_simbolo(ticker, moeda, buscar_info) or {}
 
         # Get price based on currency
         if moeda == 'BRL':
@@ -0,0 +1,415 @@
+"""
+Price returns per ativo over the AtivoInfo horizons (day, month-to-date,
+year-to-date, 12 to 60 months and since the first stored price).
+
+All of a user's stored prices are loaded with one query into a date x
+ativo matrix; every horizon is then a single row lookup in that matrix, so
+all horizons for all assets come out of one NumPy expression instead of a
+query per asset and horizon. Results are cached per trading day and data
+version.
+
+Money-weighted returns (XIRR) follow the same idea: every ativo's cash
+flows, plus each currency's whole portfolio, are padded into one matrix
+and solved together. The time-weighted series is built from one
+aggregated EvolucaoPatrimonial query and the purchase/sale cash flows with
+column arithmetic.
+"""
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from django.core.cache import cache
+from django.db.models import IntegerField, Sum, Value
+from django.utils import timezone
+
+from .models import Ativo, Dividendo, EvolucaoPatrimonial, Movimentacao, PrecoCache, Snapshot, VersaoDados
+from .types import AtivoInfo
+
+RETURNS_CACHE_TIMEOUT = 24 * 3600
+
+# Trailing horizons in months
+HORIZONTES_MESES = {
+    'variacao_12m': 12,
+    'variacao_24m': 24,
+    'variacao_36m': 36,
+    'variacao_48m': 48,
+    'variacao_60m': 60,
+}
+
+
+def ultimo_pregao(dia: date) -> date:
+    """Last weekday on or before `dia` (exchange holidays are not modelled)."""
+    while dia.weekday() >= 5:
+        dia -= timedelta(days=1)
+    return dia
+
+
+def historico_precos(ativo_ids, desde: Optional[date] = None, somente_diarios: bool = False) -> pd.DataFrame:
+    """
+    Stored prices as a date x ativo_id float matrix (NaN where an ativo has
+    no price that day).
+
+    Daily Snapshot prices and the monthly prices in EvolucaoPatrimonial
+    (historical snapshots) are read in one UNION query; on a date present
+    in both, the Snapshot wins. Zero prices (failed lookups) are ignored.
+    With somente_diarios only Snapshot prices are read, for statistics that
+    assume a daily sampling.
+    """
+    snapshots = Snapshot.objects.filter(ativo_id__in=ativo_ids, preco__gt=0)
+    evolucao = EvolucaoPatrimonial.objects.filter(ativo_id__in=ativo_ids, preco_atual__gt=0)
+    if desde:
+        snapshots = snapshots.filter(data__gte=desde)
+        evolucao = evolucao.filter(data__gte=desde)
+    snapshots = snapshots.annotate(
+        prioridade=Value(0, output_field=IntegerField())
+    ).values_list('ativo_id', 'data', 'preco', 'prioridade').order_by()
+    evolucao = evolucao.annotate(
+        prioridade=Value(1, output_field=IntegerField())
+    ).values_list('ativo_id', 'data', 'preco_atual', 'prioridade').order_by()
+
+    linhas = snapshots if somente_diarios else snapshots.union(evolucao, all=True)
+    df = pd.DataFrame(list(linhas), columns=['ativo_id', 'data', 'preco', 'prioridade'])
+    if df.empty:
+        return pd.DataFrame(index=pd.DatetimeIndex([]), columns=list(ativo_ids), dtype=float)
+    df['data'] = pd.to_datetime(df['data'])
+    df['preco'] = df['preco'].astype(float)
+    df = df.sort_values('prioridade').drop_duplicates(['data', 'ativo_id'])
+    matriz = df.pivot(index='data', columns='ativo_id', values='preco').sort_index()
+    return matriz.reindex(columns=list(ativo_ids))
+
+
+def _linha_base(datas: np.ndarray, alvo: date, inclusive: bool) -> int:
+    """Index of the last row dated before `alvo` (or on it when inclusive); -1 when there is none."""
+    lado = 'right' if inclusive else 'left'
+    return int(np.searchsorted(datas, np.datetime64(alvo), side=lado)) - 1
+
+
+def _decimal(valor: float) -> Optional[Decimal]:
+    if valor is None or not np.isfinite(valor):
+        return None
+    return Decimal(str(float(valor))).quantize(Decimal('0.01'))
+
+
+def calcular_variacoes(user, hoje: Optional[date] = None) -> List[AtivoInfo]:
+    """Percent price change of each of the user's ativos over every AtivoInfo horizon."""
+    # On weekends the reference is Friday, so "dia" still compares Friday with Thursday
+    pregao = ultimo_pregao(hoje or timezone.localdate())
+    cache_key = f'variacoes:{user.pk}:{pregao.isoformat()}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    ativos = list(Ativo.objects.filter(usuario=user).select_related('categoria').order_by('ticker'))
+    if not ativos:
+        return []
+    historico = historico_precos([a.pk for a in ativos])
+    ultimas_datas = historico.apply(pd.Series.last_valid_index)
+    matriz = historico.ffill()
+    valores = matriz.to_numpy(dtype=float)
+    datas = matriz.index.to_numpy(dtype='datetime64[ns]')
+
+    precos_cache: Dict[tuple, PrecoCache] = {
+        (p.ticker, p.moeda): p
+        for p in PrecoCache.objects.filter(ticker__in={a.ticker for a in ativos}, preco__gt=0)
+    }
+
+    # Current price: the price cache, else the last stored price
+    ultimo = valores[-1] if len(valores) else np.full(len(ativos), np.nan)
+    atual = np.array([
+        float(precos_cache[(a.ticker, a.moeda)].preco) if (a.ticker, a.moeda) in precos_cache else ultimo[i]
+        for i, a in enumerate(ativos)
+    ])
+
+    # One base row per horizon; all horizons x ativos in one matrix
+    horizontes = {
+        'variacao_dia': _linha_base(datas, pregao, inclusive=False),
+        'variacao_mes': _linha_base(datas, pregao.replace(day=1), inclusive=False),
+        'variacao_ano': _linha_base(datas, date(pregao.year, 1, 1), inclusive=False),
+    }
+    for campo, meses in HORIZONTES_MESES.items():
+        horizontes[campo] = _linha_base(datas, pregao - relativedelta(months=meses), inclusive=True)
+    linhas = np.array(list(horizontes.values()))
+    bases = np.full((len(linhas), len(ativos)), np.nan)
+    validas = linhas >= 0
+    bases[validas] = valores[linhas[validas]]
+    # Since inception: first stored price of each ativo
+    primeiro = matriz.bfill().to_numpy(dtype=float)[0] if len(valores) else np.full(len(ativos), np.nan)
+    bases = np.vstack([bases, primeiro])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        variacoes = (atual[np.newaxis, :] / bases - 1) * 100
+    campos = list(horizontes) + ['variacao_todas']
+
+    resultado: List[AtivoInfo] = []
+    for i, ativo in enumerate(ativos):
+        preco_cache = precos_cache.get((ativo.ticker, ativo.moeda))
+        if preco_cache is not None:
+            ultima_atualizacao, fonte = preco_cache.data_atualizacao.isoformat(), 'yahoo'
+        elif len(valores) and np.isfinite(ultimo[i]):
+            ultima_atualizacao, fonte = ultimas_datas[ativo.pk].date().isoformat(), 'historico'
+        else:
+            ultima_atualizacao, fonte = None, None
+        info = AtivoInfo(
+            ticker=ativo.ticker,
+            nome=ativo.nome,
+            tipo=ativo.categoria.tipo,
+            moeda=ativo.moeda,
+            preco_atual=_decimal(atual[i]),
+            ultima_atualizacao=ultima_atualizacao,
+            fonte=fonte,
+        )
+        for linha, campo in enumerate(campos):
+            info[campo] = _decimal(variacoes[linha, i])
+        resultado.append(info)
+
+    cache.set(cache_key, resultado, RETURNS_CACHE_TIMEOUT)
+    return resultado
+
+
+XIRR_MAX_ITER = 50
+XIRR_TOLERANCIA = 1e-9
+# Bisection bracket for annual rates: -99.99% to +10000%
+XIRR_MIN, XIRR_MAX = -0.9999, 100.0
+
+
+def _npv(valores: np.ndarray, anos: np.ndarray, taxas: np.ndarray) -> np.ndarray:
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        return (valores * (1 + taxas[:, np.newaxis]) ** -anos).sum(axis=1)
+
+
+def xirr_vetorizado(valores: np.ndarray, anos: np.ndarray) -> np.ndarray:
+    """
+    Annual internal rate of return of many cash-flow series at once.
+
+    `valores` and `anos` are (series x flows) matrices, padded with zero
+    flows; `anos` is the time of each flow in years since the series'
+    first flow. Newton's method runs on every row simultaneously; rows
+    where it diverges or leaves the domain are finished by a simultaneous
+    bisection. Rows without a sign change in their flows have no IRR and
+    come back as NaN.
+    """
+    n = valores.shape[0]
+    taxas = np.full(n, 0.1)
+    resolvidas = np.zeros(n, dtype=bool)
+    with np.errstate(over='ignore', invalid='ignore', divide='ignore'):
+        for _ in range(XIRR_MAX_ITER):
+            base = 1 + taxas[:, np.newaxis]
+            fator = base ** -anos
+            npv = (valores * fator).sum(axis=1)
+            derivada = (-anos * valores * fator / base).sum(axis=1)
+            passo = npv / derivada
+            novas = taxas - passo
+            validas = np.isfinite(novas) & (novas > -1)
+            resolvidas |= validas & (np.abs(passo) < XIRR_TOLERANCIA)
+            taxas = np.where(validas & ~resolvidas, novas, taxas)
+            if resolvidas.all() or not (validas | resolvidas).any():
+                break
+
+    # Bisection for the rows Newton could not settle
+    pendentes = ~resolvidas
+    if pendentes.any():
+        baixo = np.full(n, XIRR_MIN)
+        alto = np.full(n, XIRR_MAX)
+        f_baixo = _npv(valores, anos, baixo)
+        com_raiz = pendentes & (np.sign(f_baixo) != np.sign(_npv(valores, anos, alto)))
+        for _ in range(200):
+            meio = (baixo + alto) / 2
+            f_meio = _npv(valores, anos, meio)
+            mesmo_lado = np.sign(f_meio) == np.sign(f_baixo)
+            baixo = np.where(mesmo_lado, meio, baixo)
+            f_baixo = np.where(mesmo_lado, f_meio, f_baixo)
+            alto = np.where(mesmo_lado, alto, meio)
+            if np.all(alto[com_raiz] - baixo[com_raiz] < XIRR_TOLERANCIA):
+                break
+        taxas = np.where(com_raiz, (baixo + alto) / 2, np.where(resolvidas, taxas, np.nan))
+    return taxas
+
+
+def movimentacoes_em_caixa(user) -> pd.DataFrame:
+    """
+    Purchases and sales as investor cash flows, (ativo_id, moeda, data,
+    valor) rows: a purchase costs quantity x price + fee (negative), a sale
+    brings in quantity x price - fee (positive).
+    """
+    movs = pd.DataFrame(
+        list(Movimentacao.objects.filter(usuario=user, operacao__in=['COMPRA', 'VENDA']).values_list(
+            'ativo_id', 'ativo__moeda', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa'
+        ).order_by()),
+        columns=['ativo_id', 'moeda', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa'],
+    )
+    bruto = movs['quantidade'].astype(float) * movs['valorUnitario'].astype(float)
+    taxa = movs['taxa'].astype(float)
+    movs['valor'] = np.where(movs['operacao'] == 'COMPRA', -(bruto + taxa), bruto - taxa)
+    return movs[['ativo_id', 'moeda', 'data', 'valor']]
+
+
+def fluxos_de_caixa(user, hoje: date) -> pd.DataFrame:
+    """
+    Investor cash flows per ativo as (ativo_id, moeda, data, valor) rows:
+    purchases are outflows, sales and dividends inflows, and today's value
+    of the position is the final inflow. Ativos whose position has no price
+    at all are left out.
+    """
+    movs = movimentacoes_em_caixa(user)
+    dividendos = pd.DataFrame(
+        list(Dividendo.objects.filter(usuario=user).values_list('ativo_id', 'data', 'valor').order_by()),
+        columns=['ativo_id', 'data', 'valor'],
+    )
+    ativos = pd.DataFrame(
+        list(Ativo.objects.filter(usuario=user).values_list('id', 'ticker', 'moeda', 'quantidade', 'valor_atual')),
+        columns=['ativo_id', 'ticker', 'moeda', 'quantidade', 'valor'],
+    )
+    ativos['valor'] = ativos['valor'].astype(float)
+    ativos['quantidade'] = ativos['quantidade'].astype(float)
+
+    # valor_atual is 0 when the last price lookup failed: value the position
+    # at the cached price, else the last stored one, as calcular_variacoes does
+    sem_preco = (ativos['valor'] <= 0) & (ativos['quantidade'] > 0)
+    if sem_preco.any():
+        faltando = ativos[sem_preco]
+        precos_cache = {
+            (ticker, moeda): float(preco)
+            for ticker, moeda, preco in PrecoCache.objects.filter(
+                ticker__in=set(faltando['ticker']), preco__gt=0
+            ).values_list('ticker', 'moeda', 'preco')
+        }
+        historico = historico_precos(faltando['ativo_id'].tolist())
+        historico = historico[historico.index <= pd.Timestamp(hoje)].ffill()
+        ultimos = historico.iloc[-1] if len(historico) else pd.Series(dtype=float)
+        precos = np.array([
+            precos_cache.get((ticker, moeda), ultimos.get(ativo_id, np.nan))
+            for ativo_id, ticker, moeda in faltando[['ativo_id', 'ticker', 'moeda']].itertuples(index=False, name=None)
+        ], dtype=float)
+        ativos.loc[sem_preco, 'valor'] = faltando['quantidade'].to_numpy() * precos
+    # With no price at all the final value is unknown; leave the ativo out
+    ativos = ativos[ativos['valor'].notna()]
+    finais = ativos[['ativo_id', 'valor']].assign(data=hoje)
+
+    fluxos = pd.concat(
+        [movs[['ativo_id', 'data', 'valor']], dividendos, finais], ignore_index=True
+    )
+    fluxos['valor'] = fluxos['valor'].astype(float)
+    fluxos['data'] = pd.to_datetime(fluxos['data'])
+    return fluxos.merge(ativos[['ativo_id', 'moeda']], on='ativo_id')
+
+
+def _matrizes(fluxos: pd.DataFrame, chave: str):
+    """Pad each series' flows into (series x flows) value and year matrices."""
+    fluxos = fluxos.sort_values([chave, 'data'])
+    codigos, series = pd.factorize(fluxos[chave])
+    coluna = fluxos.groupby(chave).cumcount().to_numpy()
+    inicio = fluxos.groupby(chave)['data'].transform('min')
+    anos = ((fluxos['data'] - inicio).dt.days / 365.0).to_numpy()
+    valores = np.zeros((len(series), coluna.max() + 1 if len(coluna) else 0))
+    tempos = np.zeros_like(valores)
+    valores[codigos, coluna] = fluxos['valor'].to_numpy()
+    tempos[codigos, coluna] = anos
+    return series, valores, tempos
+
+
+def calcular_xirr(user, hoje: Optional[date] = None) -> Dict[str, Dict]:
+    """
+    Money-weighted annual return (XIRR, in percent) per ativo and for the
+    whole portfolio in each currency. Cached per data version.
+    """
+    hoje = hoje or timezone.localdate()
+    cache_key = f'xirr:{user.pk}:{hoje.isoformat()}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    fluxos = fluxos_de_caixa(user, hoje)
+    resultado = {'ativos': {}, 'carteira': {}}
+    if not fluxos.empty:
+        # Each ativo is one series and each currency's whole portfolio another; all solved together
+        fluxos['serie'] = 'a' + fluxos['ativo_id'].astype(str)
+        carteira = fluxos.assign(serie='m' + fluxos['moeda'])
+        series, valores, tempos = _matrizes(pd.concat([fluxos, carteira], ignore_index=True), 'serie')
+        taxas = xirr_vetorizado(valores, tempos)
+        for serie, taxa in zip(series, taxas):
+            destino = resultado['ativos'] if serie[0] == 'a' else resultado['carteira']
+            chave = int(serie[1:]) if serie[0] == 'a' else serie[1:]
+            destino[chave] = _decimal(taxa * 100)
+
+    cache.set(cache_key, resultado, RETURNS_CACHE_TIMEOUT)
+    return resultado
+
+
+def serie_twr(user, start: Optional[date] = None, end: Optional[date] = None) -> Dict[str, Dict]:
+    """
+    Time-weighted return series from EvolucaoPatrimonial, per currency.
+
+    Each month's return is (value + dividends - previous value - net
+    contribution) / (previous value + net contribution), where the net
+    contribution is the money put in by purchases minus the proceeds of
+    sales since the previous month (Movimentacao cash flows; total cost
+    cannot be used, as it is clamped at zero and ignores realized gains),
+    assumed to happen at the start of the month. Sub-period returns are
+    chain-linked into the cumulative series (since `start`) and over the
+    trailing 12 months; all series are in percent. Two queries, then column
+    arithmetic.
+    """
+    cache_key = f'twr:{user.pk}:{start}:{end}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    # Months before `start` are still read: they give the first month in the
+    # range its starting value and feed the trailing 12-month window
+    queryset = EvolucaoPatrimonial.objects.filter(ativo__usuario=user)
+    if end:
+        queryset = queryset.filter(data__lte=end)
+
+    rows = queryset.order_by().values_list('ativo__moeda', 'data').annotate(
+        valor=Sum('valor_total'),
+        dividendos=Sum('dividendos_mes'),
+    ).order_by('ativo__moeda', 'data')
+    df = pd.DataFrame(list(rows), columns=['moeda', 'data', 'valor', 'dividendos'])
+    df[['valor', 'dividendos']] = df[['valor', 'dividendos']].astype(float)
+    df['data'] = pd.to_datetime(df['data']).astype('datetime64[ns]')
+
+    # Each purchase or sale counts in the first month valued on or after it
+    movs = movimentacoes_em_caixa(user)
+    movs = movs.assign(data=pd.to_datetime(movs['data']).astype('datetime64[ns]'), aporte=-movs['valor'])
+    meses = df[['moeda', 'data']].assign(mes=df['data'])
+    alocados = pd.merge_asof(
+        movs.sort_values('data'), meses.sort_values('data'), on='data', by='moeda', direction='forward'
+    ).dropna(subset=['mes'])
+    aportes = alocados.groupby(['moeda', 'mes'], as_index=False)['aporte'].sum().rename(columns={'mes': 'data'})
+    df = df.merge(aportes, on=['moeda', 'data'], how='left').fillna({'aporte': 0.0})
+
+    anterior = df.groupby('moeda')['valor'].shift(fill_value=0.0)
+    base = anterior + df['aporte']
+    with np.errstate(divide='ignore', invalid='ignore'):
+        retorno = np.where(base > 0, (df['valor'] + df['dividendos'] - base) / base, 0.0)
+    df['retorno'] = retorno
+    df['crescimento'] = (1 + df['retorno']).groupby(df['moeda']).cumprod()
+
+    # Growth 12 months earlier, looked up by date so missing months don't shift the window
+    doze_meses = df[['moeda', 'data', 'crescimento']].assign(data=df['data'] + pd.DateOffset(months=12))
+    df = df.merge(doze_meses, on=['moeda', 'data'], how='left', suffixes=('', '_12m'))
+    df['rolling_12m'] = df['crescimento'] / df['crescimento_12m'] - 1
+
+    if start:
+        df = df[df['data'] >= pd.Timestamp(start)]
+    # Cumulative return since the start of the range: rebase on the growth just before its first month
+    inicial = (df['crescimento'] / (1 + df['retorno'])).groupby(df['moeda']).transform('first')
+    df = df.assign(acumulado=df['crescimento'] / inicial - 1)
+
+    def _lista(coluna: pd.Series) -> List[Optional[float]]:
+        return [round(v * 100, 4) if np.isfinite(v) else None for v in coluna]
+
+    resultado = {}
+    for moeda, serie in df.groupby('moeda'):
+        resultado[moeda] = {
+            'dates': [d.date().isoformat() for d in serie['data']],
+            'retornos': _lista(serie['retorno']),
+            'acumulado': _lista(serie['acumulado']),
+            'rolling_12m': _lista(serie['rolling_12m']),
+        }
+
+    cache.set(cache_key, resultado, RETURNS_CACHE_TIMEOUT)
+    return resultado
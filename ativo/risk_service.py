@@ -0,0 +1,243 @@
+"""
+Risk statistics of a user's holdings: annualized volatility, maximum
+drawdown, beta against the Ibovespa and the correlation matrix, per ativo
+and for the portfolio weighted by current position values.
+
+Everything is computed with NumPy from the stored daily prices (Snapshot)
+over the last year. Results are cached per trading day and data version.
+The correlation matrix is also kept between calls together with a
+fingerprint of each ativo's return column, so when one ativo is added or
+its history changes only the pairs involving it are recomputed.
+"""
+import hashlib
+import logging
+from datetime import date, timedelta
+from typing import Any, Dict, Optional
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+from django.core.cache import cache
+from django.utils import timezone
+
+from .metrics import provider_call
+from .models import Ativo, IndiceBenchmark, VersaoDados
+from .returns_service import RETURNS_CACHE_TIMEOUT, historico_precos, ultimo_pregao
+
+logger = logging.getLogger(__name__)
+
+IBOV_SIMBOLO = '^BVSP'
+RISCO_JANELA_DIAS = 365
+DIAS_UTEIS_ANO = 252
+# Minimum common observations for a volatility, beta or correlation
+RISCO_MIN_OBS = 20
+# A failed or empty index download is retried after this (seconds), not the next day
+IBOV_FALHA_CACHE_TIMEOUT = 5 * 60
+
+
+def historico_ibov(inicio: date, fim: date) -> pd.Series:
+    """
+    Ibovespa daily closes between the dates. The locally stored benchmark
+    series is used when it reaches the last week of the range; otherwise
+    they come from Yahoo Finance, cached per day. When the download fails
+    or comes back empty the empty series is only cached for
+    IBOV_FALHA_CACHE_TIMEOUT.
+    """
+    armazenado = pd.DataFrame(
+        list(IndiceBenchmark.objects.filter(indice='IBOV', data__gte=inicio, data__lte=fim).order_by('data').values_list('data', 'valor')),
+        columns=['data', 'valor'],
+    )
+    if not armazenado.empty and armazenado['data'].iloc[-1] >= fim - timedelta(days=7):
+        return pd.Series(armazenado['valor'].astype(float).to_numpy(), index=pd.to_datetime(armazenado['data']))
+
+    cache_key = f'ibov:{inicio.isoformat()}:{fim.isoformat()}'
+    serie = cache.get(cache_key)
+    if serie is None:
+        try:
+            with provider_call('yfinance', 'risk_service'):
+                hist = yf.Ticker(IBOV_SIMBOLO).history(start=inicio, end=fim + timedelta(days=1))
+            serie = hist['Close'] if not hist.empty else pd.Series(dtype=float)
+            serie.index = pd.to_datetime(serie.index).tz_localize(None).normalize()
+        except Exception as e:
+            logger.warning(f'Could not fetch {IBOV_SIMBOLO} history: {e}')
+            serie = pd.Series(dtype=float)
+        cache.set(cache_key, serie, RETURNS_CACHE_TIMEOUT if len(serie) else IBOV_FALHA_CACHE_TIMEOUT)
+    return serie
+
+
+def _retornos(precos: pd.DataFrame) -> pd.DataFrame:
+    """Daily simple returns; a missing day is folded into the next stored price."""
+    return precos.ffill().pct_change(fill_method=None).iloc[1:]
+
+
+def _covariancias(a: np.ndarray, b: np.ndarray):
+    """
+    Pairwise-complete moments between the columns of two (days x n) return
+    matrices with NaN gaps: for every pair, only the days where both have
+    a return count. Returns (observations, covariance, var_a, var_b), each
+    an (n_a x n_b) matrix, computed with matrix products.
+    """
+    ma, mb = (~np.isnan(a)).astype(float), (~np.isnan(b)).astype(float)
+    xa, xb = np.nan_to_num(a), np.nan_to_num(b)
+    n = ma.T @ mb
+    with np.errstate(divide='ignore', invalid='ignore'):
+        media_a = (xa.T @ mb) / n
+        media_b = (ma.T @ xb) / n
+        cov = (xa.T @ xb) / n - media_a * media_b
+        var_a = ((xa ** 2).T @ mb) / n - media_a ** 2
+        var_b = (ma.T @ xb ** 2) / n - media_b ** 2
+    return n, cov, var_a, var_b
+
+
+def _correlacoes(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    n, cov, var_a, var_b = _covariancias(a, b)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.sqrt(var_a * var_b)
+    return np.where(n >= RISCO_MIN_OBS, np.clip(corr, -1, 1), np.nan)
+
+
+def correlacao_incremental(user_pk: int, retornos: pd.DataFrame) -> pd.DataFrame:
+    """
+    Correlation matrix of the return columns, reusing the previous matrix
+    for every pair whose two columns are unchanged since it was computed.
+    Only the columns of new or changed ativos are correlated against the
+    rest, which is O(days x n) per added ativo instead of O(days x n^2).
+
+    A column's fingerprint covers only its own (date, return) pairs, so
+    dates that only other columns have do not invalidate it. When the
+    window moves forward a day every column changes and every pair is
+    recomputed; calcular_risco caches its result per trading day, so that
+    happens once a day.
+    """
+    ids = list(retornos.columns)
+    datas = retornos.index.asi8
+    impressoes = {}
+    for ativo_id in ids:
+        valores = retornos[ativo_id].to_numpy(dtype=float)
+        presentes = ~np.isnan(valores)
+        impressoes[ativo_id] = hashlib.blake2b(
+            datas[presentes].tobytes() + valores[presentes].tobytes(), digest_size=16
+        ).hexdigest()
+
+    cache_key = f'correlacao:{user_pk}'
+    anterior = cache.get(cache_key) or {'impressoes': {}, 'matriz': pd.DataFrame()}
+    mantidos = [i for i in ids if anterior['impressoes'].get(i) == impressoes[i]]
+    novos = [i for i in ids if i not in mantidos]
+
+    matriz = pd.DataFrame(np.nan, index=ids, columns=ids)
+    if mantidos:
+        matriz.loc[mantidos, mantidos] = anterior['matriz'].loc[mantidos, mantidos].to_numpy()
+    if novos:
+        bloco = _correlacoes(retornos[ids].to_numpy(), retornos[novos].to_numpy())
+        matriz.loc[ids, novos] = bloco
+        matriz.loc[novos, ids] = bloco.T
+
+    cache.set(cache_key, {'impressoes': impressoes, 'matriz': matriz}, RETURNS_CACHE_TIMEOUT)
+    return matriz
+
+
+def _max_drawdown(precos: np.ndarray) -> np.ndarray:
+    """Largest peak-to-trough fall of each column (NaN gaps ignored), as a negative fraction."""
+    if not len(precos):
+        return np.full(precos.shape[1], np.nan)
+    picos = np.fmax.accumulate(precos, axis=0)
+    return np.fmin.reduce(precos / picos - 1, axis=0)
+
+
+def _percentual(valor, casas: int = 2) -> Optional[float]:
+    return round(float(valor) * 100, casas) if np.isfinite(valor) else None
+
+
+def _arredondar(valor, casas: int = 4) -> Optional[float]:
+    return round(float(valor), casas) if np.isfinite(valor) else None
+
+
+def _estatisticas(retornos: np.ndarray, precos: np.ndarray, mercado: np.ndarray) -> Dict[str, np.ndarray]:
+    """Volatility, drawdown and beta of each column of the (days x n) matrices."""
+    observacoes = (~np.isnan(retornos)).sum(axis=0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        media = np.nansum(retornos, axis=0) / observacoes
+        variancia = np.nansum((retornos - media) ** 2, axis=0) / (observacoes - 1)
+        volatilidade = np.sqrt(variancia * DIAS_UTEIS_ANO)
+    volatilidade = np.where(observacoes >= RISCO_MIN_OBS, volatilidade, np.nan)
+
+    n, cov, _, var_mercado = _covariancias(retornos, mercado[:, np.newaxis])
+    with np.errstate(invalid='ignore', divide='ignore'):
+        beta = np.where(n[:, 0] >= RISCO_MIN_OBS, cov[:, 0] / var_mercado[:, 0], np.nan)
+    return {
+        'volatilidade': volatilidade,
+        'max_drawdown': _max_drawdown(precos),
+        'beta': beta,
+        'observacoes': observacoes,
+    }
+
+
+def calcular_risco(user, hoje: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Risk of every open position and of the portfolio per currency over the
+    last year of daily prices. Portfolio returns are the position-weighted
+    average of the available asset returns each day, weights being today's
+    values (valor_atual). Without the index history betas are None, and the
+    result is cached only as long as the failed download.
+    """
+    pregao = ultimo_pregao(hoje or timezone.localdate())
+    cache_key = f'risco:{user.pk}:{pregao.isoformat()}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    ativos = list(
+        Ativo.objects.filter(usuario=user, quantidade__gt=0).values_list('id', 'ticker', 'moeda', 'valor_atual')
+    )
+    ids = [a[0] for a in ativos]
+    inicio = pregao - timedelta(days=RISCO_JANELA_DIAS)
+    precos = historico_precos(ids, desde=inicio, somente_diarios=True)
+    precos = precos[precos.index <= pd.Timestamp(pregao)]
+    retornos = _retornos(precos)
+
+    # Index closes as of each stored date, so market and asset returns span the same days
+    ibov = historico_ibov(inicio, pregao) if len(retornos) else pd.Series(dtype=float)
+    ibov = ibov.reindex(precos.index.union(ibov.index)).ffill().reindex(precos.index)
+    mercado = _retornos(ibov.to_frame()).iloc[:, 0].to_numpy()
+
+    estatisticas = _estatisticas(retornos.to_numpy(), precos.to_numpy(), mercado)
+    resultado = {'data': pregao.isoformat(), 'ativos': [], 'carteira': {}}
+    moedas = np.array([a[2] for a in ativos])
+    valores = np.array([float(a[3]) for a in ativos])
+    for i, (ativo_id, ticker, moeda, _) in enumerate(ativos):
+        total_moeda = valores[moedas == moeda].sum()
+        resultado['ativos'].append({
+            'ativo_id': ativo_id,
+            'ticker': ticker,
+            'moeda': moeda,
+            'peso': _percentual(valores[i] / total_moeda if total_moeda else np.nan),
+            'volatilidade': _percentual(estatisticas['volatilidade'][i]),
+            'max_drawdown': _percentual(estatisticas['max_drawdown'][i]),
+            'beta': _arredondar(estatisticas['beta'][i]),
+            'observacoes': int(estatisticas['observacoes'][i]),
+        })
+
+    # One synthetic column per currency: the weighted return of its positions each day
+    r = retornos.to_numpy()
+    presentes = ~np.isnan(r)
+    for moeda in sorted(set(moedas)):
+        pesos = np.where(moedas == moeda, valores, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            carteira = np.nansum(r * pesos, axis=1) / (presentes * pesos).sum(axis=1)
+        cota = np.cumprod(np.concatenate([[1.0], 1 + np.nan_to_num(carteira)]))
+        est = _estatisticas(carteira[:, np.newaxis], cota[:, np.newaxis], mercado)
+        resultado['carteira'][moeda] = {
+            'volatilidade': _percentual(est['volatilidade'][0]),
+            'max_drawdown': _percentual(est['max_drawdown'][0]),
+            'beta': _arredondar(est['beta'][0]),
+        }
+
+    matriz = correlacao_incremental(user.pk, retornos)
+    resultado['correlacao'] = {
+        'tickers': [a[1] for a in ativos],
+        'matriz': [[_arredondar(v) for v in linha] for linha in matriz.to_numpy()],
+    }
+
+    sem_indice = not retornos.empty and ibov.isna().all()
+    cache.set(cache_key, resultado, IBOV_FALHA_CACHE_TIMEOUT if sem_indice else RETURNS_CACHE_TIMEOUT)
+    return resultado
@@ -0,0 +1,130 @@
+import re
+import unicodedata
+from typing import List, Optional
+
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.db.models.expressions import RawSQL
+from rest_framework.filters import SearchFilter
+
+# FTS5 table indexing each ativo's ticker and nome, one row per ativo with
+# the ativo id as rowid. The owner is an indexed column too, so a user's
+# search is a single index lookup ("usuario:u<id> AND ...") instead of a
+# scan over everyone's ativos. Triggers on the ativo table keep it in sync
+# for every write path (save, QuerySet.update, bulk_create, raw SQL); the
+# tokenizer folds case and accents. Only created on SQLite; other backends
+# fall back to icontains.
+SEARCH_TABLE = 'ativo_busca'
+# Only the best SEARCH_LIMIT matches are ranked; the others still match and follow them
+SEARCH_LIMIT = 200
+
+_TERM_RE = re.compile(r'\w+')
+
+
+def search_index_available() -> bool:
+    return connection.vendor == 'sqlite'
+
+
+def normalizar(texto: str) -> str:
+    """Lowercase and strip accents, so "Itaú" and "itau" index the same way."""
+    decomposed = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower()
+
+
+def _termos(query: str) -> List[str]:
+    return _TERM_RE.findall(normalizar(query))
+
+
+def _match(usuario_id: int, query: str) -> Optional[str]:
+    """The FTS5 MATCH expression for the user's ativos matching every term, or None without terms."""
+    termos = _termos(query)
+    if not termos:
+        return None
+    return ' AND '.join([f'usuario:"u{usuario_id}"'] + [f'{{ticker nome}}:"{termo}"*' for termo in termos])
+
+
+def buscar_ativo_ids(usuario_id: int, query: str, limit: int = SEARCH_LIMIT) -> Optional[List[int]]:
+    """
+    Return the ids of the user's best `limit` ativos matching every term of
+    the query as a word prefix of ticker or nome, best match first (bm25,
+    ticker weighted over nome). Returns None when the index is not
+    available on this database.
+    """
+    if not search_index_available():
+        return None
+    match = _match(usuario_id, query)
+    if match is None:
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT ativo_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+            f'ORDER BY bm25({SEARCH_TABLE}, 0.0, 10.0, 1.0) LIMIT %s',
+            [match, limit],
+        )
+        return [row[0] for row in cursor.fetchall()]
+
+
+def ativos_correspondentes(usuario_id: int, query: str):
+    """
+    Every ativo id matching the query, unranked and uncapped, as a subquery
+    for an ``__in`` filter (the rank is only needed for the first page of
+    results, the filter must keep every match).
+    """
+    match = _match(usuario_id, query)
+    if match is None:
+        return []
+    return RawSQL(f'SELECT ativo_id FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s', [match])
+
+
+def ordenar_por_relevancia(queryset, ids: List[int], field: str = 'pk'):
+    """Order a queryset by the position of `field` in a ranked id list; rows not in it come last."""
+    if not ids:
+        return queryset
+    rank = Case(
+        *[When(**{field: pk}, then=Value(pos)) for pos, pk in enumerate(ids)],
+        default=Value(len(ids)), output_field=IntegerField(),
+    )
+    return queryset.order_by(rank, *queryset.query.order_by)
+
+
+def filtrar_por_ticker(queryset, usuario_id: int, ticker: str, field: str = 'pk'):
+    """
+    Filter a queryset to the user's ativos whose ticker contains `ticker`.
+    The LIKE runs over the user's own ativos (through the usuario index),
+    not over every row joined to ativo.
+    """
+    from .models import Ativo
+
+    ids = Ativo.objects.filter(usuario_id=usuario_id, ticker__icontains=ticker).values('pk')
+    return queryset.filter(**{f'{field}__in': ids})
+
+
+class IndexedSearchFilter(SearchFilter):
+    """
+    SearchFilter backed by the ativo search index.
+
+    ``search_ativo_field`` names the path from the view's model to the ativo
+    id ("pk" for Ativo, "ativo_id" for Movimentacao/Dividendo). Matches are
+    ranked unless the client asked for an explicit ``ordering``; list this
+    backend after OrderingFilter so the rank goes in front of the default
+    ordering. ``search_exact_fields`` (e.g. operacao) are matched exactly
+    instead of with LIKE.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        query = request.query_params.get(self.search_param, '')
+        ativo_field = getattr(view, 'search_ativo_field', None)
+        if not query.strip() or ativo_field is None:
+            return super().filter_queryset(request, queryset, view)
+
+        ids = buscar_ativo_ids(request.user.pk, query)
+        if ids is None:
+            return super().filter_queryset(request, queryset, view)
+
+        condition = Q(**{f'{ativo_field}__in': ativos_correspondentes(request.user.pk, query)})
+        for field in getattr(view, 'search_exact_fields', ()):
+            condition |= Q(**{f'{field}__iexact': query.strip()})
+        queryset = queryset.filter(condition)
+        if 'ordering' not in request.query_params:
+            queryset = ordenar_por_relevancia(queryset, ids, ativo_field)
+        return queryset
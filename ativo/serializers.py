@@ -1,13 +1,14 @@
 from rest_framework import serializers
 from .models import Categoria, Ativo, Movimentacao, Dividendo, EvolucaoPatrimonial, Snapshot
+from .timing import SerializerTimingMixin
 
-class CategoriaSerializer(serializers.ModelSerializer):
+class CategoriaSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     class Meta:
         model = Categoria
         fields = ['id', 'tipo', 'subtipo', 'descricao', 'dataCriacao', 'dataAlteracao']
         read_only_fields = ['dataCriacao', 'dataAlteracao']
 
-class AtivoSerializer(serializers.ModelSerializer):
+class AtivoSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     usuario = serializers.HiddenField(default=serializers.CurrentUserDefault())
     categoria_nome = serializers.CharField(source='categoria.descricao', read_only=True)
     categoria_tipo = serializers.CharField(source='categoria.tipo', read_only=True)
@@ -49,7 +50,27 @@ class AtivoSerializer(serializers.ModelSerializer):
             instance.is_preco_estimado = False
         return super().update(instance, validated_data)
 
-class MovimentacaoSerializer(serializers.ModelSerializer):
+class AtivoPorUsuarioField(serializers.PrimaryKeyRelatedField):
+    """
+    Resolve ativo ids from a prefetched {id: Ativo} map in context['ativos']
+    when one is given (bulk requests), instead of one query per row.
+    """
+
+    def to_internal_value(self, data):
+        ativos = self.context.get('ativos')
+        if ativos is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return ativos[int(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+class MovimentacaoSerializer(SerializerTimingMixin, serializers.ModelSerializer):
+    ativo = AtivoPorUsuarioField(queryset=Ativo.objects.all())
     ativo_display = serializers.SerializerMethodField()
     operacao_display = serializers.SerializerMethodField()
 
@@ -73,7 +94,7 @@ class MovimentacaoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You can only create transactions for your own assets.")
         return value
 
-class DividendoSerializer(serializers.ModelSerializer):
+class DividendoSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     ativo_display = serializers.SerializerMethodField()
 
     class Meta:
@@ -92,7 +113,7 @@ class DividendoSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError("You can only create dividends for your own assets.")
         return value
 
-class EvolucaoPatrimonialSerializer(serializers.ModelSerializer):
+class EvolucaoPatrimonialSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     ativo_ticker = serializers.CharField(source='ativo.ticker', read_only=True)
     ativo_nome = serializers.CharField(source='ativo.nome', read_only=True)
     categoria_nome = serializers.CharField(source='ativo.categoria_display', read_only=True)
@@ -131,7 +152,7 @@ class EvolucaoPatrimonialSerializer(serializers.ModelSerializer):
             
         return data
 
-class SnapshotSerializer(serializers.ModelSerializer):
+class SnapshotSerializer(SerializerTimingMixin, serializers.ModelSerializer):
     ativo_nome = serializers.CharField(source='ativo.nome', read_only=True)
     ativo_ticker = serializers.CharField(source='ativo.ticker', read_only=True)
     moeda = serializers.CharField(source='ativo.moeda', read_only=True)
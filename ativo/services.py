@@ -2,32 +2,36 @@ import yfinance as yf
 from datetime import date, datetime, timedelta
 from decimal import Decimal
 from django.db import transaction
-from .models import Ativo, EvolucaoPatrimonial, Movimentacao, Dividendo, Snapshot, PrecoCache
-from .icon_service import fetch_ativo_icon
-import pandas as pd
+from .models import Ativo, EvolucaoPatrimonial, Movimentacao, Dividendo, Snapshot, PrecoCache, VersaoDados
 import os
 from django.utils import timezone
 import logging
 from typing import Tuple, Optional, List, Dict, Any
 import requests
-from django.db.models import Sum, F, ExpressionWrapper, FloatField, Case, When, Value
+from django.db.models import Sum, F, ExpressionWrapper, FloatField, Case, When, Value, Count, Q, DecimalField
+from django.core.cache import cache
 from django.db.models.functions import Coalesce
 from .types import PrecoInfo, AtivoInfo
-from django.db.utils import OperationalError
+from .filters import intervalo_mes
+from .timing import measure
+from .metrics import provider_call, record_provider_error, record_cache_lookup, job
+from .import_service import importar_arquivo
+from .symbol_service import acom_simbolo, com_simbolo
+from django.db.utils import DatabaseError, OperationalError
 import time
+from asgiref.sync import sync_to_async
 
 logger = logging.getLogger(__name__)
 
 def calculate_monthly_dividends(ativo: Ativo, snapshot_date: date) -> Decimal:
     """Calculate total dividends for an asset in a specific month."""
-    year = snapshot_date.year
-    month = snapshot_date.month
+    inicio, fim = intervalo_mes(snapshot_date.year, snapshot_date.month)
     
     # Get all dividends for this asset in the specified month
     monthly_dividends = Dividendo.objects.filter(
         ativo=ativo,
-        data__year=year,
-        data__month=month
+        data__gte=inicio,
+        data__lt=fim
     )
     
     total_dividends = sum(dividend.valor for dividend in monthly_dividends)
@@ -92,32 +96,45 @@ def create_snapshot(ativo: Ativo) -> Snapshot:
     """Create a snapshot of the current state of an asset"""
     try:
         current_price, is_estimated = ativo.get_current_price()
-        snapshot, created = Snapshot.objects.update_or_create(
-            ativo=ativo,
-            data=timezone.now().date(),
-            defaults={
-                'preco': current_price,
-                'quantidade': ativo.quantidade,
-                'valor_total': ativo.valor_atual,
-                'is_preco_estimado': is_estimated
-            }
-        )
-        # Create an EvolucaoPatrimonial instance with the snapshot data
-        EvolucaoPatrimonial.objects.create(
-            ativo=ativo,
-            data=snapshot.data,
-            preco_atual=snapshot.preco,
-            quantidade=snapshot.quantidade,
-            valor_total=snapshot.valor_total,
-            custo_total=calculate_current_cost(ativo),
-            dividendos_mes=0  # This will be calculated later if needed
-        )
-        logger.info(f"Snapshot created: {snapshot}")
-        return snapshot
+        return save_snapshot(ativo, current_price, is_estimated)
     except Exception as e:
         logger.error(f"Error creating snapshot for {ativo.ticker}: {str(e)}")
         raise
 
+async def acreate_snapshot(ativo: Ativo) -> Snapshot:
+    """Async create_snapshot: awaits the price provider, then persists in the ORM thread."""
+    try:
+        current_price, is_estimated = await aget_current_price(ativo.ticker, ativo.moeda)
+        return await sync_to_async(save_snapshot)(ativo, current_price, is_estimated)
+    except Exception as e:
+        logger.error(f"Error creating snapshot for {ativo.ticker}: {str(e)}")
+        raise
+
+def save_snapshot(ativo: Ativo, current_price: Decimal, is_estimated: bool) -> Snapshot:
+    """Persist the Snapshot and EvolucaoPatrimonial rows for an already fetched price"""
+    snapshot, created = Snapshot.objects.update_or_create(
+        ativo=ativo,
+        data=timezone.now().date(),
+        defaults={
+            'preco': current_price,
+            'quantidade': ativo.quantidade,
+            'valor_total': ativo.valor_atual,
+            'is_preco_estimado': is_estimated
+        }
+    )
+    # Create an EvolucaoPatrimonial instance with the snapshot data
+    EvolucaoPatrimonial.objects.create(
+        ativo=ativo,
+        data=snapshot.data,
+        preco_atual=snapshot.preco,
+        quantidade=snapshot.quantidade,
+        valor_total=snapshot.valor_total,
+        custo_total=calculate_current_cost(ativo),
+        dividendos_mes=0  # This will be calculated later if needed
+    )
+    logger.info(f"Snapshot created: {snapshot}")
+    return snapshot
+
 def create_snapshots_for_all_assets(snapshot_date=None, user=None):
     """Create snapshots for all assets for a given date and user (optional)."""
     if snapshot_date is None:
@@ -126,16 +143,19 @@ def create_snapshots_for_all_assets(snapshot_date=None, user=None):
         ativos = Ativo.objects.filter(usuario=user)
     else:
         ativos = Ativo.objects.all()
-    for ativo in ativos:
-        try:
-            create_snapshot(ativo)
-        except Exception as e:
-            logger.error(f"Error creating snapshot for {ativo.ticker}: {str(e)}")
-            continue
+    with job('snapshots') as rows_written:
+        for ativo in ativos:
+            try:
+                create_snapshot(ativo)
+                rows_written(2)  # Snapshot + EvolucaoPatrimonial
+            except Exception as e:
+                logger.error(f"Error creating snapshot for {ativo.ticker}: {str(e)}")
+                continue
 
-def import_dividendos_from_excel(file_path, user, stdout=None):
+def import_dividendos_from_excel(arquivo, user, stdout=None, nome_arquivo=None):
     """
-    Import dividendos from an Excel file for a specific user.
+    Import dividendos from an XLSX or CSV file (a path or an uploaded file
+    object) for a specific user.
     Returns a summary dict.
     """
     summary = {
@@ -143,88 +163,51 @@ def import_dividendos_from_excel(file_path, user, stdout=None):
         'errors': [],
     }
     
-    try:
-        df = pd.read_excel(file_path)
-        
-        with transaction.atomic():
-            for idx, row in df.iterrows():
-                try:
-                    # Extract ticker from 'Produto' column (format: "BBAS3 - BANCO DO BRASIL S/A")
-                    produto = str(row['Produto']).strip()
-                    ticker = produto.split(' - ')[0].strip() if ' - ' in produto else produto.strip()
-                    
-                    # Handle ticker normalization (remove 'F' suffix if present)
-                    if ticker.endswith('F') and len(ticker) > 1:
-                        ticker = ticker[:-1]
-                    
-                    # Parse date from 'Pagamento' column
-                    data_pagamento = pd.to_datetime(row['Pagamento'], format='%d/%m/%Y').date()
-                    
-                    # Parse valor from 'Valor líquido' column
-                    valor_liquido = str(row['Valor líquido']).replace(',', '.')
-                    valor = Decimal(valor_liquido)
-                    
-                    # Find the ativo for this user
-                    try:
-                        ativo = Ativo.objects.get(ticker=ticker, usuario=user)
-                    except Ativo.DoesNotExist:
-                        summary['errors'].append(f'Row {idx + 1}: Ativo {ticker} não encontrado para o usuário')
-                        if stdout:
-                            stdout.write(f'Error: Ativo {ticker} not found for user')
-                        continue
-                    
-                    # Create dividendo
-                    dividendo, created = Dividendo.objects.get_or_create(
-                        ativo=ativo,
-                        data=data_pagamento,
-                        valor=valor
-                    )
-                    
-                    if created:
-                        summary['created_dividendos'] += 1
-                        if stdout:
-                            stdout.write(f'Created dividendo: {ticker} - {data_pagamento} - {valor}')
-                    else:
-                        if stdout:
-                            stdout.write(f'Dividendo already exists: {ticker} - {data_pagamento} - {valor}')
-                    
-                except Exception as e:
-                    summary['errors'].append(f'Row {idx + 1}: {str(e)}')
-                    if stdout:
-                        stdout.write(f'Error processing row {idx + 1}: {str(e)}')
-                    continue
-    
-    except Exception as e:
-        summary['errors'].append(str(e))
-        if stdout:
-            stdout.write(f'Error reading file: {str(e)}')
-    
+    with job('import_dividendos') as rows_written:
+        try:
+            importar_arquivo(arquivo, nome_arquivo, user, 'dividendos', summary, stdout=stdout)
+        except Exception as e:
+            summary['errors'].append(str(e))
+            if stdout:
+                stdout.write(f'Error reading file: {str(e)}')
+        rows_written(summary['created_dividendos'])
     return summary
 
+
+def fetch_yahoo_price(yahoo_ticker: str) -> Optional[Decimal]:
+    """Busca o preço de mercado no Yahoo Finance (chamada de rede bloqueante)."""
+    with measure('price'), provider_call('yfinance', 'services'):
+        info = yf.Ticker(yahoo_ticker).info
+    if not info or 'regularMarketPrice' not in info:
+        record_provider_error('yfinance', 'services')
+        return None
+    return Decimal(str(info['regularMarketPrice']))
+
+PRECO_CACHE_VALIDADE = timedelta(minutes=60)
+
+def _cache_valido(cache: Optional[PrecoCache], call_site: str) -> bool:
+    """Whether a PrecoCache entry is fresh enough to serve; records the lookup metrics."""
+    if cache is None:
+        record_cache_lookup(call_site, None, False)
+        return False
+    idade = timezone.now() - cache.data_atualizacao
+    fresco = idade < PRECO_CACHE_VALIDADE
+    record_cache_lookup(call_site, idade.total_seconds(), fresco)
+    return fresco
+
 def get_current_price(ticker: str, moeda: str = 'BRL') -> Tuple[Decimal, bool]:
     """Obtém o preço atual de um ativo."""
     try:
         # Tenta obter do cache primeiro
-        cache = PrecoCache.objects.filter(
-            ticker=ticker,
-            moeda=moeda,
-            data_atualizacao__gte=timezone.now() - timedelta(minutes=60)
-        ).first()
-        
-        if cache:
+        cache = PrecoCache.objects.filter(ticker=ticker, moeda=moeda).first()
+        if _cache_valido(cache, 'services'):
             return cache.preco, cache.is_estimado
             
-        # Se não estiver em cache, busca do Yahoo Finance
-        if moeda == 'BRL':
-            ticker = f"{ticker}.SA"
-            
-        stock = yf.Ticker(ticker)
-        info = stock.info
+        # Se não estiver em cache, busca do Yahoo Finance (símbolo resolvido uma vez por ticker/moeda)
+        preco = com_simbolo(ticker, moeda, fetch_yahoo_price)
         
-        if not info or 'regularMarketPrice' not in info:
+        if preco is None:
             return Decimal('0'), True  # Preço estimado se não conseguir obter
-            
-        preco = Decimal(str(info['regularMarketPrice']))
         
         # Tenta atualizar o cache com retries
         max_retries = 3
@@ -234,7 +217,7 @@ def get_current_price(ticker: str, moeda: str = 'BRL') -> Tuple[Decimal, bool]:
             try:
                 with transaction.atomic():
                     PrecoCache.objects.update_or_create(
-                        ticker=ticker.replace('.SA', ''),
+                        ticker=ticker,
                         moeda=moeda,
                         defaults={
                             'preco': preco,
@@ -253,4 +236,300 @@ def get_current_price(ticker: str, moeda: str = 'BRL') -> Tuple[Decimal, bool]:
         
     except Exception as e:
         print(f"Erro ao obter preço de {ticker}: {str(e)}")
-        return Decimal('0'), True  # Preço estimado em caso de erro 
\ No newline at end of file
+        return Decimal('0'), True  # Preço estimado em caso de erro
+
+async def aget_current_price(ticker: str, moeda: str = 'BRL') -> Tuple[Decimal, bool]:
+    """
+    Versão assíncrona de get_current_price para views ASGI.
+    Só a chamada ao Yahoo Finance roda numa thread própria (o banco é
+    acessado pelo ORM assíncrono), então várias atualizações concorrentes
+    não bloqueiam o event loop nem umas às outras.
+    """
+    try:
+        cache = await PrecoCache.objects.filter(ticker=ticker, moeda=moeda).afirst()
+        if _cache_valido(cache, 'services'):
+            return cache.preco, cache.is_estimado
+
+        preco = await acom_simbolo(ticker, moeda, fetch_yahoo_price)
+
+        if preco is None:
+            return Decimal('0'), True
+
+        try:
+            await PrecoCache.objects.aupdate_or_create(
+                ticker=ticker,
+                moeda=moeda,
+                defaults={
+                    'preco': preco,
+                    'is_estimado': False
+                }
+            )
+        except OperationalError as e:
+            logger.warning(f"Erro ao atualizar cache para {ticker}: {str(e)}")
+
+        return preco, False
+
+    except Exception as e:
+        logger.error(f"Erro ao obter preço de {ticker}: {str(e)}")
+        return Decimal('0'), True 
+
+SERIES_GROUP_FIELDS = {
+    'ticker': 'ativo__ticker',
+    'categoria': 'ativo__categoria__tipo',
+    'subtipo': 'ativo__categoria__subtipo',
+}
+
+def build_evolucao_series(user, group_by: Optional[str] = None, start: Optional[date] = None, end: Optional[date] = None,
+                          moeda: str = 'BRL') -> Dict[str, Any]:
+    """
+    Build columnar time series of EvolucaoPatrimonial for charts.
+
+    Returns one array per metric aligned with ``dates`` instead of one object
+    per row, for the ativos in one currency (amounts in different currencies
+    don't add up). Totals are always present; with ``group_by`` (ticker,
+    categoria or subtipo) each metric also gets one array per group key. All
+    values come from a single aggregated values_list query.
+    """
+    if group_by is not None and group_by not in SERIES_GROUP_FIELDS:
+        raise ValueError(f"group_by must be one of: {', '.join(SERIES_GROUP_FIELDS)}")
+
+    queryset = EvolucaoPatrimonial.objects.filter(ativo__usuario=user, ativo__moeda=moeda)
+    if start:
+        queryset = queryset.filter(data__gte=start)
+    if end:
+        queryset = queryset.filter(data__lte=end)
+
+    group_fields = ['data']
+    if group_by:
+        group_fields.append(SERIES_GROUP_FIELDS[group_by])
+
+    rows = queryset.order_by().values_list(*group_fields).annotate(
+        valor=Sum('valor_total'),
+        custo=Sum('custo_total'),
+        dividendos=Sum('dividendos_mes'),
+    ).order_by(*group_fields)
+
+    dates: List[date] = []
+    date_index: Dict[date, int] = {}
+    grouped: Dict[str, Dict[int, Tuple[float, float, float]]] = {}
+    for row in rows:
+        data = row[0]
+        if data not in date_index:
+            date_index[data] = len(dates)
+            dates.append(data)
+        key = row[1] if group_by else None
+        grouped.setdefault(key, {})[date_index[data]] = (
+            float(row[-3] or 0), float(row[-2] or 0), float(row[-1] or 0)
+        )
+
+    size = len(dates)
+    total_valores = [0.0] * size
+    total_custos = [0.0] * size
+    total_dividendos = [0.0] * size
+    series = {}
+    for key, points in grouped.items():
+        valores = [0.0] * size
+        custos = [0.0] * size
+        dividendos = [0.0] * size
+        for i, (valor, custo, dividendo) in points.items():
+            valores[i], custos[i], dividendos[i] = valor, custo, dividendo
+            total_valores[i] += valor
+            total_custos[i] += custo
+            total_dividendos[i] += dividendo
+        if group_by:
+            series[key] = {'valores': valores, 'custos': custos, 'dividendos': dividendos}
+
+    result = {
+        'moeda': moeda,
+        'dates': [d.isoformat() for d in dates],
+        'valores': total_valores,
+        'custos': total_custos,
+        'dividendos': total_dividendos,
+    }
+    if group_by:
+        result['group_by'] = group_by
+        result['keys'] = sorted(series)
+        result['series'] = series
+    return result
+
+
+DASHBOARD_CACHE_TIMEOUT = 24 * 3600
+DASHBOARD_TOP_N = 5
+
+def _as_float(value) -> float:
+    return float(value or 0)
+
+def _percentual(parte, total) -> float:
+    return float(parte / total * 100) if total else 0.0
+
+def build_dashboard(user, hoje: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Compute the dashboard aggregates for a user, one block per currency.
+
+    Totals, allocation by categoria tipo/subtipo, target peso vs. actual
+    weight, best/worst performers and dividend totals come from a handful of
+    aggregate queries instead of the full ativos/movimentacoes lists. The
+    result is cached per user data version, so it is only recomputed after a
+    change, and per day, since the 12-month and current-year dividend totals
+    move with the date.
+    """
+    hoje = hoje or timezone.localdate()
+    cache_key = f'dashboard:{user.pk}:{hoje.isoformat()}:{VersaoDados.get_versao(user.pk)}'
+    cached = cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    ativos = Ativo.objects.filter(usuario=user)
+    investido = ExpressionWrapper(F('quantidade') * F('preco_medio'), output_field=DecimalField(max_digits=30, decimal_places=8))
+
+    # Query 1: totals per currency
+    moedas = {}
+    valor_por_moeda = {}
+    for row in ativos.values('moeda').annotate(
+        total_investido=Sum(investido),
+        valor_atual=Sum('valor_atual'),
+        peso_total=Sum('peso'),
+        count_ativos=Count('id'),
+        count_em_carteira=Count('id', filter=Q(quantidade__gt=0)),
+        count_preco_estimado=Count('id', filter=Q(is_preco_estimado=True)),
+    ).order_by('moeda'):
+        total_investido = row['total_investido'] or 0
+        valor_atual = row['valor_atual'] or 0
+        valor_por_moeda[row['moeda']] = valor_atual
+        moedas[row['moeda']] = {
+            'total_investido': _as_float(total_investido),
+            'valor_atual': _as_float(valor_atual),
+            'lucro_prejuizo': _as_float(valor_atual - total_investido),
+            'rendimento_percentual': _percentual(valor_atual - total_investido, total_investido),
+            'peso_total': _as_float(row['peso_total']),
+            'count_ativos': row['count_ativos'],
+            'count_em_carteira': row['count_em_carteira'],
+            'count_preco_estimado': row['count_preco_estimado'],
+            'alocacao': [],
+            'pesos': [],
+            'melhores': [],
+            'piores': [],
+            'dividendos': {'total': 0.0, 'ultimos_12_meses': 0.0, 'ano_atual': 0.0},
+        }
+
+    # Query 2: allocation by categoria tipo/subtipo
+    for row in ativos.values('moeda', 'categoria__tipo', 'categoria__subtipo').annotate(
+        valor_atual=Sum('valor_atual'),
+        total_investido=Sum(investido),
+        peso=Sum('peso'),
+    ).order_by('moeda', 'categoria__tipo', 'categoria__subtipo'):
+        bloco = moedas[row['moeda']]
+        bloco['alocacao'].append({
+            'tipo': row['categoria__tipo'],
+            'subtipo': row['categoria__subtipo'],
+            'valor_atual': _as_float(row['valor_atual']),
+            'total_investido': _as_float(row['total_investido']),
+            'percentual': _percentual(row['valor_atual'] or 0, valor_por_moeda[row['moeda']]),
+            'peso_alvo': _as_float(row['peso']),
+        })
+
+    # Query 3: per-asset weight and performance (values only, no model instances)
+    desempenho = []
+    for row in ativos.annotate(investido=investido).values_list('moeda', 'ticker', 'valor_atual', 'investido', 'peso'):
+        moeda, ticker, valor_atual, total_investido, peso = row
+        total_investido = total_investido or 0
+        bloco = moedas[moeda]
+        peso_atual = _percentual(valor_atual, valor_por_moeda[moeda])
+        bloco['pesos'].append({
+            'ticker': ticker,
+            'peso_alvo': _as_float(peso),
+            'peso_atual': peso_atual,
+            'diferenca': peso_atual - _as_float(peso),
+        })
+        if total_investido > 0:
+            desempenho.append((moeda, ticker, _percentual(valor_atual - total_investido, total_investido), _as_float(valor_atual - total_investido)))
+
+    desempenho.sort(key=lambda item: item[2])
+    for moeda, bloco in moedas.items():
+        itens = [
+            {'ticker': ticker, 'rendimento_percentual': pct, 'lucro_prejuizo': lucro}
+            for m, ticker, pct, lucro in desempenho if m == moeda
+        ]
+        bloco['melhores'] = list(reversed(itens[-DASHBOARD_TOP_N:]))
+        bloco['piores'] = itens[:DASHBOARD_TOP_N]
+
+    # Query 4: dividend totals with conditional aggregation
+    for row in Dividendo.objects.filter(usuario=user).values('ativo__moeda').annotate(
+        total=Sum('valor'),
+        ultimos_12_meses=Sum('valor', filter=Q(data__gt=hoje - timedelta(days=365))),
+        ano_atual=Sum('valor', filter=Q(data__gte=date(hoje.year, 1, 1))),
+    ).order_by('ativo__moeda'):
+        if row['ativo__moeda'] in moedas:
+            moedas[row['ativo__moeda']]['dividendos'] = {
+                'total': _as_float(row['total']),
+                'ultimos_12_meses': _as_float(row['ultimos_12_meses']),
+                'ano_atual': _as_float(row['ano_atual']),
+            }
+
+    result = {'moedas': moedas}
+    cache.set(cache_key, result, DASHBOARD_CACHE_TIMEOUT)
+    return result
+
+
+def recompute_ativos(ativo_ids) -> None:
+    """Replay the movimentacoes of each given ativo once and refresh quantidade/preco_medio."""
+    for ativo in Ativo.objects.filter(pk__in=set(ativo_ids)):
+        ativo.update_quantidade_preco_medio()
+
+MOVIMENTACAO_BULK_FIELDS = ['ativo', 'usuario', 'data', 'operacao', 'quantidade', 'valorUnitario', 'taxa', 'custoTotal', 'dataAlteracao']
+
+def bulk_save_movimentacoes(novas: List[Movimentacao], alteradas: Optional[List[Movimentacao]] = None, ativos_anteriores=(), recompute: bool = True) -> Dict[int, str]:
+    """
+    Insert and update movimentacoes in bulk inside one transaction.
+
+    bulk_create/bulk_update skip Movimentacao.save() and its signals, so
+    custoTotal and usuario are filled here, every touched ativo (including the
+    previous ativo of a moved row) is recomputed exactly once, and each
+    affected user's data version is bumped once. Pass recompute=False when
+    the caller recomputes the ativos itself (e.g. once after a chunked import).
+
+    If the database rejects the batch, it is saved again row by row, each row
+    in its own savepoint, so one bad row does not discard the others. Returns
+    {position: error} for the rows that were not saved, positions counting
+    novas first and then alteradas.
+    """
+    alteradas = alteradas or []
+    agora = timezone.now()
+    for mov in novas + alteradas:
+        mov.custoTotal = (mov.quantidade * mov.valorUnitario) + mov.taxa
+        mov.usuario_id = mov.ativo.usuario_id
+    for mov in alteradas:
+        mov.dataAlteracao = agora
+
+    falhas: Dict[int, str] = {}
+    try:
+        with transaction.atomic():
+            if novas:
+                Movimentacao.objects.bulk_create(novas)
+            if alteradas:
+                Movimentacao.objects.bulk_update(alteradas, MOVIMENTACAO_BULK_FIELDS)
+            if recompute:
+                recompute_ativos([mov.ativo_id for mov in novas + alteradas] + list(ativos_anteriores))
+    except DatabaseError:
+        with transaction.atomic():
+            for posicao, mov in enumerate(novas + alteradas):
+                nova = posicao < len(novas)
+                if nova:
+                    mov.pk = None
+                try:
+                    with transaction.atomic():
+                        if nova:
+                            Movimentacao.objects.bulk_create([mov])
+                        else:
+                            Movimentacao.objects.bulk_update([mov], MOVIMENTACAO_BULK_FIELDS)
+                except DatabaseError as e:
+                    if nova:
+                        mov.pk = None
+                    falhas[posicao] = str(e)
+            if recompute:
+                salvas = [mov for posicao, mov in enumerate(novas + alteradas) if posicao not in falhas]
+                recompute_ativos([mov.ativo_id for mov in salvas] + list(ativos_anteriores))
+
+    for usuario_id in {mov.usuario_id for mov in novas + alteradas}:
+        VersaoDados.incrementar(usuario_id)
+    return falhas
@@ -0,0 +1,105 @@
+"""
+Yahoo Finance symbol per (ticker, moeda).
+
+B3 tickers need a ".SA" suffix and London ones ".L", but not every asset
+follows its currency's exchange (BDRs, ETFs listed abroad, crypto). The
+working symbol is found once, by trying the candidates in order with the
+caller's own request, and stored on the Instrumento; from then on every
+price and history path uses that symbol directly, with a single request.
+
+An empty answer is not proof that a symbol is unknown: Yahoo also answers
+empty while rate-limiting. So a stored symbol that stops answering is
+resolved again, and one stored from a later candidate has the preferred
+candidates retried every REVERIFICAR_ALTERNATIVO.
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from asgiref.sync import sync_to_async
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+REVERIFICAR_ALTERNATIVO = timedelta(days=7)
+
+# Suffixes tried in order for each currency; '' is the bare ticker
+SUFIXOS = {
+    'BRL': ['.SA', ''],
+    'GBP': ['.L', ''],
+}
+
+
+def candidatos(ticker: str, moeda: str) -> List[str]:
+    return [f'{ticker}{sufixo}' for sufixo in SUFIXOS.get(moeda, [''])]
+
+
+def simbolo_salvo(ticker: str, moeda: str) -> Tuple[Optional[str], Optional[datetime]]:
+    """The stored symbol and when it was last stored, or (None, None)."""
+    from .models import Instrumento
+
+    return Instrumento.objects.filter(ticker=ticker, moeda=moeda).exclude(yahoo_symbol='').values_list(
+        'yahoo_symbol', 'dataAlteracao'
+    ).first() or (None, None)
+
+
+def salvar_simbolo(ticker: str, moeda: str, simbolo: str) -> None:
+    from .models import Instrumento
+
+    instrumento = Instrumento.para_tickers([ticker], moeda)[ticker]
+    Instrumento.objects.filter(pk=instrumento.pk).update(yahoo_symbol=simbolo, dataAlteracao=timezone.now())
+
+
+def _tentativas(ticker: str, moeda: str, salvo: Optional[str], salvo_em: Optional[datetime]) -> Tuple[List[str], bool]:
+    """
+    The symbols to try, in order, and whether the first one is the stored
+    symbol used as is (an answer from it needs no save).
+    """
+    ordem = candidatos(ticker, moeda)
+    alternativo = salvo in ordem[1:]
+    if salvo and not (alternativo and timezone.now() - salvo_em >= REVERIFICAR_ALTERNATIVO):
+        return [salvo] + [simbolo for simbolo in ordem if simbolo != salvo], True
+    return ordem, False
+
+
+def com_simbolo(ticker: str, moeda: str, buscar: Callable[[str], Optional[T]]) -> Optional[T]:
+    """
+    Call buscar(symbol) and return its result; buscar returns None when the
+    symbol gave no data.
+
+    With a stored symbol that answers this is exactly one call. Otherwise
+    the candidates are tried in order and the first one that answers is
+    stored, so the fallback costs extra requests only the first time a
+    ticker is seen, when the stored symbol stops answering (it is kept if
+    no other candidate answers either), and when a fallback symbol is due
+    for its periodic check of the preferred ones.
+    """
+    tentativas, confiavel = _tentativas(ticker, moeda, *simbolo_salvo(ticker, moeda))
+    for indice, simbolo in enumerate(tentativas):
+        resultado = buscar(simbolo)
+        if resultado is not None:
+            if indice or not confiavel:
+                salvar_simbolo(ticker, moeda, simbolo)
+            return resultado
+    logger.warning(f'No Yahoo Finance symbol found for {ticker} ({moeda})')
+    return None
+
+
+async def acom_simbolo(ticker: str, moeda: str, buscar: Callable[[str], Optional[T]]) -> Optional[T]:
+    """
+    com_simbolo for async views: the symbol is read and stored through
+    sync_to_async, on the connections Django manages, and only buscar (the
+    network call) runs in a worker thread.
+    """
+    tentativas, confiavel = _tentativas(ticker, moeda, *await sync_to_async(simbolo_salvo)(ticker, moeda))
+    for indice, simbolo in enumerate(tentativas):
+        resultado = await asyncio.to_thread(buscar, simbolo)
+        if resultado is not None:
+            if indice or not confiavel:
+                await sync_to_async(salvar_simbolo)(ticker, moeda, simbolo)
+            return resultado
+    logger.warning(f'No Yahoo Finance symbol found for {ticker} ({moeda})')
+    return None
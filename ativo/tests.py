@@ -1,3 +1,938 @@
-from django.test import TestCase
+import io
+import threading
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import openpyxl
+import pandas as pd
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import call_command
+from django.db import connection
+from django.test import AsyncClient, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import risk_service, search
+from .benchmark_service import carregar_serie, comparar_benchmarks, niveis
+from .change_feed import build_change_feed
+from .export_service import export_dataset
+from .filters import filtrar_periodo, intervalo_mes
+from .icon_service import CATEGORY_ICONS, resolve_icons
+from .import_service import IMPORTADORES, importar_arquivo, importar_movimentacoes
+from .income_service import resumo_proventos
+from .middleware import RequestTimingMiddleware
+from .models import (
+    Categoria, Ativo, Movimentacao, Dividendo, DividendoMensal, EvolucaoPatrimonial, Snapshot, PrecoCache,
+    RegistroExcluido, IconeCache, Instrumento, IndiceBenchmark,
+)
+from .returns_service import calcular_variacoes, calcular_xirr, serie_twr, xirr_vetorizado
+from .services import bulk_save_movimentacoes
+from .symbol_service import acom_simbolo, com_simbolo
+
+User = get_user_model()
+
+
+class CarteiraTestCase(TestCase):
+    """
+    Base for tests around one investor's portfolio: the user and the ações
+    categoria are created once per class, ativos and movimentacoes through
+    the helpers below.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.criar_usuario('investidor')
+        cls.categoria = Categoria.objects.get(tipo='RENDA_VARIAVEL', subtipo='ACOES')
+
+    def setUp(self):
+        # Results are cached per user pk, and pks are reused once a test rolls back
+        cache.clear()
+
+    @staticmethod
+    def criar_usuario(nome):
+        return User.objects.create_user(nome, f'{nome}@teste.com', 'senha')
+
+    @classmethod
+    def criar_ativo(cls, ticker, usuario=None, preco=None, **campos):
+        """Create an ativo; with `preco`, also a fresh cached price, which keeps Yahoo Finance out of the test."""
+        campos.setdefault('nome', ticker)
+        campos.setdefault('categoria', cls.categoria)
+        if preco is not None:
+            PrecoCache.objects.create(ticker=ticker, moeda=campos.get('moeda', 'BRL'), preco=Decimal(preco))
+        return Ativo.objects.create(ticker=ticker, usuario=usuario or cls.user, **campos)
+
+    @staticmethod
+    def movimentar(ativo, data, quantidade, preco, operacao='COMPRA', taxa=0):
+        return Movimentacao.objects.create(
+            ativo=ativo, data=data, operacao=operacao, quantidade=Decimal(quantidade),
+            valorUnitario=Decimal(preco), taxa=Decimal(taxa),
+        )
+
+    def api(self, usuario=None):
+        client = APIClient()
+        client.force_authenticate(usuario or self.user)
+        return client
+
+
+class QueryPlanTestCase(CarteiraTestCase):
+    """
+    Run EXPLAIN QUERY PLAN on the hot queries and fail if SQLite has to
+    scan a whole table (or a whole index) to answer them.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ativo = cls.criar_ativo('PLAN3')
+        cls.movimentar(cls.ativo, date(2024, 1, 10), 10, 5)
+        Dividendo.objects.create(ativo=cls.ativo, data=date(2024, 1, 15), valor=Decimal('1'))
+
+    def query_plan(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN QUERY PLAN {sql}', params)
+            return [row[-1] for row in cursor.fetchall()]
+
+    def assertIndexed(self, queryset):
+        if connection.vendor != 'sqlite':
+            self.skipTest('EXPLAIN QUERY PLAN checks are SQLite specific')
+        plan = self.query_plan(queryset)
+        scans = [step for step in plan if step.startswith('SCAN ') and 'ativo_categoria' not in step]
+        self.assertFalse(scans, f'Full scan in query plan: {plan}')
+
+    def test_movimentacoes_por_ano(self):
+        queryset = Movimentacao.objects.filter(usuario=self.user).order_by('-data', '-dataCriacao')
+        self.assertIndexed(filtrar_periodo(queryset, {'year': '2024'}))
+
+    def test_dividendos_por_mes(self):
+        queryset = Dividendo.objects.filter(usuario=self.user).order_by('-data', '-dataCriacao')
+        self.assertIndexed(filtrar_periodo(queryset, {'year': '2024', 'month': '1'}))
+
+    def test_dividendos_do_mes_por_ativo(self):
+        inicio, fim = intervalo_mes(2024, 1)
+        self.assertIndexed(Dividendo.objects.filter(ativo=self.ativo, data__gte=inicio, data__lt=fim))
+
+    def test_historico_do_ativo(self):
+        self.assertIndexed(self.ativo.movimentacao_set.order_by('data', 'dataCriacao'))
+
+    def test_evolucao_por_periodo(self):
+        queryset = EvolucaoPatrimonial.objects.filter(ativo__usuario=self.user)
+        self.assertIndexed(filtrar_periodo(queryset, {'start': '2024-01-01', 'end': '2024-06-30'}))
+
+    def test_snapshot_do_dia(self):
+        self.assertIndexed(Snapshot.objects.filter(ativo=self.ativo, data=date(2024, 1, 31)))
+
+    def test_filtro_de_ano_e_intervalo_semiaberto(self):
+        queryset = Movimentacao.objects.filter(usuario=self.user)
+        self.assertEqual(filtrar_periodo(queryset, {'year': '2024'}).count(), 1)
+        self.assertEqual(filtrar_periodo(queryset, {'year': '2023'}).count(), 0)
+        self.assertEqual(filtrar_periodo(queryset, {'end': '2024-01-10'}).count(), 1)
+        self.assertEqual(filtrar_periodo(queryset, {'start': '2024-01-11'}).count(), 0)
+        self.assertEqual(filtrar_periodo(queryset, {'year': 'abc'}).count(), 1)
+
+
+
+class VariacoesTestCase(CarteiraTestCase):
+    def test_horizontes_a_partir_do_historico(self):
+        ativo = self.criar_ativo('RETN3')
+        for data, preco in [(date(2023, 10, 16), 50), (date(2024, 9, 30), 80), (date(2024, 10, 15), 99), (date(2024, 10, 16), 100)]:
+            Snapshot.objects.create(ativo=ativo, data=data, preco=Decimal(preco), quantidade=1, valor_total=preco)
+
+        # Saturday: the reference trading day is Friday 2024-10-18
+        [info] = calcular_variacoes(self.user, hoje=date(2024, 10, 19))
+        self.assertEqual(info['preco_atual'], Decimal('100.00'))
+        self.assertEqual(info['variacao_dia'], Decimal('0.00'))
+        self.assertEqual(info['variacao_mes'], Decimal('25.00'))
+        self.assertEqual(info['variacao_12m'], Decimal('100.00'))
+        self.assertIsNone(info['variacao_24m'])
+        self.assertEqual(info['variacao_todas'], Decimal('100.00'))
+
+
+class XirrTestCase(CarteiraTestCase):
+    def test_xirr_por_ativo_e_carteira(self):
+        taxas = xirr_vetorizado(np.array([[-100.0, 110.0], [100.0, 10.0]]), np.array([[0.0, 1.0], [0.0, 1.0]]))
+        self.assertAlmostEqual(taxas[0], 0.1)
+        self.assertTrue(np.isnan(taxas[1]))  # no outflow, no IRR
+
+        ativo = self.criar_ativo('XIRR3')
+        self.movimentar(ativo, date(2024, 1, 1), 10, 10)
+        Ativo.objects.filter(pk=ativo.pk).update(valor_atual=Decimal('121'))
+
+        # 100 -> 121 over 730 days
+        resultado = calcular_xirr(self.user, hoje=date(2025, 12, 31))
+        self.assertEqual(resultado['ativos'][ativo.pk], Decimal('10.00'))
+        self.assertEqual(resultado['carteira']['BRL'], Decimal('10.00'))
+
+    def test_xirr_sem_valor_atual_usa_ultimo_preco(self):
+        ativo = self.criar_ativo('XIRR4')
+        self.movimentar(ativo, date(2024, 1, 1), 10, 10)
+        Snapshot.objects.create(ativo=ativo, data=date(2025, 12, 30), preco=Decimal('12.10'), quantidade=10, valor_total=Decimal('121'))
+        # The last price lookup failed: valor_atual is 0, not the position's value
+        Ativo.objects.filter(pk=ativo.pk).update(valor_atual=Decimal('0'))
+
+        resultado = calcular_xirr(self.user, hoje=date(2025, 12, 31))
+        self.assertEqual(resultado['ativos'][ativo.pk], Decimal('10.00'))
+
+
+class CorrelacaoTestCase(CarteiraTestCase):
+    def test_correlacao_incremental(self):
+        rng = np.random.default_rng(0)
+        retornos = pd.DataFrame(rng.normal(size=(60, 3)), index=pd.bdate_range('2024-01-01', periods=60), columns=[1, 2, 3])
+        retornos.iloc[::7, 0] = np.nan
+        risk_service.correlacao_incremental(self.user.pk, retornos)
+
+        # A new column, with a date the others lack, is correlated against
+        # the others; the cached pairs are reused
+        novo = pd.Series(rng.normal(size=61), index=retornos.index.union([pd.Timestamp('2024-03-30')]))
+        retornos = retornos.reindex(novo.index)
+        retornos[4] = novo
+        with mock.patch.object(risk_service, '_correlacoes', wraps=risk_service._correlacoes) as correlacoes:
+            matriz = risk_service.correlacao_incremental(self.user.pk, retornos)
+        self.assertEqual(correlacoes.call_args.args[1].shape[1], 1)
+        np.testing.assert_allclose(matriz.to_numpy(), retornos.corr(min_periods=20).to_numpy(), atol=1e-12)
+
+
+class RiscoTestCase(CarteiraTestCase):
+    def test_risco_contra_ibov_armazenado(self):
+        ativo = self.criar_ativo('RISK3', preco='10')
+        self.movimentar(ativo, date(2023, 1, 2), 10, 10)
+        datas = pd.bdate_range(end='2024-02-09', periods=30)
+        mercado = np.random.default_rng(1).normal(0, 0.01, size=len(datas) - 1)
+        # The ativo moves twice as much as the index: beta 2
+        niveis_ibov = 100000 * np.cumprod(np.concatenate([[1.0], 1 + mercado]))
+        precos = 1000 * np.cumprod(np.concatenate([[1.0], 1 + 2 * mercado]))
+        IndiceBenchmark.objects.bulk_create([
+            IndiceBenchmark(indice='IBOV', data=data.date(), valor=Decimal(f'{nivel:.8f}'))
+            for data, nivel in zip(datas, niveis_ibov)
+        ])
+        Snapshot.objects.bulk_create([
+            Snapshot(ativo=ativo, data=data.date(), preco=Decimal(f'{preco:.2f}'), quantidade=10, valor_total=Decimal(f'{preco * 10:.2f}'))
+            for data, preco in zip(datas, precos)
+        ])
+        # Portfolio weights come from the current position value
+        Ativo.objects.filter(pk=ativo.pk).update(valor_atual=Decimal(f'{precos[-1] * 10:.2f}'))
+
+        with mock.patch.object(risk_service.yf, 'Ticker') as yahoo:
+            risco = risk_service.calcular_risco(self.user, hoje=date(2024, 2, 10))
+        yahoo.assert_not_called()
+
+        # Expected values from the stored (rounded) prices
+        serie = pd.Series([float(f'{p:.2f}') for p in precos])
+        retornos, retornos_ibov = serie.pct_change().iloc[1:], pd.Series(niveis_ibov).pct_change().iloc[1:]
+        [info] = risco['ativos']
+        self.assertEqual(risco['data'], '2024-02-09')
+        self.assertEqual(info['observacoes'], 29)
+        self.assertEqual(info['volatilidade'], round(retornos.std() * np.sqrt(252) * 100, 2))
+        self.assertEqual(info['max_drawdown'], round((serie / serie.cummax() - 1).min() * 100, 2))
+        self.assertAlmostEqual(info['beta'], retornos.cov(retornos_ibov) / retornos_ibov.var(), places=4)
+        self.assertAlmostEqual(info['beta'], 2, places=2)
+        self.assertEqual(risco['carteira']['BRL']['beta'], info['beta'])
+
+    def test_falha_do_ibov_e_guardada_por_pouco_tempo(self):
+        with mock.patch.object(risk_service.yf, 'Ticker', side_effect=RuntimeError('rate limited')) as yahoo, \
+                mock.patch.object(risk_service.cache, 'set', wraps=risk_service.cache.set) as guardar:
+            self.assertTrue(risk_service.historico_ibov(date(2024, 1, 1), date(2024, 2, 9)).empty)
+            self.assertTrue(risk_service.historico_ibov(date(2024, 1, 1), date(2024, 2, 9)).empty)
+        self.assertEqual(yahoo.call_count, 1)
+        self.assertEqual(guardar.call_args.args[2], risk_service.IBOV_FALHA_CACHE_TIMEOUT)
+
+
+class TwrTestCase(CarteiraTestCase):
+    def test_venda_com_lucro_e_resgate(self):
+        a = self.criar_ativo('TWRA3', preco='10')
+        b = self.criar_ativo('TWRB3', preco='10')
+        for ativo in (a, b):
+            self.movimentar(ativo, date(2024, 1, 2), 10, 10)
+        # A goes 100 -> 150 and is sold at 150; B stays at 100
+        self.movimentar(a, date(2024, 3, 10), 10, 15, operacao='VENDA')
+        # bulk_create keeps the given valor_total (save() copies the ativo's current value)
+        EvolucaoPatrimonial.objects.bulk_create([
+            EvolucaoPatrimonial(ativo=ativo, data=data, preco_atual=valor / 10, quantidade=10 if valor else 0,
+                                valor_total=valor, custo_total=custo)
+            for ativo, data, valor, custo in [
+                (a, date(2024, 1, 31), 100, 100), (b, date(2024, 1, 31), 100, 100),
+                (a, date(2024, 2, 29), 150, 100), (b, date(2024, 2, 29), 100, 100),
+                (a, date(2024, 3, 31), 0, 0), (b, date(2024, 3, 31), 100, 100),
+            ]
+        ])
+
+        serie = serie_twr(self.user)['BRL']
+        self.assertEqual(serie['retornos'], [0.0, 25.0, 0.0])
+        self.assertEqual(serie['acumulado'], [0.0, 25.0, 25.0])
+
+
+class EvolucaoSeriesTestCase(CarteiraTestCase):
+    def test_series_por_moeda(self):
+        real = self.criar_ativo('SERB3')
+        dolar = self.criar_ativo('SERU', moeda='USD')
+        EvolucaoPatrimonial.objects.bulk_create([
+            EvolucaoPatrimonial(ativo=ativo, data=data, preco_atual=valor, quantidade=1, valor_total=valor, custo_total=10)
+            for ativo, data, valor in [
+                (real, date(2024, 1, 31), 50), (dolar, date(2024, 1, 31), 5),
+                (real, date(2024, 2, 29), 60), (dolar, date(2024, 2, 29), 6),
+            ]
+        ])
+
+        client = self.api()
+        serie = client.get('/api/evolucao-patrimonial/series/?group_by=ticker').json()
+        # BRL by default; the USD ativo is neither in the totals nor in the groups
+        self.assertEqual(serie['moeda'], 'BRL')
+        self.assertEqual(serie['dates'], ['2024-01-31', '2024-02-29'])
+        self.assertEqual(serie['valores'], [50.0, 60.0])
+        self.assertEqual(serie['keys'], ['SERB3'])
+
+        serie = client.get('/api/evolucao-patrimonial/series/?moeda=USD').json()
+        self.assertEqual(serie['moeda'], 'USD')
+        self.assertEqual(serie['valores'], [5.0, 6.0])
+        self.assertEqual(serie['custos'], [10.0, 10.0])
+
+
+class DividendoMensalTestCase(CarteiraTestCase):
+    def test_totais_mensais_acompanham_os_dividendos(self):
+        ativo = self.criar_ativo('PROV3')
+        primeiro = Dividendo.objects.create(ativo=ativo, data=date(2024, 3, 10), valor=Decimal('5'))
+        Dividendo.objects.create(ativo=ativo, data=date(2024, 3, 20), valor=Decimal('2'))
+
+        def totais():
+            return list(DividendoMensal.objects.order_by('mes').values_list('mes', 'total', 'pagamentos'))
+
+        self.assertEqual(totais(), [(date(2024, 3, 1), Decimal('7.00'), 2)])
+
+        # Moving a dividend to another month updates both months
+        primeiro.data = date(2024, 4, 1)
+        primeiro.save()
+        self.assertEqual(totais(), [(date(2024, 3, 1), Decimal('2.00'), 1), (date(2024, 4, 1), Decimal('5.00'), 1)])
+
+        primeiro.delete()
+        self.assertEqual(totais(), [(date(2024, 3, 1), Decimal('2.00'), 1)])
+
+
+class ProventosTestCase(CarteiraTestCase):
+    def test_totais_yields_e_projecao(self):
+        fii = Categoria.objects.get(tipo='RENDA_VARIAVEL', subtipo='FII')
+        acao = self.criar_ativo('PROA3', preco='20')
+        fundo = self.criar_ativo('PROF11', preco='10', categoria=fii)
+        exterior = self.criar_ativo('PROU', preco='10', moeda='USD')
+        self.movimentar(acao, date(2023, 1, 2), 10, 10)
+        self.movimentar(fundo, date(2023, 1, 2), 10, 10)
+        Ativo.objects.filter(pk=acao.pk).update(valor_atual=Decimal('200'))
+        for ativo, data, valor in [
+            (acao, date(2023, 1, 10), 2),  # before the trailing 12 months
+            (acao, date(2023, 11, 10), 3),
+            (acao, date(2024, 3, 10), 5),
+            (fundo, date(2024, 5, 10), 4),
+            (exterior, date(2024, 3, 10), 5),
+        ]:
+            Dividendo.objects.create(ativo=ativo, data=data, valor=Decimal(valor))
+
+        resumo = resumo_proventos(self.user, hoje=date(2024, 10, 15))
+        mensal = resumo['mensal']
+        self.assertEqual(mensal['meses'], ['2023-01', '2023-11', '2024-03', '2024-05'])
+        self.assertEqual(mensal['moedas'], {'BRL': [2.0, 3.0, 5.0, 4.0], 'USD': [0.0, 0.0, 5.0, 0.0]})
+        # Currencies are never added up, and ações and FIIs are reported apart
+        self.assertEqual(mensal['categorias'], {
+            'BRL': {'ACOES': [2.0, 3.0, 5.0, 0.0], 'FII': [0.0, 0.0, 0.0, 4.0]},
+            'USD': {'ACOES': [0.0, 0.0, 5.0, 0.0]},
+        })
+        self.assertEqual(resumo['anual']['categorias']['BRL'], {'ACOES': [5.0, 5.0], 'FII': [0.0, 4.0]})
+
+        [info] = [a for a in resumo['ativos'] if a['ticker'] == 'PROA3']
+        self.assertEqual(info['ultimos_12m'], Decimal('8'))
+        self.assertEqual(info['yield_on_cost'], Decimal('8.00'))
+        self.assertEqual(info['yield_mercado'], Decimal('4.00'))
+        self.assertEqual(info['projecao_12m'], Decimal('8.00'))
+        # No position left: no yield and nothing projected
+        [sem_posicao] = [a for a in resumo['ativos'] if a['ticker'] == 'PROU']
+        self.assertIsNone(sem_posicao['yield_on_cost'])
+        self.assertEqual(sem_posicao['projecao_12m'], Decimal('0.00'))
+
+        projecao = resumo['projecao']
+        self.assertEqual(projecao['meses'][0], '2024-11')
+        self.assertEqual(projecao['moedas']['BRL'], [3.0, 0.0, 0.0, 0.0, 5.0, 0.0, 4.0, 0.0, 0.0, 0.0, 0.0, 0.0])
+        self.assertEqual(projecao['moedas']['USD'], [0.0] * 12)
+
+
+class BenchmarkTestCase(CarteiraTestCase):
+    def test_indice_alinhado_por_data_anterior(self):
+        # CDI stored as a daily rate with a decimal comma; 2024-01-06 (Saturday) has no value
+        carregar_serie(pd.DataFrame({'data': ['04/01/2024', '05/01/2024', '08/01/2024'], 'valor': ['1,0', '1,0', '1,0']}), 'CDI')
+
+        ativo = self.criar_ativo('BENC3')
+        for data, preco in [(date(2024, 1, 4), 10), (date(2024, 1, 6), 11), (date(2024, 1, 8), 12)]:
+            Snapshot.objects.create(ativo=ativo, data=data, preco=Decimal(preco), quantidade=1, valor_total=preco)
+
+        resultado = comparar_benchmarks(self.user, ['CDI'], ativo_id=ativo.pk)
+        self.assertEqual(resultado['dates'], ['2024-01-04', '2024-01-06', '2024-01-08'])
+        self.assertEqual(resultado['carteira'], [0.0, 10.0, 20.0])
+        self.assertEqual(resultado['benchmarks']['CDI'], [0.0, 1.0, 2.01])
+
+    def test_carga_de_outro_processo_e_vista(self):
+        carregar_serie(pd.DataFrame({'data': ['2024-01-04', '2024-01-05'], 'valor': ['100', '110']}), 'IBOV')
+        self.assertEqual(niveis('IBOV')['nivel'].tolist(), [100.0, 110.0])
+
+        # Written by load_benchmarks in another process: this process's cache is never cleared
+        IndiceBenchmark.objects.filter(indice='IBOV', data=date(2024, 1, 5)).update(valor=Decimal('120'))
+        self.assertEqual(niveis('IBOV')['nivel'].tolist(), [100.0, 120.0])
+        IndiceBenchmark.objects.create(indice='IBOV', data=date(2024, 1, 8), valor=Decimal('130'))
+        self.assertEqual(niveis('IBOV')['nivel'].tolist(), [100.0, 120.0, 130.0])
+
+
+class ETagTestCase(CarteiraTestCase):
+    def test_304_ate_mudar_a_versao_ou_a_janela_de_preco(self):
+        ativo = self.criar_ativo('ETAG3', preco='10')
+        client = self.api()
+        resposta = client.get('/api/ativos/')
+        self.assertEqual(resposta.status_code, 200)
+        etag = resposta['ETag']
+
+        self.assertEqual(client.get('/api/ativos/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        # Cached prices expire without a write: the next window must not answer 304
+        with mock.patch('ativo.etag._janela_de_preco', return_value=0):
+            self.assertEqual(client.get('/api/ativos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+        ativo.anotacao = 'alterado'
+        ativo.save()
+        self.assertEqual(client.get('/api/ativos/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DashboardTestCase(CarteiraTestCase):
+    def test_totais_de_dividendos_acompanham_o_dia(self):
+        ativo = self.criar_ativo('DASH3', preco='10')
+        self.movimentar(ativo, date(2024, 1, 2), 10, 10)
+        Dividendo.objects.create(ativo=ativo, data=date(2024, 12, 20), valor=Decimal('10'))
+
+        client = self.api()
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2024, 12, 31)):
+            dividendos = client.get('/api/dashboard/').json()['moedas']['BRL']['dividendos']
+        self.assertEqual(dividendos, {'total': 10.0, 'ultimos_12_meses': 10.0, 'ano_atual': 10.0})
+
+        # Same data version, new year: the current-year total starts over
+        with mock.patch('django.utils.timezone.localdate', return_value=date(2025, 1, 1)):
+            dividendos = client.get('/api/dashboard/').json()['moedas']['BRL']['dividendos']
+        self.assertEqual(dividendos, {'total': 10.0, 'ultimos_12_meses': 10.0, 'ano_atual': 0.0})
+
+
+class KeysetPaginationTestCase(CarteiraTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ativo = cls.criar_ativo('CURS3')
+        for dia in [1, 2, 2, 2, 2, 3, 3]:
+            Dividendo.objects.create(ativo=cls.ativo, data=date(2024, 1, dia), valor=Decimal('1'))
+        # Ties on (data, dataCriacao): only the id separates these rows
+        Dividendo.objects.filter(data=date(2024, 1, 2)).update(dataCriacao=Dividendo.objects.first().dataCriacao)
+
+    def test_paginas_cobrem_todos_os_registros_na_ordem(self):
+        esperado = list(Dividendo.objects.filter(usuario=self.user).order_by('-data', '-dataCriacao', '-id').values_list('id', flat=True))
+        client = self.api()
+        vistos = []
+        url = '/api/dividendos/?cursor=&page_size=2'
+        while url:
+            pagina = client.get(url).json()
+            vistos += [item['id'] for item in pagina['results']]
+            url = pagina['next']
+        self.assertEqual(vistos, esperado)
+
+    def test_usuario_copiado_do_ativo(self):
+        self.assertEqual(Dividendo.objects.filter(usuario=self.user).count(), 7)
+
+    def test_ordering_com_cursor_e_rejeitado(self):
+        client = self.api()
+        self.assertEqual(client.get('/api/dividendos/?cursor=&ordering=valor').status_code, 400)
+        self.assertEqual(client.get('/api/dividendos/?cursor=invalido').status_code, 404)
+
+
+class ExportTestCase(CarteiraTestCase):
+    def test_exporta_movimentacoes_em_csv(self):
+        ativo = self.criar_ativo('EXPO3', preco='10')
+        self.movimentar(ativo, date(2024, 1, 3), 5, 12, operacao='VENDA', taxa='1.5')
+        self.movimentar(ativo, date(2024, 1, 2), 10, 10)
+        # Another user's ledger stays out of the file
+        self.movimentar(self.criar_ativo('EXPO3', usuario=self.criar_usuario('outro')), date(2024, 1, 2), 1, 1)
+
+        resposta = self.api().get('/api/movimentacoes/export/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertTrue(resposta.streaming)
+        self.assertEqual(resposta['Content-Disposition'], 'attachment; filename="movimentacoes.csv"')
+        self.assertEqual(b''.join(resposta.streaming_content).decode().splitlines(), [
+            'data,ticker,operacao,quantidade,valor_unitario,taxa,custo_total',
+            '2024-01-02,EXPO3,COMPRA,10.000000,10.00,0.00,100.00',
+            '2024-01-03,EXPO3,VENDA,5.000000,12.00,1.50,61.50',
+        ])
+
+        # Small chunks give the same rows
+        self.assertEqual(''.join(export_dataset('movimentacoes', self.user, chunk_size=1)).splitlines()[1:], [
+            '2024-01-02,EXPO3,COMPRA,10.000000,10.00,0.00,100.00',
+            '2024-01-03,EXPO3,VENDA,5.000000,12.00,1.50,61.50',
+        ])
+        self.assertEqual(self.api().get('/api/movimentacoes/export/?file_format=xls').status_code, 400)
+
+
+class BulkMovimentacoesTestCase(CarteiraTestCase):
+    def test_linha_rejeitada_pelo_banco_nao_descarta_as_outras(self):
+        ativo = self.criar_ativo('BULK3')
+
+        def compra(hash_linha):
+            return Movimentacao(
+                ativo=ativo, data=date(2024, 1, 2), operacao='COMPRA', quantidade=Decimal('1'),
+                valorUnitario=Decimal('10'), taxa=Decimal('0'), hash_importacao=hash_linha,
+            )
+
+        bulk_save_movimentacoes([compra('a')])
+        # The second row repeats a unique hash: only it fails
+        falhas = bulk_save_movimentacoes([compra('b'), compra('a'), compra('c')])
+        self.assertEqual(list(falhas), [1])
+        self.assertEqual(
+            sorted(Movimentacao.objects.filter(ativo=ativo).values_list('hash_importacao', flat=True)), ['a', 'b', 'c']
+        )
+        ativo.refresh_from_db()
+        self.assertEqual(ativo.quantidade, 3)
+
+    def test_endpoint_reporta_erros_por_indice(self):
+        ativo = self.criar_ativo('BULK4')
+        item = {'ativo': ativo.pk, 'data': '2024-01-02', 'operacao': 'COMPRA', 'quantidade': '1', 'valorUnitario': '10', 'taxa': '0'}
+        resposta = self.api().post('/api/movimentacoes/bulk/', [item, {**item, 'quantidade': 'x'}, item], format='json').json()
+        self.assertEqual(resposta['created'], 2)
+        self.assertEqual([erro['index'] for erro in resposta['errors']], [1])
+
+
+class ChangeFeedTestCase(CarteiraTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ativo = self.criar_ativo('FEED3', preco='10')
+        self.dividendo = Dividendo.objects.create(ativo=self.ativo, data=date(2024, 1, 2), valor=Decimal('1'))
+
+    def test_token_traz_alteracoes_e_exclusoes(self):
+        inicial = build_change_feed(self.user)
+        self.assertTrue(inicial['reset'])
+        self.assertEqual([d['id'] for d in inicial['dividendos']['upserted']], [self.dividendo.pk])
+
+        # Stamped before the token was issued but committed after it, as a chunked import does
+        atrasado = Dividendo.objects.create(ativo=self.ativo, data=date(2024, 2, 1), valor=Decimal('2'))
+        Dividendo.objects.filter(pk=atrasado.pk).update(dataAlteracao=timezone.now() - timedelta(minutes=1))
+        excluido = self.dividendo.pk
+        self.dividendo.delete()
+
+        seguinte = build_change_feed(self.user, inicial['token'])
+        self.assertFalse(seguinte['reset'])
+        self.assertIn(atrasado.pk, [d['id'] for d in seguinte['dividendos']['upserted']])
+        self.assertEqual(seguinte['dividendos']['deleted'], [excluido])
+
+        # Rows older than the safety window are not sent again
+        Dividendo.objects.filter(pk=atrasado.pk).update(dataAlteracao=timezone.now() - timedelta(hours=1))
+        RegistroExcluido.objects.update(data_exclusao=timezone.now() - timedelta(hours=1))
+        ultimo = build_change_feed(self.user, seguinte['token'])
+        self.assertEqual(ultimo['dividendos'], {'upserted': [], 'deleted': []})
+
+    def test_token_invalido(self):
+        self.assertEqual(self.api().get('/api/changes/?since=invalido').status_code, 400)
+
+
+class BuscaAtivoTestCase(CarteiraTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        outro = cls.criar_usuario('outro')
+        for ticker, nome, usuario in [
+            ('ITUB4', 'Itaú Unibanco', cls.user),
+            ('PETR4', 'Petrobras', cls.user),
+            ('BPET3', 'Outra', cls.user),
+            ('ITSA4', 'Itaúsa', outro),
+        ]:
+            cls.criar_ativo(ticker, usuario=usuario, nome=nome)
+        for ticker in ['ITUB4', 'PETR4', 'BPET3', 'VALE3']:
+            PrecoCache.objects.create(ticker=ticker, moeda='BRL', preco=Decimal('10'))
+
+    def tickers(self, query):
+        return [a['ticker'] for a in self.api().get(f'/api/ativos/?{query}').json()]
+
+    def test_busca_por_prefixo_sem_acento(self):
+        self.assertEqual(self.tickers('search=itau'), ['ITUB4'])
+        self.assertEqual(self.tickers('search=petro'), ['PETR4'])
+
+    def test_ticker_casa_parte_do_ticker(self):
+        self.assertEqual(self.tickers('ticker=petr'), ['PETR4'])
+        # ?ticker= matches anywhere in the ticker, and only the user's ativos
+        self.assertEqual(self.tickers('ticker=pet'), ['BPET3', 'PETR4'])
+        self.assertEqual(self.tickers('ticker=etr'), ['PETR4'])
+        self.assertEqual(self.tickers('ticker=its'), [])
+
+    def test_busca_alem_do_limite_de_ranking(self):
+        self.criar_ativo('PETZ3', nome='Petz')
+        [melhor] = search.buscar_ativo_ids(self.user.pk, 'pet', limit=1)
+        buscar = search.buscar_ativo_ids
+        with mock.patch.object(search, 'buscar_ativo_ids', lambda usuario_id, query: buscar(usuario_id, query, limit=1)):
+            tickers = self.tickers('search=pet')
+        # Only the best match is ranked; the other still matches and follows it
+        self.assertEqual(sorted(tickers), ['PETR4', 'PETZ3'])
+        self.assertEqual(tickers[0], Ativo.objects.get(pk=melhor).ticker)
+
+    def test_indice_acompanha_update_e_exclusao(self):
+        Ativo.objects.filter(ticker='PETR4').update(ticker='VALE3', nome='Vale')
+        self.assertEqual(self.tickers('search=petro'), [])
+        self.assertEqual(self.tickers('search=vale'), ['VALE3'])
+
+        Ativo.objects.filter(ticker='VALE3').delete()
+        self.assertEqual(self.tickers('search=vale'), [])
+
+
+class AsyncViewsTestCase(CarteiraTestCase):
+    def setUp(self):
+        super().setUp()
+        self.ativos = [self.criar_ativo(ticker) for ticker in ('ASYN3', 'ASYN4')]
+        Ativo.objects.filter(pk__in=[a.pk for a in self.ativos]).update(quantidade=Decimal('10'))
+        self.outro = self.criar_ativo('ASYN5', usuario=self.criar_usuario('outro'))
+        self.token = {'Authorization': f'Bearer {AccessToken.for_user(self.user)}'}
+
+    def post(self, url, headers=None):
+        return AsyncClient().post(url, headers=self.token if headers is None else headers)
+
+    async def test_token_obrigatorio(self):
+        url = f'/api/async/ativos/{self.ativos[0].pk}/update_price/'
+        self.assertEqual((await self.post(url, headers={})).status_code, 401)
+        self.assertEqual((await self.post(url, headers={'Authorization': 'Bearer invalido'})).status_code, 401)
+        # Another user's ativo is not found
+        self.assertEqual((await self.post(f'/api/async/ativos/{self.outro.pk}/update_price/')).status_code, 404)
+
+    async def test_precos_atualizados_em_paralelo(self):
+        # Both Yahoo calls must be in flight at once for either to return
+        barreira = threading.Barrier(2, timeout=5)
+
+        def buscar(simbolo):
+            barreira.wait()
+            return Decimal('12.5')
+
+        with mock.patch('ativo.services.fetch_yahoo_price', side_effect=buscar) as yahoo:
+            resposta = await self.post('/api/async/ativos/update_prices/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(sorted(c.args[0] for c in yahoo.call_args_list), ['ASYN3.SA', 'ASYN4.SA'])
+        self.assertEqual(sorted(a['ticker'] for a in resposta.json()), ['ASYN3', 'ASYN4'])
+        valores = [v async for v in Ativo.objects.filter(usuario=self.user).values_list('valor_atual', 'is_preco_estimado')]
+        self.assertEqual(valores, [(Decimal('125.00'), False)] * 2)
+
+    async def test_snapshot_com_preco_buscado(self):
+        with mock.patch('ativo.services.fetch_yahoo_price', return_value=Decimal('11')):
+            resposta = await self.post(f'/api/async/ativos/{self.ativos[0].pk}/create_snapshot/')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(Decimal(resposta.json()['preco']), Decimal('11'))
+        self.assertEqual(await PrecoCache.objects.filter(ticker='ASYN3').values_list('preco', flat=True).aget(), Decimal('11'))
+
+
+class MetricsTestCase(TestCase):
+    def test_somente_enderecos_permitidos_ou_token(self):
+        self.assertEqual(self.client.get('/metrics').status_code, 200)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 403)
+        with override_settings(METRICS={'ALLOWED_IPS': [], 'TOKEN': 'segredo'}):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer errado').status_code, 403)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer segredo').status_code, 200)
+
+
+class RequestTimingTestCase(CarteiraTestCase):
+    LIGADO = {'ENABLED': True, 'SLOW_REQUEST_MS': 60000, 'TOP_QUERIES': 5}
+
+    def setUp(self):
+        super().setUp()
+        self.criar_ativo('TIME3', preco='10')
+
+    def test_server_timing_quando_ligado(self):
+        with override_settings(REQUEST_TIMING=self.LIGADO):
+            resposta = self.api().get('/api/ativos/')
+        metricas = {item.split(';')[0]: item for item in resposta['Server-Timing'].split(', ')}
+        self.assertEqual(list(metricas), ['db', 'serializer', 'total'])
+        self.assertRegex(metricas['db'], r'^db;dur=\d+\.\d;desc="[1-9]\d* calls"$')
+        self.assertRegex(metricas['total'], r'^total;dur=\d+\.\d$')
+
+    def test_requisicao_lenta_e_registrada(self):
+        with override_settings(REQUEST_TIMING={**self.LIGADO, 'SLOW_REQUEST_MS': 0}), \
+                self.assertLogs('ativo.slow_requests', 'WARNING') as logs:
+            self.api().get('/api/ativos/')
+        self.assertIn('Slow request GET /api/ativos/ -> 200', logs.output[0])
+        self.assertIn('Slowest queries:', logs.output[0])
+
+    def test_desligado(self):
+        with override_settings(REQUEST_TIMING={'ENABLED': False}):
+            with self.assertRaises(MiddlewareNotUsed):
+                RequestTimingMiddleware(lambda request: None)
+            self.assertNotIn('Server-Timing', self.api().get('/api/ativos/'))
+
+
+class ImportacaoTestCase(CarteiraTestCase):
+    CABECALHO = 'Código de Negociação;Data do Negócio;Tipo de Movimentação;Quantidade;Preço;Valor\n'
+    LINHAS = [
+        'IMPO3;02/01/2024;Compra;10;20,00;200,00',
+        'IMPO3;02/01/2024;Compra;10;20,00;200,00',
+        'IMPO3;03/01/2024;Compra;5;21,00;105,00',
+        'IMPO3;04/01/2024;Venda;3;22,00;66,00',
+    ]
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.ativo = cls.criar_ativo('IMPO3', preco='20')
+
+    def importar(self, arquivo=None, nome='movimentacoes.csv', tipo='movimentacoes', chunk_size=2):
+        summary = {'created_ativos': 0, 'created_movimentacoes': 0, 'created_dividendos': 0, 'errors': []}
+        if arquivo is None:
+            arquivo = self.csv(self.CABECALHO, self.LINHAS)
+        importar_arquivo(arquivo, nome, self.user, tipo, summary, chunk_size=chunk_size)
+        return summary
+
+    @staticmethod
+    def csv(cabecalho, linhas):
+        return io.BytesIO((cabecalho + '\n'.join(linhas) + '\n').encode())
+
+    def test_reimportar_nao_duplica(self):
+        self.assertEqual(self.importar()['created_movimentacoes'], 4)
+        segunda = self.importar()
+        self.assertEqual(segunda['created_movimentacoes'], 0)
+        self.assertEqual(segunda['skipped_movimentacoes'], 4)
+        self.assertEqual(Movimentacao.objects.filter(ativo=self.ativo).count(), 4)
+        self.ativo.refresh_from_db()
+        self.assertEqual(self.ativo.quantidade, 22)
+
+    def test_linha_sem_hash_casa_pelo_conteudo(self):
+        # Entered by hand before the statement was imported: no hash_importacao
+        self.movimentar(self.ativo, date(2024, 1, 2), 10, 20)
+        summary = self.importar()
+        # Only one of the two equal rows in the file was already stored
+        self.assertEqual(summary['created_movimentacoes'], 3)
+        self.assertEqual(Movimentacao.objects.filter(ativo=self.ativo, data=date(2024, 1, 2)).count(), 2)
+        self.assertEqual(self.importar()['created_movimentacoes'], 0)
+
+    def test_retoma_apos_falha(self):
+        chamadas = []
+
+        def falha_no_segundo_bloco(*args, **kwargs):
+            chamadas.append(1)
+            if len(chamadas) == 2:
+                raise RuntimeError('conexão perdida')
+            return importar_movimentacoes(*args, **kwargs)
+
+        _, preparar, chave, offset = IMPORTADORES['movimentacoes']
+        with mock.patch.dict(IMPORTADORES, {'movimentacoes': (falha_no_segundo_bloco, preparar, chave, offset)}):
+            with self.assertRaises(RuntimeError):
+                self.importar()
+        self.assertEqual(Movimentacao.objects.filter(ativo=self.ativo).count(), 2)
+
+        summary = self.importar()
+        self.assertEqual(summary['resumed_from_row'], 2)
+        self.assertEqual(summary['created_movimentacoes'], 2)
+        self.assertEqual(Movimentacao.objects.filter(ativo=self.ativo).count(), 4)
+
+
+    def test_xlsx_lido_em_blocos(self):
+        workbook = openpyxl.Workbook()
+        planilha = workbook.active
+        planilha.append(self.CABECALHO.strip().split(';'))
+        planilha.append(['IMPO3', '02/01/2024', 'Compra', 10, 20.0, 200.0])
+        planilha.append([None] * 6)  # blank rows are skipped
+        planilha.append(['impo3f', datetime(2024, 1, 3), 'Compra', 5, 21.0, 105.5])
+        planilha.append(['IMPO3', '04/01/2024', 'Venda', 3, 22.0, 66.0])
+        arquivo = io.BytesIO()
+        workbook.save(arquivo)
+        arquivo.seek(0)
+
+        blocos = []
+        importar, preparar, chave, offset = IMPORTADORES['movimentacoes']
+
+        def registrar(df, *args, **kwargs):
+            blocos.append(list(df.index))
+            return importar(df, *args, **kwargs)
+
+        with mock.patch.dict(IMPORTADORES, {'movimentacoes': (registrar, preparar, chave, offset)}):
+            summary = self.importar(arquivo, nome='movimentacoes.xlsx')
+        self.assertEqual(blocos, [[0, 1], [2]])
+        self.assertEqual(summary['created_movimentacoes'], 3)
+        self.assertEqual(summary['errors'], [])
+        # Date cells, the fractional-market suffix and fees above quantidade x preço
+        compra = Movimentacao.objects.get(ativo=self.ativo, data=date(2024, 1, 3))
+        self.assertEqual((compra.quantidade, compra.valorUnitario, compra.taxa), (Decimal('5'), Decimal('21.00'), Decimal('0.50')))
+        self.ativo.refresh_from_db()
+        self.assertEqual(self.ativo.quantidade, 12)
+
+    def test_csv_separado_por_virgula(self):
+        linhas = [linha.split(';') for linha in self.LINHAS]
+        arquivo = self.csv(
+            self.CABECALHO.replace(';', ','),
+            [','.join(campos[:4] + [f'"{campo}"' for campo in campos[4:]]) for campos in linhas],
+        )
+        summary = self.importar(arquivo)
+        self.assertEqual(summary['created_movimentacoes'], 4)
+        self.assertEqual(
+            sorted(Movimentacao.objects.filter(ativo=self.ativo).values_list('valorUnitario', flat=True)),
+            [Decimal('20.00'), Decimal('20.00'), Decimal('21.00'), Decimal('22.00')],
+        )
+
+    def test_linhas_invalidas_sao_reportadas(self):
+        linhas = list(self.LINHAS)
+        linhas[1] = 'IMPO3;31/02/2024;Compra;10;20,00;200,00'
+        linhas[2] = 'IMPO3;03/01/2024;Compra;cinco;21,00;105,00'
+        summary = self.importar(self.csv(self.CABECALHO, linhas))
+        self.assertEqual(summary['errors'], ['Row 1: valor inválido em data', 'Row 2: valor inválido em quantidade'])
+        self.assertEqual(summary['created_movimentacoes'], 2)
+
+    def test_importa_dividendos(self):
+        cabecalho = 'Produto;Pagamento;Valor líquido\n'
+        linhas = [
+            'IMPO3 - IMPORTADORA S.A.;15/01/2024;12,50',
+            'IMPO3F - IMPORTADORA S.A.;20/01/2024;2,50',
+            'XXXX3 - DESCONHECIDA S.A.;20/01/2024;1,00',
+        ]
+        summary = self.importar(self.csv(cabecalho, linhas), nome='proventos.csv', tipo='dividendos')
+        self.assertEqual(summary['created_dividendos'], 2)
+        self.assertEqual(summary['errors'], ['Row 3: Ativo XXXX3 não encontrado para o usuário'])
+        self.assertEqual(
+            list(DividendoMensal.objects.filter(ativo=self.ativo).values_list('mes', 'total', 'pagamentos')),
+            [(date(2024, 1, 1), Decimal('15.00'), 2)],
+        )
+
+        novamente = self.importar(self.csv(cabecalho, linhas), nome='proventos.csv', tipo='dividendos')
+        self.assertEqual(novamente['created_dividendos'], 0)
+        self.assertEqual(Dividendo.objects.filter(ativo=self.ativo).count(), 2)
+
+
+class IconeTestCase(CarteiraTestCase):
+    def test_icone_do_cache_sem_consulta_por_ativo(self):
+        for ticker in ['icon3', 'ICON4', 'ICON5']:
+            self.criar_ativo(ticker)
+        # The cache is keyed by the upper-cased ticker
+        IconeCache.objects.create(ticker='ICON3', url='https://exemplo.com/icon3.png', status='ENCONTRADO', checked_at=timezone.now())
+        IconeCache.objects.create(ticker='ICON4', url='https://exemplo.com/icon4.png', status='ENCONTRADO', checked_at=timezone.now())
+
+        self.assertEqual(Ativo.objects.get(ticker='icon3').get_icon_url(), 'https://exemplo.com/icon3.png')
+        with self.assertNumQueries(1):
+            urls = {a.ticker: a.get_icon_url() for a in Ativo.objects.filter(usuario=self.user).select_related('categoria').com_icone_cache()}
+        self.assertEqual(urls['icon3'], 'https://exemplo.com/icon3.png')
+        self.assertEqual(urls['ICON4'], 'https://exemplo.com/icon4.png')
+        # No cached icon: the categoria default
+        self.assertTrue(urls['ICON5'].startswith('https://cdn-icons-png.flaticon.com/'))
+
+    def test_icone_nao_encontrado_nao_e_gravado(self):
+        ativo = self.criar_ativo('MISS3')
+        with mock.patch('ativo.icon_service.search_company_icon', return_value=None) as busca:
+            self.assertEqual(resolve_icons([ativo.pk]), 0)
+            # The remembered miss spares the probes; the ativo stays a candidate
+            self.assertEqual(resolve_icons([ativo.pk]), 0)
+        self.assertEqual(busca.call_count, 1)
+        ativo.refresh_from_db()
+        self.assertFalse(ativo.icone_url)
+        self.assertEqual(ativo.get_icon_url(), CATEGORY_ICONS['ACOES'])
+
+        # Once the miss expires the ativo is probed again and the logo stored
+        IconeCache.objects.filter(ticker='MISS3').update(checked_at=timezone.now() - IconeCache.TTL_NEGATIVO)
+        with mock.patch('ativo.icon_service.search_company_icon', return_value='https://exemplo.com/miss3.png'):
+            self.assertEqual(resolve_icons([ativo.pk]), 1)
+        ativo.refresh_from_db()
+        self.assertEqual(ativo.icone_url, 'https://exemplo.com/miss3.png')
+        self.assertEqual(ativo.instrumento.icone_url, 'https://exemplo.com/miss3.png')
+
+
+class InstrumentoTestCase(CarteiraTestCase):
+    def test_para_tickers_cria_uma_vez(self):
+        primeiro = Instrumento.para_tickers(['INST3', 'INST4'], 'BRL', {'INST3': 'Instrumento S.A.'})
+        self.assertEqual(primeiro['INST3'].nome, 'Instrumento S.A.')
+        self.assertEqual(primeiro['INST4'].nome, '')
+        # Existing rows are returned as they are, not renamed
+        segundo = Instrumento.para_tickers(['INST3'], 'BRL', {'INST3': 'Outro nome'})
+        self.assertEqual(segundo['INST3'].pk, primeiro['INST3'].pk)
+        self.assertEqual(segundo['INST3'].nome, 'Instrumento S.A.')
+        self.assertEqual(Instrumento.objects.filter(ticker__startswith='INST').count(), 2)
+
+    def test_save_liga_sem_copiar_o_nome_do_usuario(self):
+        ativo = self.criar_ativo('MEU3', nome='Minha aposta secreta')
+        self.assertEqual(ativo.instrumento.ticker, 'MEU3')
+        self.assertEqual(ativo.instrumento.nome, '')
+
+        outro = self.criar_ativo('MEU3', usuario=self.criar_usuario('bruno'), nome='Meu3')
+        self.assertEqual(outro.instrumento_id, ativo.instrumento_id)
+
+        # Changing moeda links the ativo to the instrument of the new market
+        outro.moeda = 'USD'
+        outro.save()
+        self.assertNotEqual(outro.instrumento_id, ativo.instrumento_id)
+        self.assertEqual(outro.instrumento.moeda, 'USD')
+
+
+class SnapshotsHistoricosTestCase(CarteiraTestCase):
+    def test_historico_buscado_uma_vez_por_instrumento(self):
+        outro = self.criar_usuario('bruno')
+        ativos = [self.criar_ativo('HIST3', preco='10'), self.criar_ativo('HIST3', usuario=outro)]
+        for ativo in ativos:
+            self.movimentar(ativo, date(2023, 12, 1), 10, 10)
+        fechamentos = pd.DataFrame({'Close': [10.0, 12.0]}, index=pd.to_datetime(['2023-12-29', '2024-01-31']))
+
+        with mock.patch('ativo.management.commands.create_historical_snapshots.yf.Ticker') as yahoo:
+            yahoo.return_value.history.return_value = fechamentos
+            call_command('create_historical_snapshots', '--all-users', '--start-date', '2024-01-01',
+                         '--end-date', '2024-02-01', stdout=io.StringIO())
+
+        # One request for the instrument, for both holders and both months
+        self.assertEqual(yahoo.return_value.history.call_count, 1)
+        precos = EvolucaoPatrimonial.objects.order_by('ativo_id', 'data').values_list('ativo_id', 'data', 'preco_atual')
+        self.assertEqual(list(precos), [
+            (ativos[0].pk, date(2024, 1, 1), Decimal('10.00')), (ativos[0].pk, date(2024, 2, 1), Decimal('12.00')),
+            (ativos[1].pk, date(2024, 1, 1), Decimal('10.00')), (ativos[1].pk, date(2024, 2, 1), Decimal('12.00')),
+        ])
+
+
+class SimboloTestCase(TestCase):
+    def setUp(self):
+        self.respostas = {}
+        self.chamadas = []
+
+    def buscar(self, simbolo):
+        self.chamadas.append(simbolo)
+        return self.respostas.get(simbolo)
+
+    def resolver(self):
+        self.chamadas = []
+        return com_simbolo('SIMB3', 'BRL', self.buscar)
+
+    def test_alternativo_e_reverificado(self):
+        # .SA answered empty (e.g. rate-limited) and the bare ticker answered
+        self.respostas = {'SIMB3': 'bare'}
+        self.assertEqual(self.resolver(), 'bare')
+        self.assertEqual(Instrumento.objects.get(ticker='SIMB3').yahoo_symbol, 'SIMB3')
+
+        self.respostas = {'SIMB3.SA': 'sa', 'SIMB3': 'bare'}
+        self.assertEqual(self.resolver(), 'bare')
+        self.assertEqual(self.chamadas, ['SIMB3'])
+
+        # Once the check is due the preferred symbol wins again
+        Instrumento.objects.filter(ticker='SIMB3').update(dataAlteracao=timezone.now() - timedelta(days=8))
+        self.assertEqual(self.resolver(), 'sa')
+        self.assertEqual(Instrumento.objects.get(ticker='SIMB3').yahoo_symbol, 'SIMB3.SA')
+
+    def test_simbolo_salvo_sem_resposta_e_resolvido_de_novo(self):
+        self.respostas = {'SIMB3.SA': 'sa'}
+        self.resolver()
+
+        # Nothing answers: the stored symbol is kept
+        self.respostas = {}
+        self.assertIsNone(self.resolver())
+        self.assertEqual(self.chamadas, ['SIMB3.SA', 'SIMB3'])
+        self.assertEqual(Instrumento.objects.get(ticker='SIMB3').yahoo_symbol, 'SIMB3.SA')
+
+        self.respostas = {'SIMB3': 'bare'}
+        self.assertEqual(self.resolver(), 'bare')
+        self.assertEqual(Instrumento.objects.get(ticker='SIMB3').yahoo_symbol, 'SIMB3')
+
+    async def test_versao_assincrona_busca_fora_do_event_loop(self):
+        self.respostas = {'SIMB3': 'bare'}
+        threads = []
+
+        def buscar(simbolo):
+            threads.append(threading.current_thread())
+            return self.buscar(simbolo)
+
+        self.assertEqual(await acom_simbolo('SIMB3', 'BRL', buscar), 'bare')
+        self.assertEqual(self.chamadas, ['SIMB3.SA', 'SIMB3'])
+        self.assertNotIn(threading.main_thread(), threads)
+        self.assertEqual(await Instrumento.objects.filter(ticker='SIMB3').values_list('yahoo_symbol', flat=True).aget(), 'SIMB3')
@@ -0,0 +1,85 @@
+import heapq
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from time import perf_counter
+
+# Per-request timing buckets for RequestTimingMiddleware. Context variables
+# follow the request into sync_to_async/asyncio.to_thread calls, so queries
+# and provider calls made there are still attributed to the right request.
+# Outside an instrumented request every hook below is a no-op.
+_current = ContextVar('request_timings', default=None)
+_open = ContextVar('request_timing_open', default=frozenset())
+
+
+class RequestTimings:
+    def __init__(self, top_queries: int = 5):
+        self.durations = defaultdict(float)
+        self.counts = defaultdict(int)
+        self.top_queries = top_queries
+        self._queries = []  # min-heap of (duration, sequence, sql)
+
+    def add(self, name: str, duration: float) -> None:
+        self.durations[name] += duration
+        self.counts[name] += 1
+
+    def add_query(self, sql: str, duration: float) -> None:
+        self.add('db', duration)
+        entry = (duration, self.counts['db'], sql)
+        if len(self._queries) < self.top_queries:
+            heapq.heappush(self._queries, entry)
+        else:
+            heapq.heappushpop(self._queries, entry)
+
+    def slowest_queries(self):
+        return [(duration, sql) for duration, _, sql in sorted(self._queries, reverse=True)]
+
+
+def start_request(top_queries: int = 5):
+    timings = RequestTimings(top_queries)
+    return timings, _current.set(timings)
+
+
+def end_request(token) -> None:
+    _current.reset(token)
+
+
+@contextmanager
+def measure(name: str):
+    """
+    Add the time spent in the block to the current request under `name`.
+    Nested blocks with the same name (a serializer inside a serializer)
+    are only counted once.
+    """
+    timings = _current.get()
+    open_names = _open.get()
+    if timings is None or name in open_names:
+        yield
+        return
+    token = _open.set(open_names | {name})
+    start = perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, perf_counter() - start)
+        _open.reset(token)
+
+
+def record_query(execute, sql, params, many, context):
+    """Database execute wrapper (see connection.execute_wrappers)."""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.add_query(sql, perf_counter() - start)
+
+
+class SerializerTimingMixin:
+    """Count time spent turning instances into data as "serializer" time."""
+
+    def to_representation(self, instance):
+        with measure('serializer'):
+            return super().to_representation(instance)
@@ -1,7 +1,9 @@
 from rest_framework.routers import DefaultRouter
 from django.urls import path, include
+from . import async_views
 from .views import (CategoriaViewSet, AtivoViewSet, MovimentacaoViewSet,
-                   DividendoViewSet, EvolucaoPatrimonialViewSet, SnapshotViewSet)
+                   DividendoViewSet, EvolucaoPatrimonialViewSet, SnapshotViewSet,
+                   DashboardViewSet, ChangesViewSet)
 
 router = DefaultRouter()
 router.register(r'categorias', CategoriaViewSet)
@@ -10,7 +12,12 @@ router.register(r'movimentacoes', MovimentacaoViewSet, basename='movimentacao')
 router.register(r'dividendos', DividendoViewSet, basename='dividendo')
 router.register(r'evolucao-patrimonial', EvolucaoPatrimonialViewSet, basename='evolucao-patrimonial')
 router.register(r'snapshots', SnapshotViewSet)
+router.register(r'dashboard', DashboardViewSet, basename='dashboard')
+router.register(r'changes', ChangesViewSet, basename='changes')
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('async/ativos/update_prices/', async_views.update_prices, name='async-ativo-update-prices'),
+    path('async/ativos/<int:pk>/update_price/', async_views.update_price, name='async-ativo-update-price'),
+    path('async/ativos/<int:pk>/create_snapshot/', async_views.create_snapshot, name='async-ativo-create-snapshot'),
 ]
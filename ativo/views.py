@@ -5,16 +5,29 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from .models import Categoria, Ativo, Movimentacao, Dividendo, EvolucaoPatrimonial, Snapshot
 from .serializers import CategoriaSerializer, AtivoSerializer, MovimentacaoSerializer, DividendoSerializer, EvolucaoPatrimonialSerializer, SnapshotSerializer
-from .services import create_snapshot, create_snapshots_for_all_assets
+from .services import create_snapshot, create_snapshots_for_all_assets, build_evolucao_series, build_dashboard, bulk_save_movimentacoes
+from .etag import VersaoETagMixin, etag_por_versao
+from .pagination import KeysetPagination
+from .search import IndexedSearchFilter, filtrar_por_ticker
+from .filters import filtrar_periodo
+from .export_service import export_dataset, EXPORT_FORMATS
+from .change_feed import build_change_feed
+from .returns_service import calcular_variacoes, calcular_xirr, serie_twr
+from .risk_service import calcular_risco
+from .income_service import resumo_proventos
+from .benchmark_service import comparar_benchmarks
+from .metrics import render_metrics
 from datetime import date
 from django.db import models
 from rest_framework.parsers import MultiPartParser, FormParser
+from django.http import StreamingHttpResponse, HttpResponse
+from django.conf import settings
 import pandas as pd
 from decimal import Decimal
 from django.contrib.auth import get_user_model
-import os
 from .management.commands.import_excel_data import import_movimentacoes_from_excel
 from .services import import_dividendos_from_excel
+import hmac
 import logging
 
 User = get_user_model()
@@ -22,6 +35,25 @@ logger = logging.getLogger(__name__)
 
 # Create your views here.
 
+class ExportMixin:
+    """
+    Adds a streaming ``export`` action (?file_format=csv|parquet) for the
+    dataset named by ``export_dataset_name``.
+    """
+    export_dataset_name = None
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        file_format = request.query_params.get('file_format', 'csv')
+        try:
+            content = export_dataset(self.export_dataset_name, request.user, file_format)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+        content_type, extension = EXPORT_FORMATS[file_format]
+        response = StreamingHttpResponse(content, content_type=content_type)
+        response['Content-Disposition'] = f'attachment; filename="{self.export_dataset_name}.{extension}"'
+        return response
+
 class CategoriaViewSet(viewsets.ModelViewSet):
     queryset = Categoria.objects.all()
     serializer_class = CategoriaSerializer
@@ -35,11 +67,12 @@ class CategoriaViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         return Categoria.objects.all()
 
-class AtivoViewSet(viewsets.ModelViewSet):
+class AtivoViewSet(VersaoETagMixin, viewsets.ModelViewSet):
     queryset = Ativo.objects.all()
     serializer_class = AtivoSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    filter_backends = [OrderingFilter, IndexedSearchFilter]
     search_fields = ['ticker', 'nome']
+    search_ativo_field = 'pk'
     ordering_fields = ['ticker', 'nome', 'moeda', 'dataCriacao', 'dataAlteracao']
     ordering = ['ticker']
     pagination_class = None
@@ -50,15 +83,30 @@ class AtivoViewSet(viewsets.ModelViewSet):
         This view should return a list of all ativos
         for the currently authenticated user.
         """
-        queryset = Ativo.objects.filter(usuario=self.request.user)
+        queryset = Ativo.objects.filter(usuario=self.request.user).select_related('categoria').com_icone_cache()
         
         # Filter by ticker if provided
         ticker = self.request.query_params.get('ticker')
         if ticker:
-            queryset = queryset.filter(ticker__icontains=ticker)
+            queryset = filtrar_por_ticker(queryset, self.request.user.pk, ticker)
             
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def variacoes(self, request):
+        """Price change of every ativo over each AtivoInfo horizon (day, month, year, 12-60m, all)."""
+        return Response(calcular_variacoes(request.user))
+
+    @action(detail=False, methods=['get'])
+    def risco(self, request):
+        """Volatility, max drawdown and beta vs IBOV per open position and portfolio, plus the correlation matrix."""
+        return Response(calcular_risco(request.user))
+
+    @action(detail=False, methods=['get'])
+    def xirr(self, request):
+        """Annualized money-weighted return (%) per ativo id and of the portfolio per currency."""
+        return Response(calcular_xirr(request.user))
+
     @action(detail=True, methods=['post'])
     def update_price(self, request, pk=None):
         """Update the current price and value of an asset."""
@@ -98,100 +146,156 @@ class AtivoViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
 
-class MovimentacaoViewSet(viewsets.ModelViewSet):
+class MovimentacaoViewSet(ExportMixin, VersaoETagMixin, viewsets.ModelViewSet):
     queryset = Movimentacao.objects.all()
     serializer_class = MovimentacaoSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    export_dataset_name = 'movimentacoes'
+    filter_backends = [OrderingFilter, IndexedSearchFilter]
     search_fields = ['ativo__ticker', 'operacao']
+    search_ativo_field = 'ativo_id'
+    search_exact_fields = ['operacao']
     ordering_fields = ['data', 'operacao', 'quantidade', 'valorUnitario', 'custoTotal', 'dataCriacao']
     ordering = ['-data', '-dataCriacao']
+    pagination_class = KeysetPagination
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = Movimentacao.objects.filter(ativo__usuario=self.request.user)
+        queryset = Movimentacao.objects.filter(usuario=self.request.user)
         
-        # Filter by year if provided
-        year = self.request.query_params.get('year')
-        if year:
-            try:
-                year = int(year)
-                queryset = queryset.filter(data__year=year)
-            except ValueError:
-                pass
+        # Filter by ?year=, ?month= or ?start=/?end= as date ranges
+        queryset = filtrar_periodo(queryset, self.request.query_params)
         
         # Filter by ticker if provided
         ticker = self.request.query_params.get('ticker')
         if ticker:
-            queryset = queryset.filter(ativo__ticker__icontains=ticker)
+            queryset = filtrar_por_ticker(queryset, self.request.user.pk, ticker, 'ativo_id')
         
         return queryset
 
+    @action(detail=False, methods=['post'])
+    def bulk(self, request):
+        """
+        Create or update many movimentacoes in one request.
+        Expects a list; items with an "id" update that movimentacao. Invalid
+        items, and items the database rejects, are reported by index and do
+        not prevent the others from saving.
+        """
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a list of movimentacoes.'}, status=400)
+
+        ativos = {ativo.pk: ativo for ativo in Ativo.objects.filter(usuario=request.user).select_related('categoria')}
+        ids = []
+        for item in items:
+            try:
+                ids.append(int(item['id']))
+            except (TypeError, KeyError, ValueError):
+                pass
+        existentes = {
+            mov.pk: mov
+            for mov in Movimentacao.objects.filter(usuario=request.user, pk__in=ids).select_related('ativo')
+        }
+        context = {**self.get_serializer_context(), 'ativos': ativos}
+
+        novas, alteradas, ativos_anteriores, errors = [], [], [], []
+        indices_novas, indices_alteradas = [], []
+        for index, item in enumerate(items):
+            if not isinstance(item, dict):
+                errors.append({'index': index, 'errors': {'non_field_errors': ['Invalid data.']}})
+                continue
+            instance = None
+            if item.get('id') is not None:
+                try:
+                    instance = existentes.get(int(item['id']))
+                except (TypeError, ValueError):
+                    pass
+                if instance is None:
+                    errors.append({'index': index, 'errors': {'id': ['Movimentação não encontrada.']}})
+                    continue
+            serializer = self.get_serializer(instance, data=item, partial=instance is not None, context=context)
+            if not serializer.is_valid():
+                errors.append({'index': index, 'errors': serializer.errors})
+                continue
+            if instance is None:
+                novas.append(Movimentacao(**serializer.validated_data))
+                indices_novas.append(index)
+            else:
+                indices_alteradas.append(index)
+                ativos_anteriores.append(instance.ativo_id)
+                for field, value in serializer.validated_data.items():
+                    setattr(instance, field, value)
+                alteradas.append(instance)
+
+        falhas = bulk_save_movimentacoes(novas, alteradas, ativos_anteriores)
+        salvas = []
+        for posicao, (index, mov) in enumerate(zip(indices_novas + indices_alteradas, novas + alteradas)):
+            if posicao in falhas:
+                errors.append({'index': index, 'errors': {'non_field_errors': [falhas[posicao]]}})
+            else:
+                salvas.append(mov)
+        errors.sort(key=lambda erro: erro['index'])
+        return Response({
+            'created': len(novas) - sum(1 for posicao in falhas if posicao < len(novas)),
+            'updated': len(alteradas) - sum(1 for posicao in falhas if posicao >= len(novas)),
+            'errors': errors,
+            'results': self.get_serializer(salvas, many=True, context=context).data,
+        })
+
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def import_excel(self, request):
-        """Import movimentacoes from an uploaded XLSX file."""
+        """Import movimentacoes from an uploaded XLSX or CSV file."""
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({'error': 'No file uploaded.'}, status=400)
         user = request.user
         try:
-            # Save uploaded file temporarily
-            temp_path = f'/tmp/{file_obj.name}'
-            with open(temp_path, 'wb+') as temp_file:
-                for chunk in file_obj.chunks():
-                    temp_file.write(chunk)
-            # Use the shared import logic
-            summary = import_movimentacoes_from_excel(temp_path, user)
-            os.remove(temp_path)
+            # Read straight from the upload stream, chunk by chunk
+            summary = import_movimentacoes_from_excel(file_obj, user, nome_arquivo=file_obj.name)
             if summary['errors']:
                 return Response({'message': f"{summary['created_movimentacoes']} movimentações importadas, {len(summary['errors'])} erros.", 'errors': summary['errors']})
             return Response({'message': f"{summary['created_movimentacoes']} movimentações importadas com sucesso."})
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
-class DividendoViewSet(viewsets.ModelViewSet):
+class DividendoViewSet(ExportMixin, VersaoETagMixin, viewsets.ModelViewSet):
     serializer_class = DividendoSerializer
-    filter_backends = [SearchFilter, OrderingFilter]
+    export_dataset_name = 'dividendos'
+    filter_backends = [OrderingFilter, IndexedSearchFilter]
     search_fields = ['ativo__ticker']
+    search_ativo_field = 'ativo_id'
     ordering_fields = ['data', 'valor', 'dataCriacao']
     ordering = ['-data', '-dataCriacao']
+    pagination_class = KeysetPagination
 
     def get_queryset(self):
-        queryset = Dividendo.objects.filter(ativo__usuario=self.request.user)
+        queryset = Dividendo.objects.filter(usuario=self.request.user)
         
-        # Filter by year if provided
-        year = self.request.query_params.get('year')
-        if year:
-            try:
-                year = int(year)
-                queryset = queryset.filter(data__year=year)
-            except ValueError:
-                pass
+        # Filter by ?year=, ?month= or ?start=/?end= as date ranges
+        queryset = filtrar_periodo(queryset, self.request.query_params)
         
         # Filter by ticker if provided
         ticker = self.request.query_params.get('ticker')
         if ticker:
-            queryset = queryset.filter(ativo__ticker__icontains=ticker)
+            queryset = filtrar_por_ticker(queryset, self.request.user.pk, ticker, 'ativo_id')
         
         return queryset
 
+    @action(detail=False, methods=['get'])
+    def resumo(self, request):
+        """Monthly/yearly income per currency, ticker and categoria, trailing 12m yields and a 12-month projection."""
+        return Response(resumo_proventos(request.user))
+
     @action(detail=False, methods=['post'], parser_classes=[MultiPartParser, FormParser])
     def import_excel(self, request):
-        """Import dividendos from an uploaded XLSX file."""
+        """Import dividendos from an uploaded XLSX or CSV file."""
         file_obj = request.FILES.get('file')
         if not file_obj:
             return Response({'error': 'No file uploaded.'}, status=400)
         
         user = request.user
         try:
-            # Save uploaded file temporarily
-            temp_path = f'/tmp/{file_obj.name}'
-            with open(temp_path, 'wb+') as temp_file:
-                for chunk in file_obj.chunks():
-                    temp_file.write(chunk)
-            
-            # Use the import logic from services
-            summary = import_dividendos_from_excel(temp_path, user)
-            os.remove(temp_path)
+            # Read straight from the upload stream, chunk by chunk
+            summary = import_dividendos_from_excel(file_obj, user, nome_arquivo=file_obj.name)
             
             if summary['errors']:
                 return Response({
@@ -205,9 +309,10 @@ class DividendoViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
-class EvolucaoPatrimonialViewSet(viewsets.ModelViewSet):
+class EvolucaoPatrimonialViewSet(ExportMixin, VersaoETagMixin, viewsets.ModelViewSet):
     queryset = EvolucaoPatrimonial.objects.all()
     serializer_class = EvolucaoPatrimonialSerializer
+    export_dataset_name = 'evolucao'
     filter_backends = [SearchFilter, OrderingFilter]
     search_fields = ['ativo__ticker']
     ordering_fields = ['data', 'valor_total']
@@ -215,7 +320,8 @@ class EvolucaoPatrimonialViewSet(viewsets.ModelViewSet):
     pagination_class = None
     
     def get_queryset(self):
-        return EvolucaoPatrimonial.objects.filter(ativo__usuario=self.request.user)
+        queryset = EvolucaoPatrimonial.objects.filter(ativo__usuario=self.request.user)
+        return filtrar_periodo(queryset, self.request.query_params)
     
     @action(detail=False, methods=['post'])
     def create_snapshots(self, request):
@@ -255,6 +361,70 @@ class EvolucaoPatrimonialViewSet(viewsets.ModelViewSet):
             return Response({'error': str(e)}, status=400)
     
     @action(detail=False, methods=['get'])
+    @etag_por_versao
+    def series(self, request):
+        """
+        Columnar time series for charts: dates[] plus valores[], custos[] and
+        dividendos[] arrays, optionally per ticker/categoria/subtipo (?group_by=).
+        Accepts ?start=YYYY-MM-DD, ?end=YYYY-MM-DD and ?moeda= (default BRL).
+        """
+        try:
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            return Response(build_evolucao_series(
+                self.request.user,
+                group_by=request.query_params.get('group_by') or None,
+                start=date.fromisoformat(start) if start else None,
+                end=date.fromisoformat(end) if end else None,
+                moeda=request.query_params.get('moeda', 'BRL'),
+            ))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+    @action(detail=False, methods=['get'])
+    @etag_por_versao
+    def twr(self, request):
+        """
+        Time-weighted return per currency: monthly, cumulative and trailing
+        12-month series (%) aligned with dates[], contributions neutralized.
+        Accepts ?start=YYYY-MM-DD and ?end=YYYY-MM-DD.
+        """
+        try:
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            return Response(serie_twr(
+                self.request.user,
+                start=date.fromisoformat(start) if start else None,
+                end=date.fromisoformat(end) if end else None,
+            ))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+    @action(detail=False, methods=['get'])
+    def benchmark(self, request):
+        """
+        Cumulative return (%) of the portfolio, or of one ativo with ?ativo=<id>,
+        next to benchmark indices (?indices=CDI,IBOV,IPCA), aligned with dates[].
+        Accepts ?start=YYYY-MM-DD, ?end=YYYY-MM-DD and ?moeda= (default BRL).
+        """
+        try:
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            ativo = request.query_params.get('ativo')
+            indices = request.query_params.get('indices', 'CDI,IBOV,IPCA')
+            return Response(comparar_benchmarks(
+                self.request.user,
+                [indice.strip().upper() for indice in indices.split(',') if indice.strip()],
+                start=date.fromisoformat(start) if start else None,
+                end=date.fromisoformat(end) if end else None,
+                ativo_id=int(ativo) if ativo else None,
+                moeda=request.query_params.get('moeda', 'BRL'),
+            ))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=400)
+
+    @action(detail=False, methods=['get'])
+    @etag_por_versao
     def monthly_summary(self, request):
         """Get summary of monthly snapshots grouped by month."""
         try:
@@ -287,10 +457,57 @@ class EvolucaoPatrimonialViewSet(viewsets.ModelViewSet):
         except Exception as e:
             return Response({'error': str(e)}, status=400)
 
-class SnapshotViewSet(viewsets.ModelViewSet):
+class SnapshotViewSet(ExportMixin, viewsets.ModelViewSet):
     queryset = Snapshot.objects.all()
     serializer_class = SnapshotSerializer
+    export_dataset_name = 'snapshots'
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         return Snapshot.objects.filter(ativo__usuario=self.request.user)
+
+class DashboardViewSet(viewsets.ViewSet):
+    """Server-side dashboard aggregates for the current user."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    @etag_por_versao
+    def list(self, request):
+        return Response(build_dashboard(request.user))
+
+
+class ChangesViewSet(viewsets.ViewSet):
+    """
+    Incremental change feed: ``?since=<token>`` returns only what was created,
+    updated or deleted after the token was issued, plus a new token.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def list(self, request):
+        try:
+            feed = build_change_feed(request.user, request.query_params.get('since'))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(feed)
+
+
+def metrics_autorizado(request) -> bool:
+    config = settings.METRICS
+    if config['TOKEN']:
+        esperado = f"Bearer {config['TOKEN']}"
+        if hmac.compare_digest(request.META.get('HTTP_AUTHORIZATION', ''), esperado):
+            return True
+    return request.META.get('REMOTE_ADDR') in config['ALLOWED_IPS']
+
+
+def metrics(request):
+    """
+    Prometheus scrape endpoint (text exposition format), restricted to the
+    addresses and token in settings.METRICS.
+    """
+    if not metrics_autorizado(request):
+        return HttpResponse('Forbidden', status=403, content_type='text/plain')
+    try:
+        body, content_type = render_metrics()
+    except RuntimeError as e:
+        return HttpResponse(str(e), status=503, content_type='text/plain')
+    return HttpResponse(body, content_type=content_type)
@@ -106,6 +106,46 @@ export type Ativo = {
   preco_atual: number;
 }
 
+// Risk over the last year of daily prices (volatility and drawdown in %); null without enough history
+export type RiscoMetricas = {
+  volatilidade: number | null;
+  max_drawdown: number | null;
+  beta: number | null;
+};
+
+export type Risco = {
+  data: string;
+  ativos: (RiscoMetricas & { ativo_id: number; ticker: string; moeda: string; peso: number | null; observacoes: number })[];
+  carteira: Record<string, RiscoMetricas>;
+  correlacao: { tickers: string[]; matriz: (number | null)[][] };
+};
+
+// Annualized money-weighted return (%) per ativo id and per currency; null when undefined
+export type Xirr = {
+  ativos: Record<number, number | null>;
+  carteira: Record<string, number | null>;
+};
+
+// Percent price changes per horizon (ativo/types.py:AtivoInfo); null without enough history
+export type AtivoInfo = {
+  ticker: string;
+  nome: string;
+  tipo: string;
+  moeda: string;
+  preco_atual: number | null;
+  variacao_dia: number | null;
+  variacao_mes: number | null;
+  variacao_ano: number | null;
+  variacao_12m: number | null;
+  variacao_24m: number | null;
+  variacao_36m: number | null;
+  variacao_48m: number | null;
+  variacao_60m: number | null;
+  variacao_todas: number | null;
+  ultima_atualizacao: string | null;
+  fonte: string | null;
+}
+
 type PaginatedResponse<T> = {
   count: number;
   next: string | null;
@@ -113,6 +153,24 @@ type PaginatedResponse<T> = {
   results: T[];
 }
 
+// Keyset pagination (?cursor=): no total count, constant cost per page
+export type CursorPaginatedResponse<T> = {
+  next: string | null;
+  results: T[];
+}
+
+const buildCursorUrl = (resource: string, cursor?: string, pageSize?: number, year?: number, ticker?: string) => {
+  const params = new URLSearchParams();
+  params.append('cursor', cursor ?? '');
+  if (pageSize) params.append('page_size', pageSize.toString());
+  if (year) params.append('year', year.toString());
+  if (ticker) params.append('ticker', ticker);
+  return `/${resource}/?${params.toString()}`;
+};
+
+// `next` links are absolute; strip the base URL so the api instance can reuse them
+const relativeUrl = (url: string) => url.replace('http://localhost:8000/api', '');
+
 export const categoriaService = {
   getAll: () => api.get<Categoria[]>('/categorias/'),
   getById: (id: number) => api.get<Categoria>(`/categorias/${id}/`),
@@ -138,6 +196,9 @@ export const ativoService = {
   update: (id: number, data: Partial<Ativo>) => api.put<Ativo>(`/ativos/${id}/`, data),
   delete: (id: number) => api.delete(`/ativos/${id}/`),
   updatePrice: (id: number) => api.post<Ativo>(`/ativos/${id}/update_price/`),
+  getVariacoes: () => api.get<AtivoInfo[]>('/ativos/variacoes/'),
+  getXirr: () => api.get<Xirr>('/ativos/xirr/'),
+  getRisco: () => api.get<Risco>('/ativos/risco/'),
 };
 
 export type Movimentacao = {
@@ -168,6 +229,9 @@ export const movimentacaoService = {
     
     return api.get<PaginatedResponse<Movimentacao>>(url);
   },
+  getByCursor: (cursor?: string, pageSize?: number, year?: number, ticker?: string) =>
+    api.get<CursorPaginatedResponse<Movimentacao>>(buildCursorUrl('movimentacoes', cursor, pageSize, year, ticker)),
+  getNext: (next: string) => api.get<CursorPaginatedResponse<Movimentacao>>(relativeUrl(next)),
   getById: (id: number) => api.get<Movimentacao>(`/movimentacoes/${id}/`),
   create: (data: any) => api.post<Movimentacao>('/movimentacoes/', data),
   update: (id: number, data: any) => api.put<Movimentacao>(`/movimentacoes/${id}/`, data),
@@ -184,6 +248,28 @@ export type Dividendo = {
   dataAlteracao: string;
 };
 
+// Columnar income totals aligned with meses/anos: one array per currency, per ticker and per categoria subtipo within each currency
+export type TotaisProventos = {
+  moedas: Record<string, number[]>;
+  ativos: Record<string, number[]>;
+  categorias: Record<string, Record<string, number[]>>;
+};
+
+export type ResumoProventos = {
+  mensal: TotaisProventos & { meses: string[] };
+  anual: TotaisProventos & { anos: number[] };
+  ativos: {
+    ativo_id: number;
+    ticker: string;
+    moeda: string;
+    ultimos_12m: number;
+    yield_on_cost: number | null;
+    yield_mercado: number | null;
+    projecao_12m: number;
+  }[];
+  projecao: { meses: string[]; moedas: Record<string, number[]> };
+};
+
 export const dividendoService = {
   getAll: (page?: number, pageSize?: number, year?: number, ticker?: string) => {
     const params = new URLSearchParams();
@@ -197,10 +283,64 @@ export const dividendoService = {
     
     return api.get<PaginatedResponse<Dividendo>>(url);
   },
+  getByCursor: (cursor?: string, pageSize?: number, year?: number, ticker?: string) =>
+    api.get<CursorPaginatedResponse<Dividendo>>(buildCursorUrl('dividendos', cursor, pageSize, year, ticker)),
+  getNext: (next: string) => api.get<CursorPaginatedResponse<Dividendo>>(relativeUrl(next)),
   getById: (id: number) => api.get<Dividendo>(`/dividendos/${id}/`),
   create: (data: any) => api.post<Dividendo>('/dividendos/', data),
   update: (id: number, data: any) => api.put<Dividendo>(`/dividendos/${id}/`, data),
   delete: (id: number) => api.delete(`/dividendos/${id}/`),
+  getResumo: () => api.get<ResumoProventos>('/dividendos/resumo/'),
+};
+
+export type DashboardMoeda = {
+  total_investido: number;
+  valor_atual: number;
+  lucro_prejuizo: number;
+  rendimento_percentual: number;
+  peso_total: number;
+  count_ativos: number;
+  count_em_carteira: number;
+  count_preco_estimado: number;
+  alocacao: { tipo: string; subtipo: string; valor_atual: number; total_investido: number; percentual: number; peso_alvo: number }[];
+  pesos: { ticker: string; peso_alvo: number; peso_atual: number; diferenca: number }[];
+  melhores: { ticker: string; rendimento_percentual: number; lucro_prejuizo: number }[];
+  piores: { ticker: string; rendimento_percentual: number; lucro_prejuizo: number }[];
+  dividendos: { total: number; ultimos_12_meses: number; ano_atual: number };
+};
+
+export const dashboardService = {
+  get: () => api.get<{ moedas: { [moeda: string]: DashboardMoeda } }>('/dashboard/'),
+};
+
+export type Snapshot = {
+  id: number;
+  ativo: number;
+  ativo_nome: string;
+  ativo_ticker: string;
+  data: string;
+  preco: number;
+  quantidade: number;
+  valor_total: number;
+  is_preco_estimado: boolean;
+  moeda: string;
+  dataCriacao: string;
+  dataAlteracao: string;
+};
+
+export type ChangeSet<T> = { upserted: T[]; deleted: number[] };
+
+export type ChangeFeed = {
+  token: string;
+  reset: boolean;
+  ativos: ChangeSet<Ativo>;
+  movimentacoes: ChangeSet<Movimentacao>;
+  dividendos: ChangeSet<Dividendo>;
+  snapshots: ChangeSet<Snapshot>;
+};
+
+export const changesService = {
+  get: (since?: string) => api.get<ChangeFeed>('/changes/', { params: since ? { since } : {} }),
 };
 
 export default api; 
\ No newline at end of file
@@ -45,4 +45,40 @@ export interface MonthlyGroup {
     count_ativos: number;
     ativos: EvolucaoPatrimonial[];
     isExpanded: boolean;
-} 
\ No newline at end of file
+} 
+
+export interface EvolucaoSeriesColumns {
+    valores: number[];
+    custos: number[];
+    dividendos: number[];
+}
+
+// Response of /evolucao-patrimonial/series/?moeda= (arrays aligned with `dates`, one currency)
+export interface EvolucaoSeries extends EvolucaoSeriesColumns {
+    moeda: string;
+    dates: string[];
+    group_by?: 'ticker' | 'categoria' | 'subtipo';
+    keys?: string[];
+    series?: {
+        [key: string]: EvolucaoSeriesColumns;
+    };
+}
+
+// Response of /evolucao-patrimonial/twr/: per currency, percent arrays aligned with `dates`
+export interface TwrSeries {
+    [moeda: string]: {
+        dates: string[];
+        retornos: (number | null)[];
+        acumulado: (number | null)[];
+        rolling_12m: (number | null)[];
+    };
+}
+
+// Response of /evolucao-patrimonial/benchmark/: cumulative % since the first date, aligned with `dates`
+export interface BenchmarkComparison {
+    dates: string[];
+    carteira: (number | null)[];
+    benchmarks: {
+        [indice: string]: (number | null)[];
+    };
+}
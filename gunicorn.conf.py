@@ -0,0 +1,13 @@
+# Gunicorn reads this file automatically when started from the project root.
+# With PROMETHEUS_MULTIPROC_DIR set, workers share metrics through files in that
+# directory; a worker's files must be marked dead when it exits so its live
+# samples stop being reported (counters and histograms are kept).
+try:
+    from prometheus_client import multiprocess
+except ImportError:
+    multiprocess = None
+
+
+def child_exit(server, worker):
+    if multiprocess is not None:
+        multiprocess.mark_process_dead(worker.pid)
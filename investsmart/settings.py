@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 from datetime import timedelta
 
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'ativo.middleware.RequestTimingMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -184,3 +186,19 @@ SIMPLE_JWT = {
     'TOKEN_TYPE_CLAIM': 'token_type',
     'JTI_CLAIM': 'jti',
 }
+
+# Per-request SQL/provider/serializer timings (Server-Timing header + slow request log).
+# Off unless REQUEST_TIMING=1 is set in the environment.
+REQUEST_TIMING = {
+    'ENABLED': os.environ.get('REQUEST_TIMING') == '1',
+    'SLOW_REQUEST_MS': 500,
+    'TOP_QUERIES': 5,
+}
+
+# Who may scrape /metrics: clients whose address is listed, or that send
+# "Authorization: Bearer <METRICS_TOKEN>" when a token is configured.
+# REMOTE_ADDR is used as is; behind a proxy, set a token instead.
+METRICS = {
+    'ALLOWED_IPS': [ip.strip() for ip in os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',') if ip.strip()],
+    'TOKEN': os.environ.get('METRICS_TOKEN', ''),
+}